@@ -0,0 +1,117 @@
+"""
+API 客户端压测：在本地 DashScope 兼容服务（src/mock_server.py）上注入延迟、429、5xx 和挂起，
+对比不同重试配置下的客户端失败率、重试次数、延迟分位数和吞吐。
+
+模拟服务对每个成功请求都返回合法的 bbox，因此这里统计到的失败全部来自客户端和传输层；
+理想情况下开启重试后 client_error_rate 应接近 0，即失败率只反映模型本身。
+
+    python3 -m benchmarks.api_load --tasks 500 --workers 32 --throttle-rate 0.1 --error-rate 0.05
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from data.generate_data import iter_mock_samples, render_mock_ui
+from src.api_client import DashScopeClient
+from src.concurrency import run_concurrent
+from src.grounding_model import UIGroundingModel
+from src.image_io import ImageHandle
+from src.instrumentation import Instrumentation
+from src.mock_server import MockDashScopeServer
+from src.resilience import CircuitBreaker, RetryPolicy
+
+# 对比的客户端配置：(名称, 最大重试次数, 熔断阈值)
+CONFIGS = (
+    ("no_retry", 0, 0),
+    ("retry", 3, 0),
+    ("retry_breaker", 3, 10),
+)
+
+
+def run_load(base_url, tasks, workers, max_retries, breaker_threshold, timeout, base_delay):
+    instrumentation = Instrumentation()
+    client = DashScopeClient(
+        "mock-key",
+        base_url=base_url,
+        timeout=timeout,
+        retry=RetryPolicy(max_retries=max_retries, base_delay=base_delay),
+        breaker=CircuitBreaker(breaker_threshold, reset_timeout=2.0) if breaker_threshold > 0 else None,
+        instrumentation=instrumentation,
+    )
+    model = UIGroundingModel(mode="api", api_client=client, instrumentation=instrumentation)
+
+    def _predict(task):
+        image, instruction = task
+        start = time.perf_counter()
+        thought, _ = model.predict(image, instruction)
+        return thought, time.perf_counter() - start
+
+    start = time.perf_counter()
+    outcomes = [result for _, result in run_concurrent(_predict, tasks, max_workers=workers)]
+    wall = time.perf_counter() - start
+
+    latencies = np.asarray([latency for _, latency in outcomes]) * 1000
+    errors = sum(1 for thought, _ in outcomes if thought.startswith(("API Error", "API Exception")))
+    counters = instrumentation.summary()["counters"]
+    return {
+        "tasks": len(outcomes),
+        "client_error_rate": round(errors / len(outcomes), 4),
+        "tasks_per_sec": round(len(outcomes) / wall, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "retries": counters.get("api_retry", 0),
+        "timeouts": counters.get("api_timeout", 0),
+        "circuit_open": counters.get("circuit_open", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API 客户端压测（本地模拟服务 + 故障注入）")
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.1)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--hang-rate", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=1.0, help="客户端单次请求超时（秒）")
+    parser.add_argument("--base-delay", type=float, default=0.2, help="退避的基础延迟（秒）")
+    parser.add_argument("--configs", nargs="+", choices=[name for name, _, _ in CONFIGS],
+                        default=[name for name, _, _ in CONFIGS])
+    args = parser.parse_args()
+
+    # 少量不同的截图循环复用，请求体大小与真实评估相当
+    images = []
+    for sample in iter_mock_samples(16, seed=0):
+        images.append((ImageHandle.from_image(render_mock_ui(sample, 500, 800)), sample["instruction"]))
+    tasks = [images[i % len(images)] for i in range(args.tasks)]
+
+    report = {"server": vars(args), "runs": {}}
+    for name, max_retries, breaker_threshold in CONFIGS:
+        if name not in args.configs:
+            continue
+        server = MockDashScopeServer(
+            latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms,
+            throttle_rate=args.throttle_rate, retry_after=args.retry_after, error_rate=args.error_rate,
+            hang_rate=args.hang_rate, hang_seconds=args.timeout * 3,
+        )
+        base_url = server.start()
+        try:
+            result = run_load(base_url, tasks, args.workers, max_retries, breaker_threshold,
+                              args.timeout, args.base_delay)
+        finally:
+            server.stop()
+        result["server_status"] = {str(k): v for k, v in sorted(server.stats.items())}
+        report["runs"][name] = result
+        print(f"[{name}] client_error_rate={result['client_error_rate']:.2%} "
+              f"{result['tasks_per_sec']} tasks/s", flush=True)
+
+    print(json.dumps(report, ensure_ascii=False, indent=4))
+
+
+if __name__ == "__main__":
+    main()
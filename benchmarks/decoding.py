@@ -0,0 +1,98 @@
+"""
+本地模式解码方式基准：在同一数据集上依次以 full（完整 CoT）、early_stop（输出完整 BBox 后停止）
+和 coords（只输出坐标、按文法约束解码）运行本地模型，对比每个任务的延迟、生成 token 数和定位精度。
+
+需要本地模型权重及 torch / transformers / qwen_vl_utils；不读写预测缓存，每种模式都真实推理。
+
+    python3 -m benchmarks.decoding --model Qwen/Qwen2-VL-2B-Instruct --dataset data/dataset.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from src.backends import DECODING_MODES
+from src.dataset import open_dataset
+from src.grounding_model import UIGroundingModel
+from src.image_io import ImageHandle
+from src.instrumentation import Instrumentation
+from src.metrics import format_table, instruction_types, score, to_bbox_array
+from src.preprocess import Preprocessor
+
+
+def run_mode(model_path, dataset, decoding, preprocessor=None, warmup=1):
+    """
+    以指定解码模式逐条推理 dataset，返回 (统计, 定位指标)。
+    前 warmup 条只用于预热（首次调用包含算子初始化），不计入统计。
+    """
+    instrumentation = Instrumentation()
+    model = UIGroundingModel(
+        mode="local", model_path=model_path, preprocessor=preprocessor, decoding=decoding,
+        instrumentation=instrumentation,
+    )
+    if model.mode != "local":
+        raise SystemExit("本地模型依赖未安装，无法运行解码基准")
+
+    for item in dataset[:warmup]:
+        model.predict(ImageHandle(item["image_path"]), item["instruction"])
+    model.instrumentation = instrumentation = Instrumentation()
+
+    latencies = []
+    results = []
+    for item in dataset:
+        start = time.perf_counter()
+        _, bbox = model.predict(ImageHandle(item["image_path"]), item["instruction"])
+        latencies.append(time.perf_counter() - start)
+        results.append({"instruction": item["instruction"], "pred_bbox": bbox, "gt_bbox": item["bbox"]})
+
+    latencies = np.asarray(latencies) * 1000
+    values = instrumentation.summary()["values"]
+    stats = {
+        "tasks": len(results),
+        "mean_ms": round(float(latencies.mean()), 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "mean_output_tokens": values.get("output_tokens", {}).get("mean"),
+        "mean_input_tokens": values.get("input_tokens", {}).get("mean"),
+    }
+    report = score(
+        to_bbox_array([r["pred_bbox"] for r in results]),
+        to_bbox_array([r["gt_bbox"] for r in results]),
+        instruction_types(results),
+    )
+    return stats, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模式解码方式基准（full / early_stop / coords）")
+    parser.add_argument("--model", required=True, help="本地模型权重路径")
+    parser.add_argument("--dataset", default="data/dataset.json")
+    parser.add_argument("--modes", nargs="+", choices=DECODING_MODES, default=list(DECODING_MODES))
+    parser.add_argument("--limit", type=int, default=None, help="只使用前 N 个任务")
+    parser.add_argument("--max-pixels", type=int, default=None, help="推理前把图像缩放到该像素预算以内")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", default=None, help="把 JSON 结果写入该文件")
+    args = parser.parse_args()
+
+    dataset = list(open_dataset(args.dataset))[: args.limit]
+    preprocessor = Preprocessor(max_pixels=args.max_pixels) if args.max_pixels else None
+
+    runs = {}
+    reports = {}
+    for decoding in args.modes:
+        stats, report = run_mode(args.model, dataset, decoding, preprocessor, args.warmup)
+        runs[decoding] = {"stats": stats, "overall": report["overall"]}
+        reports[decoding] = report
+        print(f"[{decoding}] {stats['mean_ms']} ms/task, {stats['mean_output_tokens']} output tokens/task", flush=True)
+
+    print("\n" + format_table(reports))
+    output = json.dumps({"model": args.model, "dataset": args.dataset, "runs": runs}, ensure_ascii=False, indent=4)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+响应解析器基准：对比 src.parser 的预编译单遍解析器与原先 _parse_response 的实现。
+
+先在随机生成的语料（正常 CoT 输出、像素坐标、多次自我修正、中文冒号、嵌套括号和随机噪声）上
+逐条校验两者结果一致，再分别计时。
+
+    python3 -m benchmarks.parser --num 100000 --cot-length 2000
+"""
+import argparse
+import json
+import random
+import re
+import time
+
+from src.parser import parse_many, parse_response
+
+
+def legacy_parse_response(response, width, height):
+    """原 UIGroundingModel._parse_response 的实现，仅作为基准对照和一致性校验使用。"""
+    FLOAT_RE = r"[-+]?(?:\d*\.\d+|\d+)(?:[eE][-+]?\d+)?"
+
+    def _normalize_bbox_if_needed(bbox):
+        if any(v > 1.1 for v in bbox):
+            bbox = [
+                bbox[0] / width,
+                bbox[1] / height,
+                bbox[2] / width,
+                bbox[3] / height,
+            ]
+        bbox = [max(0.0, min(1.0, float(v))) for v in bbox]
+        return [round(v, 3) for v in bbox]
+
+    def _is_valid_bbox(bbox):
+        if not isinstance(bbox, (list, tuple)) or len(bbox) != 4:
+            return False
+        x1, y1, x2, y2 = bbox
+        if not (0.0 <= x1 <= 1.0 and 0.0 <= y1 <= 1.0 and 0.0 <= x2 <= 1.0 and 0.0 <= y2 <= 1.0):
+            return False
+        return (x2 > x1) and (y2 > y1)
+
+    def _extract_candidate_bboxes(text):
+        candidates = []
+        for m in re.finditer(r"BBox\s*[:：]\s*\[([^\]]+)\]", text, flags=re.I):
+            nums = re.findall(FLOAT_RE, m.group(1))
+            if len(nums) >= 4:
+                try:
+                    bbox = [float(n) for n in nums[:4]]
+                    candidates.append(bbox)
+                except Exception:
+                    pass
+        if not candidates:
+            for m in re.finditer(r"\[([^\]]+)\]", text):
+                nums = re.findall(FLOAT_RE, m.group(1))
+                if len(nums) == 4:
+                    try:
+                        bbox = [float(n) for n in nums]
+                        candidates.append(bbox)
+                    except Exception:
+                        pass
+        return candidates
+
+    try:
+        thought_match = re.search(r"Thought\s*[:：]\s*(.*)", response, re.S | re.I)
+        thought = thought_match.group(1).split("BBox:")[0].strip() if thought_match else ""
+        candidates = _extract_candidate_bboxes(response)
+        for raw_bbox in reversed(candidates):
+            bbox = _normalize_bbox_if_needed(raw_bbox)
+            if _is_valid_bbox(bbox):
+                return thought, bbox
+        return thought, [0, 0, 0, 0]
+    except Exception as e:
+        print(f"解析失败: {e}, 原始输出: {response}")
+        return "解析失败", [0, 0, 0, 0]
+
+
+_FILLER = (
+    "界面顶部是状态栏，主体为浅灰色背景。", "The layout contains a header, a sidebar and a footer. ",
+    "候选元素包括按钮 [提交] 和输入框。", "Comparing regions [0.1, 0.2] and [left, right]. ",
+    "坐标估计约为 (120, 340)。", "Step 2: the target looks like an icon in the top-right corner. ",
+)
+
+
+def _random_bbox(rng, width, height):
+    if rng.random() < 0.3:
+        x1, y1 = rng.uniform(0, width * 0.8), rng.uniform(0, height * 0.8)
+        return [round(x1, 1), round(y1, 1), round(x1 + rng.uniform(1, 200), 1), round(y1 + rng.uniform(1, 80), 1)]
+    x1, y1 = rng.uniform(0, 0.8), rng.uniform(0, 0.8)
+    return [round(x1, 3), round(y1, 3), round(x1 + rng.uniform(-0.05, 0.2), 3), round(y1 + rng.uniform(-0.05, 0.2), 3)]
+
+
+def make_response(rng, cot_length, width, height):
+    """生成一条模拟模型输出。"""
+    kind = rng.random()
+    if kind < 0.05:
+        # 随机噪声，覆盖各种边界情况
+        alphabet = ["BBox", "bbox:", "：", ":", "[", "]", "Thought:", " ", ",", "0.5", "12", "1e3", "-3", "x", "\n"]
+        return "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 60)))
+
+    parts = [rng.choice(["Thought: ", "thought：", "思考: ", ""])]
+    while sum(map(len, parts)) < cot_length:
+        parts.append(rng.choice(_FILLER))
+        if rng.random() < 0.1:
+            parts.append(f"初步判断 {_random_bbox(rng, width, height)}，")
+    for _ in range(rng.choice([0, 1, 1, 1, 2, 3])):
+        tag = rng.choice(["BBox: ", "BBox：", "bbox : ", "BBox:", "Box: "])
+        parts.append(f"\n{tag}{_random_bbox(rng, width, height)}")
+    if rng.random() < 0.05:
+        parts.insert(1, "[嵌套 BBox: [0.1, 0.2, 0.3, 0.4]")
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="响应解析器基准")
+    parser.add_argument("--num", type=int, default=100_000, help="语料条数")
+    parser.add_argument("--cot-length", type=int, default=1000, help="CoT 部分的大致字符数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="交替计时的轮数，报告各自的最短耗时（单次计时受系统噪声影响较大）")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = []
+    for _ in range(args.num):
+        width, height = rng.choice([(500, 800), (1280, 4000), (1920, 1080)])
+        corpus.append((make_response(rng, rng.randint(0, args.cot_length * 2), width, height), width, height))
+
+    mismatches = sum(
+        1 for response, width, height in corpus
+        if legacy_parse_response(response, width, height) != parse_response(response, width, height)
+    )
+
+    legacy_runs, compiled_runs = [], []
+    for _ in range(max(1, args.repeat)):
+        start = time.perf_counter()
+        for response, width, height in corpus:
+            legacy_parse_response(response, width, height)
+        legacy_runs.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        parse_many(corpus)
+        compiled_runs.append(time.perf_counter() - start)
+    legacy_seconds, compiled_seconds = min(legacy_runs), min(compiled_runs)
+
+    print(json.dumps({
+        "num": args.num,
+        "mismatches": mismatches,
+        "legacy": {"seconds": round(legacy_seconds, 3), "per_sec": round(args.num / legacy_seconds)},
+        "compiled": {"seconds": round(compiled_seconds, 3), "per_sec": round(args.num / compiled_seconds)},
+        "speedup": round(legacy_seconds / compiled_seconds, 2),
+        # 逐轮的加速比，反映计时噪声
+        "speedup_per_run": [round(a / b, 2) for a, b in zip(legacy_runs, compiled_runs)],
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
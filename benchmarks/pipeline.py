@@ -0,0 +1,226 @@
+"""
+端到端与分阶段吞吐基准。
+
+在合成数据集（data/generate_data.py 的模拟界面）上用真实的评估流水线（main.run_evaluation：
+并发 / 批量推理、结果日志、原始输出归档、后台可视化）分别运行 Mock 模式和本地推理桩，
+从流水线自身的埋点中统计各阶段（load / preprocess / predict / parse / draw / write）的延迟分位数，
+以及端到端吞吐和真实的峰值 RSS，输出 JSON，便于在不同提交之间比较性能回归。
+
+    python3 -m benchmarks.pipeline --sizes 10 1000 100000 --resolutions 500x800 1280x4000 --output bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+from data.generate_data import iter_mock_samples, render_mock_ui
+from main import run_evaluation
+from src.backends import Backend, register_backend
+from src.dataset import ShardedDatasetWriter, open_dataset
+from src.memory import PeakMemoryTracker
+from src.preprocess import Preprocessor
+from src.visualize import VisualizationWriter
+
+# 阶段名 -> 流水线埋点中对应的 span 名（按顺序取第一个出现的）：逐条推理的路径记录 image_open / predict，
+# 批量推理的路径与本地后端一样记录 image_decode / generate。Mock 模式不单独读图，没有 load 阶段
+STAGES = {
+    "load": ("image_open", "image_decode"),
+    "preprocess": ("preprocess",),
+    "predict": ("predict", "generate"),
+    "parse": ("parse",),
+    "draw": ("vis_draw",),
+    "write": ("vis_write",),
+}
+
+
+def build_dataset(root, num_tasks, width, height, unique_images=64, seed=0):
+    """
+    在 root 下构造 num_tasks 个任务的分片数据集。只渲染 unique_images 张不同的截图并循环复用，
+    避免大规模数据集的构造时间掩盖被测流水线本身。
+    """
+    samples = list(iter_mock_samples(min(num_tasks, unique_images), seed))
+    encoded = []
+    for sample in samples:
+        buf = io.BytesIO()
+        render_mock_ui(sample, width, height).save(buf, format="PNG")
+        encoded.append(buf.getvalue())
+
+    with ShardedDatasetWriter(root) as writer:
+        for i in range(num_tasks):
+            k = i % len(samples)
+            writer.add(dict(samples[k], id=str(i + 1)), encoded[k])
+
+
+@register_backend("stub")
+class StubLocalBackend(Backend):
+    """
+    本地推理桩：不加载模型，按标注生成一段带 CoT 的模型输出文本（像素坐标，会触发解析时的归一化纠正），
+    可选模拟每个批次的生成延迟。与本地模式一样支持批量，评估时走 views / predict_batch_raw 的真实路径，
+    用于在没有权重和显卡的环境下测量本地流水线中模型以外的开销。
+    """
+
+    batched = True
+    latency_ms = 0.0
+
+    def __init__(self, owner):
+        super().__init__(owner)
+        self._rng = random.Random(0)
+        # 按指令查找标注（视图可能是预处理产生的内存图像，没有对应的路径）
+        self._index = {item["instruction"]: item for item in open_dataset(owner.mock_dataset)}
+
+    def generate(self, items, sizes):
+        inst = self.owner.instrumentation
+        with inst.span("image_decode"):
+            for image, _ in items:
+                image.decode()
+        with inst.span("generate"):
+            return self._responses(items, sizes)
+
+    def _responses(self, items, sizes):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        outputs = []
+        for (_, instruction), (width, height) in zip(items, sizes):
+            item = self._index[instruction]
+            x1, y1, x2, y2 = item["bbox"]
+            jitter = self._rng.uniform(-0.01, 0.01)
+            outputs.append({"response": (
+                f"Thought: 界面顶部是状态栏，主体为浅灰色背景。根据指令 '{instruction}'，"
+                f"目标是 {item['target']}，先粗略估计为 [0, 0, 1, 1]，再结合布局修正。\n"
+                f"BBox: [{(x1 + jitter) * width:.1f}, {(y1 + jitter) * height:.1f}, "
+                f"{(x2 + jitter) * width:.1f}, {(y2 + jitter) * height:.1f}]"
+            )})
+        return outputs
+
+
+def run_pipeline(root, backend, out_dir, max_pixels=None, workers=1, batch_size=4, vis="all"):
+    """
+    在 out_dir 下运行一次完整评估，返回 (埋点汇总, 峰值 RSS（MB）, 总耗时)。
+    各任务的逐条打印被丢弃；峰值 RSS 取流水线逐任务峰值（VmHWM）与收尾阶段峰值中的最大值。
+    """
+    preprocessor = Preprocessor(max_pixels=max_pixels) if max_pixels else None
+    tracker = PeakMemoryTracker()
+    cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            tracker.reset()
+            start = time.perf_counter()
+            run_evaluation(
+                dataset_path=root,
+                mode=backend,
+                workers=workers,
+                batch_size=batch_size,
+                cache_path=None,
+                preprocessor=preprocessor,
+                visualizer=VisualizationWriter("output", mode=vis),
+            )
+            wall = time.perf_counter() - start
+            tail_peak = tracker.peak()["rss_mb"]
+        with open(os.path.join("output", "instrumentation.json"), "r", encoding="utf-8") as f:
+            summary = json.load(f)
+    finally:
+        os.chdir(cwd)
+    task_peaks = summary["values"].get("task_peak_rss_mb", {})
+    return summary, max(tail_peak, task_peaks.get("max", 0.0)), wall
+
+
+def _stage_summary(spans_ms, names):
+    dist = next((spans_ms[name] for name in names if spans_ms.get(name, {}).get("count")), None)
+    if dist is None:
+        return None
+    return {
+        "count": dist["count"],
+        "mean_ms": dist["mean"],
+        "p50_ms": dist["p50"],
+        "p95_ms": dist["p95"],
+        "p99_ms": dist["p99"],
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, resolutions, backends, max_pixels=None, workers=1, batch_size=4, vis="all"):
+    runs = []
+    for width, height in resolutions:
+        for num_tasks in sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                root = os.path.join(tmp, "dataset")
+                build_dataset(root, num_tasks, width, height)
+                for backend in backends:
+                    out_dir = os.path.join(tmp, f"run-{backend}")
+                    os.makedirs(out_dir)
+                    summary, peak_rss, wall = run_pipeline(
+                        root, backend, out_dir, max_pixels, workers, batch_size, vis
+                    )
+                    runs.append({
+                        "backend": backend,
+                        "num_tasks": num_tasks,
+                        "resolution": [width, height],
+                        "end_to_end": {
+                            "seconds": round(wall, 3),
+                            "tasks_per_sec": round(num_tasks / wall, 2),
+                            "peak_rss_mb": round(peak_rss, 1),
+                        },
+                        "task_peak_rss_mb": summary["values"].get("task_peak_rss_mb"),
+                        "stages": {
+                            stage: _stage_summary(summary["spans_ms"], names) for stage, names in STAGES.items()
+                        },
+                    })
+                    print(f"[{backend}] {num_tasks} tasks @ {width}x{height}: "
+                          f"{num_tasks / wall:.1f} tasks/s, peak RSS {peak_rss:.1f} MB", flush=True)
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "max_pixels": max_pixels,
+        "workers": workers,
+        "batch_size": batch_size,
+        "vis": vis,
+        "runs": runs,
+    }
+
+
+def _parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端与分阶段吞吐基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000], help="数据集规模（任务数）")
+    parser.add_argument("--resolutions", type=_parse_resolution, nargs="+", default=[(500, 800), (1280, 4000)],
+                        help="截图分辨率，如 500x800")
+    parser.add_argument("--backends", nargs="+", choices=["mock", "stub"], default=["mock", "stub"])
+    parser.add_argument("--max-pixels", type=int, default=None, help="预处理阶段的像素预算")
+    parser.add_argument("--workers", type=int, default=1, help="Mock 模式的并发数")
+    parser.add_argument("--batch-size", type=int, default=4, help="推理桩的批大小")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="推理桩每个批次的模拟生成延迟")
+    parser.add_argument("--vis", choices=["all", "none"], default="all", help="是否绘制结果图")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    StubLocalBackend.latency_ms = args.stub_latency_ms
+    report = run_benchmarks(args.sizes, args.resolutions, args.backends, args.max_pixels,
+                            args.workers, args.batch_size, args.vis)
+    text = json.dumps(report, ensure_ascii=False, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
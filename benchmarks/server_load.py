@@ -0,0 +1,150 @@
+"""
+推理服务（src/server.py）的压测客户端：并发发送上传截图的定位请求，统计吞吐、延迟分位数和 429 / 5xx 比例，
+结束后读取服务的 /metrics，给出实际的微批次大小和排队时间分布。
+
+    # 压测已启动的服务（闭环：固定 32 个并发客户端）
+    python3 -m benchmarks.server_load --url http://127.0.0.1:8090 --requests 2000 --concurrency 32
+    # 开环：按固定速率发送，观察超出服务能力后的背压
+    python3 -m benchmarks.server_load --url http://127.0.0.1:8090 --rate 200 --concurrency 256
+
+不给 --url 时在进程内启动一个推理服务（API 模式，后端指向本地模拟 DashScope 服务），无需模型或网络。
+"""
+import argparse
+import base64
+import json
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from data.generate_data import iter_mock_samples, render_mock_ui
+from src.api_client import DashScopeClient
+from src.concurrency import run_concurrent
+from src.dataset import open_dataset
+from src.grounding_model import UIGroundingModel
+from src.image_io import ImageHandle
+from src.instrumentation import Instrumentation
+from src.mock_server import MockDashScopeServer
+from src.resilience import RetryPolicy
+from src.server import GROUND_PATH, METRICS_WINDOW, GroundingServer
+
+
+def build_payloads(dataset=None, num_images=16):
+    """预先编码请求体：来自数据集的截图，或合成的 Mock UI 截图。"""
+    payloads = []
+    if dataset:
+        for item in open_dataset(dataset):
+            data = ImageHandle(item["image_path"]).data
+            payloads.append((data, item["instruction"]))
+            if len(payloads) >= num_images:
+                break
+    else:
+        for sample in iter_mock_samples(num_images, seed=0):
+            payloads.append((ImageHandle.from_image(render_mock_ui(sample, 500, 800)).data, sample["instruction"]))
+    return [
+        json.dumps({"instruction": instruction, "image": base64.b64encode(data).decode("ascii")}).encode("utf-8")
+        for data, instruction in payloads
+    ]
+
+
+def send(url, body, timeout):
+    """发送一个定位请求，返回 (HTTP 状态码, 延迟秒数)；连接失败记为状态码 0。"""
+    request = urllib.request.Request(url + GROUND_PATH, data=body, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def run_load(url, payloads, requests, concurrency, rate=None, timeout=120.0):
+    tasks = (payloads[k % len(payloads)] for k in range(requests))
+    start = time.perf_counter()
+    outcomes = [
+        result for _, result in
+        run_concurrent(lambda body: send(url, body, timeout), tasks, max_workers=concurrency, rate_limit=rate)
+    ]
+    wall = time.perf_counter() - start
+
+    statuses = {}
+    for status, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = np.asarray([latency for status, latency in outcomes if status == 200]) * 1000
+    report = {
+        "requests": len(outcomes),
+        "ok": int(ok.size),
+        "ok_per_sec": round(ok.size / wall, 2),
+        "rejected_rate": round(statuses.get("429", 0) / len(outcomes), 4),
+        "statuses": statuses,
+    }
+    if ok.size:
+        for q in (50, 95, 99):
+            report[f"p{q}_ms"] = round(float(np.percentile(ok, q)), 1)
+        report["max_ms"] = round(float(ok.max()), 1)
+    return report
+
+
+def _server_metrics(url):
+    with urllib.request.urlopen(url + "/metrics", timeout=10) as response:
+        metrics = json.loads(response.read())
+    values = metrics.get("values", {})
+    return {
+        "batch_size": values.get("batch_size"),
+        "queue_wait_ms": values.get("queue_wait_ms"),
+        "counters": metrics.get("counters"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理服务压测客户端（吞吐与尾延迟）")
+    parser.add_argument("--url", default=None, help="服务地址；不给时在进程内启动服务（API 模式 + 模拟后端）")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32, help="同时在途的请求数")
+    parser.add_argument("--rate", type=float, default=None, help="开环压测：每秒发送的请求数（默认闭环）")
+    parser.add_argument("--timeout", type=float, default=120.0, help="客户端单个请求的超时（秒）")
+    parser.add_argument("--dataset", default=None, help="使用该数据集中的截图（默认合成截图）")
+    parser.add_argument("--num-images", type=int, default=16, help="循环使用的不同截图数")
+    parser.add_argument("--backend-latency-ms", type=float, default=100.0, help="进程内服务：模拟后端的延迟")
+    parser.add_argument("--server-workers", type=int, default=16, help="进程内服务：同时处理的请求数")
+    parser.add_argument("--server-max-queue", type=int, default=64, help="进程内服务：排队请求数上限")
+    parser.add_argument("--output", default=None, help="把 JSON 结果写入该文件")
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.dataset, args.num_images)
+    backend = server = None
+    url = args.url
+    if url is None:
+        backend = MockDashScopeServer(latency_ms=args.backend_latency_ms, latency_jitter_ms=args.backend_latency_ms / 4)
+        instrumentation = Instrumentation(max_samples=METRICS_WINDOW)
+        client = DashScopeClient("mock-key", base_url=backend.start(), retry=RetryPolicy(max_retries=0),
+                                 instrumentation=instrumentation)
+        model = UIGroundingModel(mode="api", api_client=client, instrumentation=instrumentation)
+        server = GroundingServer(model, workers=args.server_workers, max_queue=args.server_max_queue)
+        url = server.start()
+
+    try:
+        report = run_load(url, payloads, args.requests, args.concurrency, args.rate, args.timeout)
+        report["server"] = _server_metrics(url)
+    finally:
+        if server is not None:
+            server.stop()
+        if backend is not None:
+            backend.stop()
+
+    output = json.dumps({"url": args.url or "in-process", "args": vars(args), "result": report},
+                        ensure_ascii=False, indent=4)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+启动开销基准：在全新的子进程中测量常用入口（导入模块、构造各模式的模型、CLI --help）的
+墙钟时间和峰值 RSS，并检查是否意外导入了 torch / transformers 等重量级依赖。
+
+    python3 -m benchmarks.startup --repeat 5
+    python3 -m benchmarks.startup --local-model Qwen/Qwen2-VL-2B-Instruct   # 额外测量本地模式
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ("torch", "transformers", "qwen_vl_utils")
+
+SCENARIOS = {
+    "import grounding_model": ["-c", "import src.grounding_model"],
+    "mock model": ["-c", "from src.grounding_model import UIGroundingModel; UIGroundingModel(mode='mock')"],
+    "api model": ["-c", "from src.grounding_model import UIGroundingModel; UIGroundingModel(mode='api')"],
+    "main.py --help": ["main.py", "--help"],
+    "metrics --help": ["-m", "src.metrics", "--help"],
+    "archive --help": ["-m", "src.archive", "--help"],
+}
+
+
+def _run(args):
+    """运行一次子进程，返回 (墙钟秒数, 峰值 RSS MB, stderr)。"""
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, *args], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.read().decode("utf-8", "replace")
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"{' '.join(args)} 运行失败:\n{stderr}")
+    return elapsed, usage.ru_maxrss / 1024, stderr
+
+
+def _imports(args, top):
+    """用 -X importtime 运行一次，返回 (导入的重量级模块, 累计耗时最长的 top 个顶层包)。"""
+    _, _, stderr = _run(["-X", "importtime", *args])
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        # 跳过表头（self [us] | cumulative | imported package）
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        package = parts[2].strip().split(".")[0]
+        cumulative[package] = max(cumulative.get(package, 0), int(parts[1]))
+    heavy = sorted(m for m in HEAVY_MODULES if m in cumulative)
+    slowest = sorted(cumulative.items(), key=lambda kv: -kv[1])[:top]
+    return heavy, {name: round(us / 1000, 1) for name, us in slowest}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动开销基准")
+    parser.add_argument("--repeat", type=int, default=5, help="每个场景重复的次数（取中位数）")
+    parser.add_argument("--top", type=int, default=5, help="列出累计导入耗时最长的前几个包")
+    parser.add_argument("--local-model", default=None, help="额外测量本地模式加载该模型的开销")
+    args = parser.parse_args()
+
+    scenarios = dict(SCENARIOS)
+    if args.local_model:
+        scenarios["local model"] = [
+            "-c", f"from src.grounding_model import UIGroundingModel; UIGroundingModel({args.local_model!r}, mode='local')"
+        ]
+
+    report = {}
+    for name, cmd in scenarios.items():
+        runs = [_run(cmd) for _ in range(args.repeat)]
+        heavy, slowest = _imports(cmd, args.top)
+        report[name] = {
+            "median_ms": round(statistics.median(r[0] for r in runs) * 1000, 1),
+            "min_ms": round(min(r[0] for r in runs) * 1000, 1),
+            "peak_rss_mb": round(max(r[1] for r in runs), 1),
+            "heavy_imports": heavy,
+            "slowest_imports_ms": slowest,
+        }
+        print(f"{name}: {report[name]['median_ms']} ms, {report[name]['peak_rss_mb']} MB", flush=True)
+    print(json.dumps(report, ensure_ascii=False, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,91 +1,296 @@
+"""
+流式导入 Multimodal-Mind2Web 子集。
+
+    python3 data/load_mind2web.py --num-samples 20000 --shard-dir data/shards --workers 16
+
+- 以 streaming 方式读取数据集，截图保持编码后的原始字节，由线程池并行计算内容哈希、读取尺寸并按需转码
+  （hashlib 和 PIL 的编解码都会释放 GIL），主线程只负责按顺序写入；
+- 内容相同的截图只存储一次：分片数据集中多个样本引用同一段图像字节，dataset.json 模式下共用同一个文件；
+- 追加到已有数据集，已存在的样本 id 会被跳过；
+- 每 --checkpoint-every 条落盘一次并记录已消费的数据流位置，中断后重新运行同一命令即从断点继续。
+  --num-samples 是整个导入任务的目标样本数，完成后调大该值再次运行即可继续追加后续样本。
+"""
+import argparse
 import io
+import itertools
 import json
 import os
+import sys
+import time
 
-from datasets import load_dataset
 from PIL import Image
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.concurrency import run_concurrent  # noqa: E402
+from src.dataset import ShardedDataset, ShardedDatasetWriter, image_digest  # noqa: E402
+
+SOURCE = "osunlp/Multimodal-Mind2Web"
+JSON_PATH = "data/dataset.json"
+IMAGE_DIR = "data/images"
+CHECKPOINT_NAME = "mind2web.checkpoint.json"
+
+# 转码格式：名称 -> (PIL 格式, 扩展名, 保存参数)；keep 表示直接保存数据集中的原始编码字节
+IMAGE_FORMATS = {
+    "png": ("PNG", ".png", {}),
+    "jpeg": ("JPEG", ".jpg", {"quality": 90}),
+    "webp": ("WEBP", ".webp", {"quality": 90}),
+}
+_KEEP_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+
+def convert_sample(sample, width, height):
+    """把 Mind2Web 样本转换为数据项（不含图像），没有可用的目标元素时返回 None。"""
+    pos_candidates = sample.get('pos_candidates', [])
+    if not pos_candidates:
+        return None
+
+    # 取第一个正样本候选作为目标
+    target_candidate = pos_candidates[0]
+    # Mind2Web 的 bbox 格式是 [top, left, height, width] (像素值)
+    raw_bbox = target_candidate.get('bbox')
+    if not raw_bbox or len(raw_bbox) < 4:
+        return None
+
+    top, left, h, w = raw_bbox
+
+    # 转换为 [xmin, ymin, xmax, ymax] 并归一化
+    xmin = max(0.0, min(1.0, left / width))
+    ymin = max(0.0, min(1.0, top / height))
+    xmax = max(0.0, min(1.0, (left + w) / width))
+    ymax = max(0.0, min(1.0, (top + h) / height))
+
+    return {
+        "instruction": sample['instruction'],
+        "target": target_candidate.get('backend_node_id', 'element'),
+        "bbox": [round(xmin, 3), round(ymin, 3), round(xmax, 3), round(ymax, 3)],
+    }
+
+
+def _screenshot_bytes(screenshot):
+    """取出截图的编码字节：未解码的 {"bytes", "path"}，或已解码的 PIL 图像（编码为 PNG）。"""
+    if isinstance(screenshot, Image.Image):
+        buf = io.BytesIO()
+        screenshot.save(buf, format="PNG")
+        return buf.getvalue()
+    if screenshot.get("bytes") is not None:
+        return screenshot["bytes"]
+    with open(screenshot["path"], "rb") as f:
+        return f.read()
+
+
+class _ShardSink:
+    """
+    写入分片数据集，图像按内容哈希去重。已有样本 id 从 manifest 已确认的记录中读取；
+    中断的导入续跑时，ShardedDatasetWriter 打开时会丢弃 index.tsv / images.tsv 中未确认的行，
+    即使本次不再写入那些 id（调小 --num-samples 或 --restart），它们也不会残留在随机访问索引中。
+    """
+
+    def __init__(self, root):
+        self.ids = {str(item["id"]) for item in ShardedDataset(root)} if os.path.isdir(root) else set()
+        self.writer = ShardedDatasetWriter(root)
+
+    def has_image(self, digest):
+        return self.writer.has_image(digest)
+
+    def add(self, item, data, digest, ext):
+        self.ids.add(item["id"])
+        return self.writer.add(item, data, digest=digest)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+
+class _JsonSink:
+    """追加到 dataset.json，图像以内容哈希命名保存在 image_dir 中，相同内容只保存一个文件。"""
+
+    def __init__(self, json_path=JSON_PATH, image_dir=IMAGE_DIR):
+        self.json_path = json_path
+        self.image_dir = image_dir
+        os.makedirs(image_dir, exist_ok=True)
+        self.items = []
+        if os.path.exists(json_path):
+            with open(json_path, "r", encoding="utf-8") as f:
+                self.items = json.load(f)
+        self.ids = {str(item["id"]) for item in self.items}
+        self.images = {}
+        for name in os.listdir(image_dir):
+            if name.startswith("mind2web-"):
+                self.images[name[len("mind2web-"):].split(".")[0]] = f"{image_dir}/{name}"
+
+    def has_image(self, digest):
+        return digest in self.images
+
+    def add(self, item, data, digest, ext):
+        path = self.images.get(digest)
+        written = path is None
+        if written:
+            path = f"{self.image_dir}/mind2web-{digest}{ext}"
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.images[digest] = path
+        item["image_path"] = path
+        self.items.append(item)
+        self.ids.add(item["id"])
+        return written
 
-def load_mind2web_subset(num_samples=5):
-    os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
+    def flush(self):
+        # JSON 数组无法原地追加，每次落盘整体重写（先写临时文件再替换，中断时不会留下半个文件）
+        tmp_path = self.json_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.items, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.json_path)
 
-    print(f"Loading {num_samples} samples from osunlp/Multimodal-Mind2Web...")
-    
-    # 加载数据集的一个子集
+    def close(self):
+        self.flush()
+
+
+def _load_checkpoint(path, split):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("source") == SOURCE and checkpoint.get("split") == split:
+            return checkpoint
+    return {"source": SOURCE, "split": split, "position": 0, "added": 0}
+
+
+def _save_checkpoint(path, checkpoint):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def _open_stream(split):
+    from datasets import Image as ImageFeature
+    from datasets import load_dataset
+
+    ds = load_dataset(SOURCE, split=split, streaming=True)
+    # 不在读取时解码截图，编码字节直接交给工作线程
+    return ds.cast_column("screenshot", ImageFeature(decode=False))
+
+
+def ingest(stream, sink, checkpoint, checkpoint_path, num_samples, workers=8, image_format="keep",
+           checkpoint_every=500):
+    """
+    按顺序消费 stream（已跳过 checkpoint["position"] 之前的样本），直到累计新增 num_samples 个样本或数据流结束。
+    每 checkpoint_every 条以及退出时（包括中断）先把 sink 落盘再保存断点，断点之前的样本都已持久化。
+    """
+    position = checkpoint["position"]
+
+    def _prepare(task):
+        index, sample = task
+        try:
+            item_id = str(sample.get("action_uid") or f"mind2web_{index}")
+            if item_id in sink.ids:
+                return None
+            data = _screenshot_bytes(sample["screenshot"])
+            digest = image_digest(data)
+            with Image.open(io.BytesIO(data)) as img:
+                # 只读取文件头即可得到尺寸
+                width, height = img.size
+                item = convert_sample(sample, width, height)
+                if item is None:
+                    return None
+                ext = _KEEP_EXTENSIONS.get(img.format) if image_format == "keep" else None
+                if ext is None and sink.has_image(digest):
+                    # 已存储过的截图不再转码，写入时直接引用
+                    data, ext = None, ""
+                elif ext is None:
+                    pil_format, ext, params = IMAGE_FORMATS.get(image_format, IMAGE_FORMATS["png"])
+                    img = img.convert("RGB") if pil_format == "JPEG" and img.mode not in ("RGB", "L") else img
+                    buf = io.BytesIO()
+                    img.save(buf, format=pil_format, **params)
+                    data = buf.getvalue()
+            return {"id": item_id, **item}, data, digest, ext
+        except Exception as e:
+            print(f"Error processing sample {index}: {e}")
+            return None
+
+    start = time.perf_counter()
+    added = deduplicated = 0
+    tasks = enumerate(stream, start=position)
+    try:
+        if checkpoint["added"] < num_samples:
+            for (index, _), prepared in run_concurrent(_prepare, tasks, max_workers=workers):
+                position = index + 1
+                if prepared is not None and prepared[0]["id"] not in sink.ids:
+                    if not sink.add(*prepared):
+                        deduplicated += 1
+                    added += 1
+                done = checkpoint["added"] + added >= num_samples
+                if done or position % checkpoint_every == 0:
+                    sink.flush()
+                    _save_checkpoint(checkpoint_path, {**checkpoint, "position": position,
+                                                       "added": checkpoint["added"] + added})
+                    elapsed = time.perf_counter() - start
+                    print(f"已消费 {position} 条，本次新增 {added} 个样本（{deduplicated} 张截图去重），"
+                          f"{added / max(elapsed, 1e-9):.1f} 样本/秒", flush=True)
+                if done:
+                    break
+    finally:
+        sink.close()
+        checkpoint = {**checkpoint, "position": position, "added": checkpoint["added"] + added}
+        _save_checkpoint(checkpoint_path, checkpoint)
+    return checkpoint, added, deduplicated
+
+
+def load_mind2web_subset(num_samples=5, shard_dir=None, split="test_task", workers=8, image_format="keep",
+                         checkpoint_every=500, restart=False):
+    """
+    shard_dir: 若指定，则把样本追加写入该分片数据集目录（图像打包存储），
+    否则图像保存到 data/images，样本追加到 data/dataset.json。
+    restart: 忽略已有断点，从数据流开头重新消费（已存在的样本 id 仍会被跳过）。
+    """
+    os.environ.setdefault('HF_ENDPOINT', 'https://hf-mirror.com')
+
+    if shard_dir:
+        sink = _ShardSink(shard_dir)
+        checkpoint_path = os.path.join(shard_dir, CHECKPOINT_NAME)
+    else:
+        sink = _JsonSink()
+        checkpoint_path = os.path.join(os.path.dirname(JSON_PATH), CHECKPOINT_NAME)
+    checkpoint = _load_checkpoint(checkpoint_path, split)
+    if restart:
+        checkpoint.update(position=0, added=0)
+
+    print(f"Loading {num_samples} samples from {SOURCE} ({split}), "
+          f"resuming at stream position {checkpoint['position']}...")
     try:
-        # 使用 test_task 分片，通常比 train 小
-        ds = load_dataset("osunlp/Multimodal-Mind2Web", split="test_task", streaming=True)
+        stream = _open_stream(split)
     except Exception as e:
         print(f"Error loading dataset: {e}")
+        sink.close()
         return
+    if checkpoint["position"]:
+        stream = itertools.islice(stream, checkpoint["position"], None)
 
-    os.makedirs("data/images", exist_ok=True)
-    dataset_metadata = []
-    
-    count = 0
-    for sample in ds:
-        if count >= num_samples:
-            break
-            
-        try:
-            img = sample['screenshot']
-            instruction = sample['instruction']
-            pos_candidates = sample.get('pos_candidates', [])
-            
-            if not pos_candidates:
-                continue
-                
-            # 取第一个正样本候选作为目标
-            target_candidate = pos_candidates[0]
-            # Mind2Web 的 bbox 格式是 [top, left, height, width] (像素值)
-            raw_bbox = target_candidate.get('bbox') 
-            
-            if not raw_bbox or len(raw_bbox) < 4:
-                continue
-                
-            top, left, h, w = raw_bbox
-            width, height = img.size
-            
-            # 转换为 [xmin, ymin, xmax, ymax] 并归一化
-            xmin = max(0.0, min(1.0, left / width))
-            ymin = max(0.0, min(1.0, top / height))
-            xmax = max(0.0, min(1.0, (left + w) / width))
-            ymax = max(0.0, min(1.0, (top + h) / height))
-            
-            normalized_bbox = [round(xmin, 3), round(ymin, 3), round(xmax, 3), round(ymax, 3)]
-            
-            img_filename = f"mind2web_{count}.png"
-            img_path = f"data/images/{img_filename}"
-            img.save(img_path)
-            
-            dataset_metadata.append({
-                "id": str(count + 100), # 避免与之前的 ID 冲突
-                "image_path": img_path,
-                "instruction": instruction,
-                "target": target_candidate.get('backend_node_id', 'element'),
-                "bbox": normalized_bbox
-            })
-            
-            print(f"Processed sample {count+1}: {instruction}")
-            count += 1
-            
-        except Exception as e:
-            print(f"Error processing sample: {e}")
-            continue
-
-    # 更新 dataset.json
-    # 如果已存在，则合并
-    existing_data = []
-    if os.path.exists("data/dataset.json"):
-        with open("data/dataset.json", "r", encoding="utf-8") as f:
-            existing_data = json.load(f)
-    
-    # 为了演示，我们可以选择替换或追加。用户要求“使用”该数据集，我将替换它以确保证明使用了新数据。
-    with open("data/dataset.json", "w", encoding="utf-8") as f:
-        json.dump(dataset_metadata, f, ensure_ascii=False, indent=4)
-        
-    print(f"Successfully saved {len(dataset_metadata)} samples to data/dataset.json")
+    checkpoint, added, deduplicated = ingest(
+        stream, sink, checkpoint, checkpoint_path, num_samples, workers, image_format, checkpoint_every
+    )
+    print(f"Successfully appended {added} samples ({deduplicated} duplicate screenshots reused) "
+          f"to {shard_dir or JSON_PATH}; {checkpoint['added']}/{num_samples} in total")
 
-if __name__ == "__main__":
-    load_mind2web_subset()
 
+def main():
+    parser = argparse.ArgumentParser(description="流式导入 Multimodal-Mind2Web 样本")
+    parser.add_argument("shard_dir", nargs="?", default=None,
+                        help="分片数据集目录；省略时追加到 data/dataset.json")
+    parser.add_argument("--num-samples", type=int, default=5, help="导入任务的目标样本总数")
+    parser.add_argument("--split", default="test_task")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="图像哈希与转码的线程数")
+    parser.add_argument("--image-format", choices=["keep", *IMAGE_FORMATS], default="keep",
+                        help="keep 直接保存原始编码字节，其他取值会转码")
+    parser.add_argument("--checkpoint-every", type=int, default=500, help="每消费多少条落盘并保存断点")
+    parser.add_argument("--restart", action="store_true", help="忽略已有断点，从头消费数据流")
+    args = parser.parse_args()
+    load_mind2web_subset(args.num_samples, args.shard_dir, args.split, args.workers, args.image_format,
+                         args.checkpoint_every, args.restart)
+
+
+if __name__ == "__main__":
+    main()
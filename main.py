@@ -1,79 +1,400 @@
-import json
+import argparse
 import os
+import sys
+from itertools import islice
 
-from PIL import Image
-
+from src.api_client import DEFAULT_BASE_URL, DashScopeClient
+from src.archive import DEFAULT_ARCHIVE_PATH, ResponseArchive
+from src.backends import BACKENDS, DECODING_MODES
+from src.cache import DEFAULT_CACHE_PATH, PredictionCache
+from src.concurrency import RequestLimiter, run_concurrent
+from src.dataset import open_dataset
 from src.grounding_model import UIGroundingModel
-from src.utils import draw_bbox
+from src.image_io import ImageHandle
+from src.instrumentation import Instrumentation
+from src.journal import ResultJournal
+from src.memory import MemoryBudget, PeakMemoryTracker
+from src.metrics import format_table, instruction_types, score, split_errors, to_bbox_array
+from src.parser import parse_raw, raw_error
+from src.prefix_cache import PrefixCache
+from src.preprocess import Preprocessor
+from src.resilience import CircuitBreaker, RetryPolicy
+from src.sharding import DatasetShard, launch_workers, merge_shards, parse_shard, shard_paths
+from src.visualize import VIS_FORMATS, VIS_MODES, VisualizationWriter
+
+
+# 共享前缀缓存开启时按截图分组的窗口大小（条）
+PREFIX_GROUP_WINDOW = 64
+
+
+def iter_predictions(model, dataset, workers=1, rate_limit=None, batch_size=1):
+    """
+    按数据集顺序 yield (item, image, raw)，image 为该任务共享的 ImageHandle，
+    raw 为模型的原始输出记录（见 UIGroundingModel.predict_raw）。
+    支持批量的后端（本地模式）且 batch_size > 1 时走 predict_batch_raw，否则通过线程池并发调用 predict_raw。
+    本地模式开启共享前缀缓存时，在 PREFIX_GROUP_WINDOW 条的窗口内按截图分组推理，
+    同一截图的指令连续执行、前缀状态只计算一次，结果仍按数据集顺序返回。
+    """
+    tasks = ((item, ImageHandle(item["image_path"])) for item in dataset)
+
+    grouped = model.backend.batched and model.prefix_cache is not None
+    if model.backend.batched and (batch_size > 1 or grouped):
+        window = max(batch_size, PREFIX_GROUP_WINDOW) if grouped else batch_size
+        while chunk := list(islice(tasks, window)):
+            order = list(range(len(chunk)))
+            if grouped:
+                order.sort(key=lambda k: chunk[k][0]["image_path"])
+            preds = model.predict_batch_raw(
+                [(chunk[k][1], chunk[k][0]["instruction"]) for k in order], batch_size=batch_size
+            )
+            by_index = dict(zip(order, preds))
+            for k, (item, image) in enumerate(chunk):
+                yield item, image, by_index[k]
+        return
+
+    def _predict(task):
+        item, image = task
+        return model.predict_raw(image, item["instruction"])
+
+    for (item, image), pred in run_concurrent(_predict, tasks, max_workers=workers, rate_limit=rate_limit):
+        yield item, image, pred
+
+
+JOURNAL_PATH = "output/results.journal.jsonl"
+
+# 不分片运行时的输出文件；分片运行时见 src.sharding.shard_paths
+OUTPUT_PATHS = {
+    "journal": JOURNAL_PATH,
+    "archive": DEFAULT_ARCHIVE_PATH,
+    "results": "output/results.json",
+    "instrumentation": "output/instrumentation.json",
+}
+
+
+def _handle_result(item, image, thought, pred_bbox, journal, visualizer, error=None):
+    img_id = item["id"]
+    instruction = item["instruction"]
+    gt_bbox = item["bbox"]
+
+    print(f"\n任务 {img_id}: {instruction}")
 
+    # 1. 图像预处理 (推理增强：添加视觉网格)
+    # grid_img = add_visual_grid(image.decode().copy())
+    # grid_img.save(f"output/{img_id}_grid.png")
 
-def run_evaluation():
+    # 2. 模型推理（已在线程池 / 批量推理中完成）
+    print(f"思考过程: {thought}")
+    print(f"预测 BBox: {pred_bbox}")
+    print(f"真实 BBox: {gt_bbox}")
+
+    result = {
+        "id": img_id,
+        "instruction": instruction,
+        "pred_bbox": pred_bbox,
+        "gt_bbox": gt_bbox,
+        "thought": thought
+    }
+    if error is not None:
+        # 请求失败（重试耗尽、熔断）：记录下来但不算完成，--resume 时重新推理，也不计入模型指标
+        result["error"] = error
+    journal.append(result)
+
+    # 3. 结果可视化（Pred=红色，GT=绿色）：交给后台线程绘制和编码，图像由写入器负责释放
+    visualizer.submit(img_id, image, pred_bbox, gt_bbox)
+
+
+def run_evaluation(dataset_path="data/dataset.json", mode="api", model_path="qwen-vl-max", workers=1, rate_limit=None, batch_size=1,
+                   cache_path=DEFAULT_CACHE_PATH, resume=False, preprocessor=None, visualizer=None,
+                   api_client=None, shard=None, prefix_cache=None, decoding="full", memory_budget=None):
+    """
+    dataset_path: dataset.json 或分片数据集目录（见 src/dataset.py）；
+    mode: 推理后端（mock / api / local，见 src/backends.py）；
+    model_path: API 模式下的模型名，或本地模式下的权重路径；
+    workers: 同时在途的推理请求数（API 模式建议 20~50），1 表示串行；
+    rate_limit: 每秒最多发起的请求数，None 表示不限速；
+    batch_size: 本地模式下每次 generate 的样本数；
+    cache_path: 预测缓存文件路径，None 表示绕过缓存；
+    resume: 续跑模式，跳过结果日志中已完成的任务；
+    preprocessor: 推理前的图像缩放 / 切片配置（src.preprocess.Preprocessor），None 表示原图推理；
+    visualizer: 后台可视化写入器（src.visualize.VisualizationWriter），None 表示默认配置（全部绘制为 PNG）；
+    api_client: API 模式的 HTTP 客户端（src.api_client.DashScopeClient），None 表示默认的超时和重试配置；
+    shard: (i, N) 表示只评估数据集的第 i 个分片（共 N 个），部分结果写入 output/shards/，
+           全部分片完成后用 merge_evaluation 合并。
+    prefix_cache: 本地模式的共享前缀缓存（src.prefix_cache.PrefixCache），同一截图的多条指令只计算一次
+                  视觉编码和 prompt 前缀，None 表示不启用。
+    decoding: 解码模式（full / early_stop / coords，见 src.backends.DECODING_MODES）；
+    memory_budget: 单进程内存预算（src.memory.MemoryBudget）：推理前把截图缩放到预算对应的像素上限以内，
+                   推理完成后立即释放解码图像；None 表示不限制。无论是否设置都会统计每个任务的峰值内存。
+    """
     # 初始化
     os.makedirs("output", exist_ok=True)
-    
+    paths = OUTPUT_PATHS if shard is None else shard_paths(*shard)
+    os.makedirs(os.path.dirname(paths["journal"]), exist_ok=True)
+    if shard is not None and os.path.exists(paths["results"]):
+        # 分片的部分结果只在分片完整结束时写出；先删掉上一次运行留下的文件，
+        # 本次分片中途失败时合并会把它报告为缺失，而不是悄悄合并过期的结果
+        os.remove(paths["results"])
+
+    if memory_budget is not None:
+        # 图像在编码前按预算缩放：缩放只影响送入模型的视图，坐标是归一化的，结果无需换算
+        if preprocessor is None:
+            preprocessor = Preprocessor(max_pixels=memory_budget.max_pixels)
+        elif not preprocessor.max_pixels or preprocessor.max_pixels > memory_budget.max_pixels:
+            preprocessor.max_pixels = memory_budget.max_pixels
+
     # 获取 API Key (优先从环境变量读取)
     api_key = os.getenv("DASHSCOPE_API_KEY")
-    
-    # 初始化模型：使用 API 模式
+
+    # 初始化模型：默认使用 API 模式
     # 可选模型：'qwen-vl-max', 'qwen-vl-plus'
+    cache = PredictionCache(cache_path) if cache_path else None
+    instrumentation = Instrumentation()
+    # API 模式按请求限流：切片定位时一个任务会发出多个请求，并发数和速率限制对每个请求生效，
+    # 而不是只对任务生效（任务本身不再额外占用令牌）
+    request_limiter = RequestLimiter(workers, rate_limit) if mode == "api" else None
     model = UIGroundingModel(
-        mode="api", 
-        model_path="qwen-vl-max", 
-        api_key=api_key
+        mode=mode,
+        model_path=model_path,
+        api_key=api_key,
+        cache=cache,
+        mock_dataset=dataset_path,
+        preprocessor=preprocessor,
+        instrumentation=instrumentation,
+        api_client=api_client,
+        prefix_cache=prefix_cache,
+        decoding=decoding,
+        request_limiter=request_limiter,
     )
-    
-    if not api_key:
+    if request_limiter is not None:
+        rate_limit = None
+
+    if model.mode == "api" and not api_key:
         print("警告: 未检测到 DASHSCOPE_API_KEY 环境变量，请确保已设置或在代码中手动填入。")
         # 如果需要演示，可以切回 mock 模式
         # model.mode = "mock"
-    
-    with open("data/dataset.json", "r", encoding="utf-8") as f:
-        dataset = json.load(f)
-
-    print(f"开始评估，共 {len(dataset)} 个任务...")
-    
-    results = []
-    for item in dataset:
-        img_id = item["id"]
-        img_path = item["image_path"]
-        instruction = item["instruction"]
-        gt_bbox = item["bbox"]
-
-        print(f"\n任务 {img_id}: {instruction}")
-        
-        # 1. 图像预处理 (推理增强：添加视觉网格)
-        raw_img = Image.open(img_path)
-        # grid_img = add_visual_grid(raw_img.copy())
-        # grid_img.save(f"output/{img_id}_grid.png")
-
-        # 2. 模型推理
-        thought, pred_bbox = model.predict(img_path, instruction)
-        
-        print(f"思考过程: {thought}")
-        print(f"预测 BBox: {pred_bbox}")
-        print(f"真实 BBox: {gt_bbox}")
-
-        # 3. 结果可视化（Pred=红色，GT=绿色）
-        result_img = draw_bbox(raw_img.copy(), pred_bbox, label="Pred", color="red", line_width=3)
-        result_img = draw_bbox(result_img, gt_bbox, label="GT", color="lime", line_width=3)
-        
-        save_path = f"output/result_{img_id}.png"
-        result_img.save(save_path)
-        
-        results.append({
-            "id": img_id,
-            "instruction": instruction,
-            "pred_bbox": pred_bbox,
-            "gt_bbox": gt_bbox,
-            "thought": thought
-        })
-
-    # 保存结果
-    with open("output/results.json", "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=4)
-    
+
+    if model.mode == "local" and workers > 1:
+        # 本地模型不是线程安全的，并发只对 API / Mock 模式有意义
+        print("提示: 本地模式不支持并发推理，已切换为串行执行。")
+        workers = 1
+
+    # 分片数据集按需流式读取，不会一次性载入全部元数据
+    dataset = open_dataset(dataset_path)
+    if shard is not None:
+        dataset = DatasetShard(dataset, *shard)
+
+    visualizer = visualizer or VisualizationWriter("output")
+    visualizer.instrumentation = instrumentation
+
+    # 每条结果完成后立即追加写入日志，中断后可用 --resume 续跑
+    journal = ResultJournal(paths["journal"], resume=resume)
+    done = journal.completed() if resume else set()
+    pending = (item for item in dataset if str(item["id"]) not in done)
+
+    shard_note = f"分片 {shard[0]}/{shard[1]}，" if shard is not None else ""
+    print(f"开始评估，{shard_note}共 {len(dataset)} 个任务（已完成 {len(done)} 个，并发数 {workers}）...")
+
+    # 原始输出逐条归档，调整解析规则后可用 python3 -m src.archive reparse 离线重建结果
+    archive = ResponseArchive(paths["archive"], mode="a" if resume else "w")
+
+    # 推理在线程池中并发（或本地批量）进行，结果按数据集顺序返回，保证输出与串行一致
+    tracker = PeakMemoryTracker()
+    tracker.reset()
+    try:
+        for item, image, raw in iter_predictions(model, pending, workers, rate_limit, batch_size):
+            archive.append(item["id"], raw)
+            with instrumentation.span("parse"):
+                thought, pred_bbox = parse_raw(raw)
+            if memory_budget is not None:
+                # 推理已完成，立即释放解码图像和字节：可视化线程需要时重新读取，
+                # 排队中的可视化任务不会各自持有一整张解码后的截图
+                image.release()
+            _handle_result(item, image, thought, pred_bbox, journal, visualizer, raw_error(raw))
+            _record_peak_memory(item, tracker.peak(), instrumentation, memory_budget)
+            tracker.reset()
+    except KeyboardInterrupt:
+        print(f"\n评估被中断，已完成的结果保存在 {paths['journal']}，使用 --resume 继续。")
+        raise
+    finally:
+        journal.close()
+        archive.close()
+        visualizer.close()
+    if visualizer.dropped:
+        print(f"\n提示: 可视化队列已满（--vis-drop-when-full），跳过了 {visualizer.dropped} 张结果图的写入。")
+
+    # 保存结果：按数据集顺序整理日志
+    results = journal.compact(dataset, paths["results"])
+    # 各阶段耗时、token 用量、缓存命中等埋点统计
+    instrumentation.dump(paths["instrumentation"])
+
+    # 汇总指标
+    _print_report(results, os.path.basename(paths["results"]))
+
+    peaks = instrumentation.summary()["values"].get("task_peak_rss_mb")
+    if peaks:
+        print(f"\n每任务峰值 RSS: p50 {peaks['p50']} MB，p95 {peaks['p95']} MB，最大 {peaks['max']} MB。")
+
+    if cache is not None:
+        stats = cache.stats()
+        print(f"\n缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次（共 {stats['entries']} 条）。")
+        cache.close()
+
+    if model.mode == "local" and prefix_cache is not None:
+        stats = prefix_cache.stats()
+        print(f"\n共享前缀命中 {stats['hits']} 次，未命中 {stats['misses']} 次，淘汰 {stats['evictions']} 次。")
+
     print("\n评估完成，结果已保存至 output/ 目录。")
 
-if __name__ == "__main__":
-    run_evaluation()
 
+def _record_peak_memory(item, peak, instrumentation, memory_budget):
+    instrumentation.observe("task_peak_rss_mb", peak["rss_mb"])
+    note = f"峰值内存: {peak['rss_mb']} MB"
+    if "gpu_mb" in peak:
+        instrumentation.observe("task_peak_gpu_mb", peak["gpu_mb"])
+        note += f"（显存 {peak['gpu_mb']} MB）"
+    print(note)
+    if memory_budget is not None and memory_budget.exceeded(peak["rss_mb"]):
+        print(f"警告: 任务 {item['id']} 的峰值内存超出预算 {memory_budget.max_mb} MB。")
+
+
+def _print_report(results, name):
+    results, errors = split_errors(results)
+    if errors:
+        print(f"\n客户端 / API 错误 {len(errors)} 条（请求失败，未计入模型指标），可用 --resume 重新推理。")
+    if results:
+        report = score(
+            to_bbox_array([r["pred_bbox"] for r in results]),
+            to_bbox_array([r["gt_bbox"] for r in results]),
+            instruction_types(results),
+        )
+        print("\n" + format_table({name: report}))
+
+
+def merge_evaluation(dataset_path, count):
+    """把 count 个分片的部分结果和原始输出归档合并为 output/results.json 与 output/responses.archive。"""
+    results, missing = merge_shards(
+        open_dataset(dataset_path), count, OUTPUT_PATHS["results"], OUTPUT_PATHS["archive"]
+    )
+    if missing:
+        print(f"警告: 分片 {missing} 没有部分结果，合并结果不完整（可对这些分片加 --resume 重新运行）。")
+    print(f"已合并 {count} 个分片的 {len(results)} 条结果至 {OUTPUT_PATHS['results']}")
+    _print_report(results, os.path.basename(OUTPUT_PATHS["results"]))
+
+
+def _build_preprocessor(args):
+    if args.max_pixels is None and args.tile_size is None:
+        return None
+    return Preprocessor(
+        max_pixels=args.max_pixels,
+        tile_size=args.tile_size,
+        tile_overlap=args.tile_overlap,
+        tile_workers=max(1, args.workers),
+    )
+
+
+def _build_prefix_cache(args):
+    if not args.prefix_cache:
+        return None
+    return PrefixCache(
+        max_bytes=args.prefix_cache_mb * 1024 * 1024,
+        min_free_bytes=args.prefix_cache_min_free_mb * 1024 * 1024,
+    )
+
+
+def _build_api_client(args):
+    return DashScopeClient(
+        os.getenv("DASHSCOPE_API_KEY"),
+        base_url=args.api_base_url,
+        timeout=args.api_timeout,
+        retry=RetryPolicy(max_retries=args.max_retries),
+        breaker=CircuitBreaker(args.breaker_threshold, args.breaker_reset) if args.breaker_threshold > 0 else None,
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="UI Grounding 评估脚本")
+    parser.add_argument("--dataset", default="data/dataset.json", help="dataset.json 或分片数据集目录")
+    parser.add_argument("--mode", choices=sorted(BACKENDS), default="api", help="推理后端（默认 api）")
+    parser.add_argument("--model", default="qwen-vl-max", help="API 模式的模型名，或本地模式的权重路径")
+    parser.add_argument("--workers", type=int, default=1, help="同时在途的推理请求数（默认 1，即串行）")
+    parser.add_argument("--rate-limit", type=float, default=None, help="每秒最多发起的请求数（默认不限速）")
+    parser.add_argument("--batch-size", type=int, default=1, help="本地模式下每个批次的样本数（默认 1）")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="预测缓存文件路径")
+    parser.add_argument("--no-cache", action="store_true", help="绕过预测缓存，所有任务重新推理")
+    parser.add_argument("--resume", action="store_true", help="从结果日志续跑，跳过已完成的任务")
+    parser.add_argument("--vis", choices=VIS_MODES, default="all",
+                        help="结果可视化：all 全部 / none 不绘制 / failures 仅失败样本 / every 每 N 个")
+    parser.add_argument("--vis-every", type=int, default=10, help="--vis every 时的采样间隔")
+    parser.add_argument("--vis-format", choices=sorted(VIS_FORMATS), default="png", help="可视化图片格式")
+    parser.add_argument("--vis-max-side", type=int, default=None, help="可视化缩略图的最长边（像素）")
+    parser.add_argument("--vis-drop-when-full", action="store_true",
+                        help="可视化队列已满时跳过该张结果图，而不是等待写入（推理循环不会被可视化拖慢）")
+    parser.add_argument("--max-pixels", type=int, default=None, help="推理前把图像缩放到该像素预算以内")
+    parser.add_argument("--tile-size", type=int, default=None, help="切片边长（像素），超长截图切片后逐片定位")
+    parser.add_argument("--tile-overlap", type=float, default=0.2, help="相邻切片的重叠比例")
+    parser.add_argument("--memory-budget-mb", type=int, default=None,
+                        help="单进程内存预算（MB）：推理前按预算缩小超大截图并及时释放解码图像")
+    parser.add_argument("--decoding", choices=DECODING_MODES, default="full",
+                        help="解码模式：full 完整 CoT / early_stop 输出完整 BBox 后立即停止 / coords 只输出坐标")
+    parser.add_argument("--prefix-cache", action="store_true",
+                        help="本地模式：按截图分组推理，同一截图的指令共享视觉编码和 prompt 前缀的 KV cache")
+    parser.add_argument("--prefix-cache-mb", type=int, default=2048, help="共享前缀缓存的显存上限（MB）")
+    parser.add_argument("--prefix-cache-min-free-mb", type=int, default=1024,
+                        help="可用显存低于该值时淘汰共享前缀缓存（MB）")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="只评估第 i 个分片（共 N 个，i 从 0 开始），如 0/4；多机共享存储时每台机器各跑一部分")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="在本机启动的评估进程数，每个进程处理一个分片，结束后自动合并")
+    parser.add_argument("--devices", default=None, help="多进程时轮流分配的 GPU 编号，如 0,1,2,3")
+    parser.add_argument("--merge-shards", type=int, default=None, metavar="N",
+                        help="只合并 N 个分片的部分结果，不做推理")
+    parser.add_argument("--api-base-url", default=os.getenv("DASHSCOPE_BASE_URL", DEFAULT_BASE_URL),
+                        help="DashScope 兼容接口地址（可指向 src/mock_server.py 启动的本地服务）")
+    parser.add_argument("--api-timeout", type=float, default=60.0, help="单次 API 请求的超时（秒）")
+    parser.add_argument("--max-retries", type=int, default=3, help="限流 / 5xx / 超时后的最大重试次数")
+    parser.add_argument("--breaker-threshold", type=int, default=10,
+                        help="连续失败多少次后熔断（快速失败），0 表示不熔断")
+    parser.add_argument("--breaker-reset", type=float, default=10.0, help="熔断后多少秒放行试探请求")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.merge_shards:
+        merge_evaluation(args.dataset, args.merge_shards)
+        sys.exit(0)
+    if args.processes > 1 and args.shard is None:
+        devices = args.devices.split(",") if args.devices else None
+        codes = launch_workers(__file__, sys.argv[1:], args.processes, devices=devices)
+        failed = [index for index, code in enumerate(codes) if code != 0]
+        if failed:
+            # 有分片失败时不合并，避免得到不完整的 results.json
+            print(f"错误: 分片 {failed} 的评估进程异常退出，未合并结果。"
+                  f"对这些分片加 --resume 重新运行后，用 --merge-shards {args.processes} 合并。")
+            sys.exit(1)
+        merge_evaluation(args.dataset, args.processes)
+        sys.exit(0)
+    run_evaluation(
+        dataset_path=args.dataset,
+        mode=args.mode,
+        model_path=args.model,
+        workers=args.workers,
+        rate_limit=args.rate_limit,
+        batch_size=args.batch_size,
+        cache_path=None if args.no_cache else args.cache_path,
+        resume=args.resume,
+        preprocessor=_build_preprocessor(args),
+        visualizer=VisualizationWriter(
+            "output",
+            mode=args.vis,
+            every=args.vis_every,
+            image_format=args.vis_format,
+            max_side=args.vis_max_side,
+            drop_when_full=args.vis_drop_when_full,
+        ),
+        api_client=_build_api_client(args) if args.mode == "api" else None,
+        shard=args.shard,
+        prefix_cache=_build_prefix_cache(args) if args.mode == "local" else None,
+        decoding=args.decoding,
+        memory_budget=MemoryBudget(args.memory_budget_mb) if args.memory_budget_mb else None,
+    )
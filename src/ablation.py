@@ -0,0 +1,289 @@
+"""
+声明式消融实验：在同一数据集上一次性对比多组 模型 / prompt（解码模式）/ 预处理 配置。
+
+    python3 -m src.ablation ablation.json
+
+实验文件示例（matrix 中各维度做笛卡尔积，configs 中的条目逐个追加，未给出的字段取 defaults）：
+
+    {
+        "dataset": "data/dataset.json",
+        "output_dir": "output/ablation",
+        "workers": 16,
+        "defaults": {"mode": "api"},
+        "matrix": {"model": ["qwen-vl-max", "qwen-vl-plus"], "decoding": ["full", "coords"], "grid_size": [null, 100]},
+        "configs": [{"name": "max-1280px", "model": "qwen-vl-max", "max_pixels": 1638400}]
+    }
+
+每张截图只读取、解码一次，相同预处理配置的视图只计算一次，在各配置之间共享；
+(任务, 配置) 对在同一个线程池中并发执行。各配置的结果写入 output_dir/<name>/，
+合并的对比表写入 output_dir/comparison.md 和 comparison.json。
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+
+from src.archive import ResponseArchive
+from src.cache import DEFAULT_CACHE_PATH, PredictionCache
+from src.concurrency import RequestLimiter, run_concurrent
+from src.dataset import open_dataset
+from src.grounding_model import UIGroundingModel
+from src.image_io import ImageHandle
+from src.instrumentation import Instrumentation
+from src.journal import ResultJournal
+from src.metrics import format_table, instruction_types, score, split_errors, to_bbox_array
+from src.parser import parse_raw, raw_error
+from src.preprocess import Preprocessor
+
+# 单个实验配置的字段及默认值
+DEFAULT_CONFIG = {
+    "mode": "api",
+    "model": "qwen-vl-max",
+    "decoding": "full",
+    "max_pixels": None,
+    "tile_size": None,
+    "tile_overlap": 0.2,
+    "grid_size": None,
+}
+
+
+def expand_configs(spec):
+    """
+    把实验文件展开为配置列表：matrix 的笛卡尔积在前，configs 中的条目在后。
+    未命名的配置以其在 matrix 中的取值命名（如 model=qwen-vl-max,decoding=coords）。
+    """
+    defaults = dict(DEFAULT_CONFIG, **spec.get("defaults", {}))
+    configs = []
+    matrix = spec.get("matrix", {})
+    if matrix:
+        keys = list(matrix)
+        for values in itertools.product(*(matrix[k] for k in keys)):
+            config = dict(defaults, **dict(zip(keys, values)))
+            config.setdefault("name", ",".join(f"{k}={v}" for k, v in zip(keys, values)))
+            configs.append(config)
+    for entry in spec.get("configs", []):
+        config = dict(defaults, **entry)
+        config.setdefault("name", f"config-{len(configs)}")
+        configs.append(config)
+
+    if not configs:
+        raise ValueError("实验文件中没有任何配置（matrix / configs 均为空）")
+    names = set()
+    for config in configs:
+        unknown = set(config) - set(DEFAULT_CONFIG) - {"name"}
+        if unknown:
+            raise ValueError(f"配置 {config['name']} 含有未知字段: {', '.join(sorted(unknown))}")
+        if config["name"] in names:
+            raise ValueError(f"配置名重复: {config['name']}")
+        names.add(config["name"])
+    return configs
+
+
+class SharedViews:
+    """
+    在多个实验配置之间共享同一预处理配置的视图：每个任务的视图只计算一次，
+    该任务的所有配置完成后调用 forget() 释放。其余属性（signature / tile_workers 等）透传给 Preprocessor。
+    """
+
+    def __init__(self, preprocessor):
+        self.preprocessor = preprocessor
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.preprocessor, name)
+
+    def views(self, image):
+        with self._lock:
+            entry = self._views.get(id(image))
+            if entry is None:
+                entry = self._views[id(image)] = [threading.Lock(), None]
+        # 同一任务的多个配置可能同时到达，只有第一个真正计算
+        with entry[0]:
+            if entry[1] is None:
+                entry[1] = self.preprocessor.views(image)
+            return entry[1]
+
+    def forget(self, image):
+        with self._lock:
+            self._views.pop(id(image), None)
+
+
+class _Run:
+    """单个实验配置的模型、结果日志、原始输出归档和埋点。"""
+
+    def __init__(self, config, model, run_dir, resume):
+        self.config = config
+        self.model = model
+        self.run_dir = run_dir
+        self.journal = ResultJournal(os.path.join(run_dir, "results.journal.jsonl"), resume=resume)
+        self.done = self.journal.completed() if resume else set()
+        self.archive = ResponseArchive(os.path.join(run_dir, "responses.archive"), mode="a" if resume else "w")
+
+    def close(self):
+        self.journal.close()
+        self.archive.close()
+
+
+def _build_runs(configs, spec, out_dir, cache, resume, request_limiter):
+    shared = {}
+    runs = []
+    for config in configs:
+        preprocessor = None
+        if config["max_pixels"] or config["tile_size"] or config["grid_size"]:
+            p = Preprocessor(
+                max_pixels=config["max_pixels"],
+                tile_size=config["tile_size"],
+                tile_overlap=config["tile_overlap"],
+                grid_size=config["grid_size"],
+            )
+            preprocessor = shared.setdefault(p.signature(), SharedViews(p))
+        model = UIGroundingModel(
+            model_path=config["model"],
+            mode=config["mode"],
+            api_key=os.getenv("DASHSCOPE_API_KEY"),
+            cache=cache,
+            mock_dataset=spec["dataset"],
+            preprocessor=preprocessor,
+            instrumentation=Instrumentation(),
+            decoding=config["decoding"],
+            request_limiter=request_limiter if config["mode"] == "api" else None,
+        )
+        runs.append(_Run(config, model, os.path.join(out_dir, config["name"]), resume))
+    return runs, list(shared.values())
+
+
+def run_ablation(spec, resume=False):
+    """
+    运行实验文件 spec（已解析的字典），返回 {配置名: 指标报告}。
+    resume 为 True 时每个配置跳过其结果日志中已完成的任务。
+    """
+    configs = expand_configs(spec)
+    out_dir = spec.get("output_dir", "output/ablation")
+    os.makedirs(out_dir, exist_ok=True)
+    dataset = open_dataset(spec["dataset"])
+    if spec.get("limit"):
+        dataset = list(itertools.islice(dataset, spec["limit"]))
+
+    cache_path = spec.get("cache", DEFAULT_CACHE_PATH)
+    cache = PredictionCache(cache_path) if cache_path else None
+    workers = spec.get("workers", 8)
+    # 各 API 配置共享同一个请求级限流器：切片请求同样计入并发数和速率限制
+    request_limiter = RequestLimiter(workers, spec.get("rate_limit"))
+    runs, shared_views = _build_runs(configs, spec, out_dir, cache, resume, request_limiter)
+
+    if any(run.model.mode == "local" for run in runs) and workers > 1:
+        # 本地模型不是线程安全的
+        print("提示: 实验中包含本地模式的配置，已切换为串行执行。")
+        workers = 1
+
+    def _pairs():
+        # 同一任务的各配置相邻排列：共享的图像句柄和视图在它们全部完成后释放
+        for item in dataset:
+            todo = [run for run in runs if str(item["id"]) not in run.done]
+            image = ImageHandle(item["image_path"])
+            for k, run in enumerate(todo):
+                yield item, image, run, k == len(todo) - 1
+
+    def _predict(pair):
+        item, image, run, _ = pair
+        start = time.perf_counter()
+        raw = run.model.predict_raw(image, item["instruction"])
+        return raw, time.perf_counter() - start
+
+    print(f"开始消融实验：{len(runs)} 组配置 × {len(dataset)} 个任务（并发数 {workers}）...")
+    start = time.perf_counter()
+    finished = 0
+    try:
+        for (item, image, run, last), (raw, elapsed) in run_concurrent(
+            _predict, _pairs(), max_workers=workers,
+            rate_limit=None if any(run.model.mode == "api" for run in runs) else spec.get("rate_limit"),
+        ):
+            run.archive.append(item["id"], raw)
+            thought, pred_bbox = parse_raw(raw)
+            run.model.instrumentation.observe("task_latency_ms", elapsed * 1000)
+            result = {
+                "id": item["id"],
+                "instruction": item["instruction"],
+                "pred_bbox": pred_bbox,
+                "gt_bbox": item["bbox"],
+                "thought": thought,
+            }
+            error = raw_error(raw)
+            if error is not None:
+                # 请求失败不算完成（--resume 时重试），也不计入该配置的指标
+                result["error"] = error
+            run.journal.append(result)
+            if last:
+                for views in shared_views:
+                    views.forget(image)
+                image.release()
+                finished += 1
+                if finished % 50 == 0:
+                    print(f"已完成 {finished} 个任务（{time.perf_counter() - start:.1f} 秒）", flush=True)
+    except KeyboardInterrupt:
+        print(f"\n实验被中断，已完成的结果保存在 {out_dir}/，使用 --resume 继续。")
+        raise
+    finally:
+        for run in runs:
+            run.close()
+    wall = time.perf_counter() - start
+
+    reports = {}
+    summary = {"dataset": spec["dataset"], "wall_seconds": round(wall, 2), "configs": {}}
+    for run in runs:
+        name = run.config["name"]
+        results = run.journal.compact(dataset, os.path.join(run.run_dir, "results.json"))
+        run.model.instrumentation.dump(os.path.join(run.run_dir, "instrumentation.json"))
+        results, errors = split_errors(results)
+        if errors:
+            print(f"提示: 配置 {name} 有 {len(errors)} 条客户端 / API 错误，未计入指标。")
+        if not results:
+            continue
+        reports[name] = score(
+            to_bbox_array([r["pred_bbox"] for r in results]),
+            to_bbox_array([r["gt_bbox"] for r in results]),
+            instruction_types(results),
+        )
+        values = run.model.instrumentation.summary()["values"]
+        summary["configs"][name] = {
+            "config": run.config,
+            "overall": reports[name]["overall"],
+            "client_errors": len(errors),
+            "latency_ms": values.get("task_latency_ms"),
+            "output_tokens": values.get("output_tokens"),
+        }
+
+    table = format_table(reports)
+    with open(os.path.join(out_dir, "comparison.md"), "w", encoding="utf-8") as f:
+        f.write(table + "\n")
+    with open(os.path.join(out_dir, "comparison.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=4)
+    print("\n" + table)
+    if cache is not None:
+        cache.close()
+    print(f"\n消融实验完成（{wall:.1f} 秒），各配置结果与对比表已保存至 {out_dir}/")
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="声明式消融实验（模型 / prompt / 预处理配置矩阵）")
+    parser.add_argument("spec", help="实验文件（JSON）")
+    parser.add_argument("--resume", action="store_true", help="跳过各配置结果日志中已完成的任务")
+    parser.add_argument("--workers", type=int, default=None, help="覆盖实验文件中的并发数")
+    parser.add_argument("--limit", type=int, default=None, help="只使用数据集的前 N 个任务")
+    args = parser.parse_args()
+
+    with open(args.spec, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    if args.workers is not None:
+        spec["workers"] = args.workers
+    if args.limit is not None:
+        spec["limit"] = args.limit
+    run_ablation(spec, resume=args.resume)
+
+
+if __name__ == "__main__":
+    main()
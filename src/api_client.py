@@ -0,0 +1,133 @@
+import base64
+import email.utils
+import http.client
+import json
+import socket
+import time
+import urllib.error
+import urllib.request
+
+from src.resilience import RetryPolicy, TransientError, call_with_retry
+
+DEFAULT_BASE_URL = "https://dashscope.aliyuncs.com/api/v1"
+GENERATION_PATH = "/services/aigc/multimodal-generation/generation"
+
+# 这些 HTTP 状态码表示限流或服务端暂时不可用，可以重试
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+_IMAGE_MIME = (
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8", "image/jpeg"),
+    (b"RIFF", "image/webp"),
+    (b"GIF8", "image/gif"),
+)
+
+
+class APIError(Exception):
+    """服务端返回的不可重试错误（如参数错误、鉴权失败）。"""
+
+    def __init__(self, status, code, message):
+        super().__init__(f"{status} {code} - {message}")
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+class _RetryableAPIError(TransientError):
+    def __init__(self, status, code, message, retry_after=None):
+        super().__init__(f"{status} {code} - {message}", retry_after)
+        self.status = status
+        self.code = code
+
+
+def image_data_uri(data):
+    """把图像字节编码为 data URI，不依赖文件路径，本地切片 / 打包图像也能直接上传。"""
+    mime = next((m for magic, m in _IMAGE_MIME if data.startswith(magic)), "image/png")
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def _parse_retry_after(value):
+    """Retry-After 可以是秒数或 HTTP 日期，解析失败时返回 None。"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class DashScopeClient:
+    """
+    DashScope 多模态生成接口的 HTTP 客户端（兼容接口的本地服务见 src/mock_server.py）：
+
+    - timeout: 单次请求的超时（秒）；
+    - retry: 重试策略（src.resilience.RetryPolicy），限流、5xx、超时和连接错误会按带抖动的指数退避重试，
+      并遵守服务端返回的 Retry-After；
+    - breaker: 熔断器（src.resilience.CircuitBreaker），连续失败后快速失败，None 表示不熔断。
+
+    默认参数（3 次重试、不熔断）适合直接构造；main.py 会按命令行参数组装。
+    """
+
+    def __init__(self, api_key=None, base_url=DEFAULT_BASE_URL, timeout=60.0, retry=None,
+                 breaker=None, instrumentation=None):
+        self.api_key = api_key
+        self.url = base_url.rstrip("/") + GENERATION_PATH
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker
+        self.instrumentation = instrumentation
+
+    def generate(self, model, image_data, prompt):
+        """
+        发送一张图像和一段文本，返回 (输出文本, usage 字典)。
+        重试耗尽抛出 TransientError，不可重试的错误抛出 APIError，熔断时抛出 CircuitOpenError。
+        """
+        body = json.dumps({
+            "model": model,
+            "input": {
+                "messages": [
+                    {"role": "user", "content": [{"image": image_data_uri(image_data)}, {"text": prompt}]}
+                ]
+            },
+        }).encode("utf-8")
+        payload = call_with_retry(
+            lambda: self._post(body), self.retry, self.breaker, self.instrumentation
+        )
+        content = payload["output"]["choices"][0]["message"]["content"]
+        # 如果返回的是列表，提取文本内容
+        if isinstance(content, list):
+            content = next((item["text"] for item in content if "text" in item), "")
+        return content, payload.get("usage") or {}
+
+    def _post(self, body):
+        request = urllib.request.Request(self.url, data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                detail = json.loads(e.read())
+            except (ValueError, OSError):
+                detail = {}
+            code = detail.get("code", "")
+            message = detail.get("message", e.reason)
+            if e.code in RETRYABLE_STATUS:
+                if self.instrumentation is not None:
+                    self.instrumentation.count(f"http_{e.code}")
+                raise _RetryableAPIError(
+                    e.code, code, message, _parse_retry_after(e.headers.get("Retry-After"))
+                ) from e
+            raise APIError(e.code, code, message) from e
+        except (socket.timeout, TimeoutError) as e:
+            if self.instrumentation is not None:
+                self.instrumentation.count("api_timeout")
+            raise TransientError(f"timeout after {self.timeout}s") from e
+        except (urllib.error.URLError, http.client.HTTPException, ConnectionError) as e:
+            raise TransientError(f"connection error: {e}") from e
@@ -0,0 +1,206 @@
+"""
+模型原始输出归档与离线重新解析。
+
+评估时每个任务的原始输出记录（见 UIGroundingModel.predict_raw）逐条压缩追加到归档中；
+修改解析或归一化规则后，用 reparse 从归档重建 results.json 并重新计算指标，无需模型和网络：
+
+    python3 -m src.archive reparse --dataset data/dataset.json
+    python3 -m src.archive show 42
+"""
+import argparse
+import json
+import os
+import zlib
+
+from src.dataset import open_dataset
+from src.journal import truncate_partial_line
+from src.metrics import format_table, instruction_types, score, split_errors, to_bbox_array
+from src.parser import parse_raw, raw_error
+
+DEFAULT_ARCHIVE_PATH = "output/responses.archive"
+
+_MAGIC = b"RSPARCH1"
+# 预置压缩字典：单条记录很短，用输出格式中反复出现的片段作为字典可以明显提高压缩率。
+# 修改字典会导致旧归档无法解压，需要同时更换 _MAGIC。
+_ZDICT = (
+    '{"size": [, "views": [{"tile": null, "size": [, "response": "Thought: \\nBBox: [0., 0., 0., 0.]"}]}'
+    '{"error": "API Error: API Exception: '
+    "界面 布局 顶部 底部 左侧 右侧 中间 按钮 图标 输入框 搜索 菜单 链接 导航栏 状态栏 "
+    "根据指令 目标元素 位于 坐标 归一化 在图片中找到了与指令 相关的元素 "
+).encode("utf-8")
+
+
+class ResponseArchive:
+    """
+    模型原始输出的归档，追加写入、逐条 zlib 压缩：
+
+    - <path>: 数据文件，文件头之后依次存放压缩后的 JSON 记录；
+    - <path>.idx: 索引（TSV：id、偏移、长度），每条记录写入后追加一行并 flush。
+
+    mode 与 open() 一致："r" 只读，"w" 新建（清空旧归档），"a" 续写。
+    同一 id 出现多次时以最后一条为准；进程异常退出留下的残缺记录会被忽略。
+    """
+
+    def __init__(self, path=DEFAULT_ARCHIVE_PATH, mode="r"):
+        if mode not in ("r", "w", "a"):
+            raise ValueError(f"未知的打开模式: {mode}")
+        self.path = path
+        self.index_path = path + ".idx"
+        self.mode = mode
+        self._data = None
+        self._index_file = None
+        self._reader = None
+
+        if mode == "r":
+            self._offsets = self._load_index()
+            self._reader = open(path, "rb")
+            if self._reader.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{path} 不是响应归档文件")
+            return
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if mode == "a":
+            # 索引中崩溃留下的半行会吞掉续写的第一条索引
+            truncate_partial_line(self.index_path)
+        self._offsets = self._load_index() if mode == "a" else {}
+        self._data = open(path, "ab" if mode == "a" else "wb")
+        self._index_file = open(self.index_path, "a" if mode == "a" else "w", encoding="utf-8")
+        if self._data.tell() == 0:
+            self._data.write(_MAGIC)
+            self._data.flush()
+
+    def _load_index(self):
+        offsets = {}
+        if not os.path.exists(self.index_path) or not os.path.exists(self.path):
+            return offsets
+        data_size = os.path.getsize(self.path)
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 3:
+                    continue
+                task_id, offset, length = parts[0], int(parts[1]), int(parts[2])
+                if offset + length <= data_size:
+                    offsets[task_id] = (offset, length)
+        return offsets
+
+    def append(self, task_id, raw):
+        """写入一条原始输出记录。先写数据再写索引，中途退出时只会留下没有索引的残缺数据。"""
+        compressor = zlib.compressobj(6, zdict=_ZDICT)
+        payload = compressor.compress(json.dumps(raw, ensure_ascii=False).encode("utf-8")) + compressor.flush()
+        offset = self._data.tell()
+        self._data.write(payload)
+        self._data.flush()
+        self._index_file.write(f"{task_id}\t{offset}\t{len(payload)}\n")
+        self._index_file.flush()
+        self._offsets[str(task_id)] = (offset, len(payload))
+
+    def get(self, task_id):
+        """按任务 id 读取原始输出记录，不存在时返回 None。"""
+        entry = self._offsets.get(str(task_id))
+        if entry is None:
+            return None
+        if self._reader is None:
+            self._reader = open(self.path, "rb")
+        offset, length = entry
+        self._reader.seek(offset)
+        decompressor = zlib.decompressobj(zdict=_ZDICT)
+        return json.loads(decompressor.decompress(self._reader.read(length)))
+
+    def ids(self):
+        return list(self._offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, task_id):
+        return str(task_id) in self._offsets
+
+    def close(self):
+        if self._data is not None and not self._data.closed:
+            self._data.flush()
+            os.fsync(self._data.fileno())
+            self._data.close()
+            self._index_file.flush()
+            os.fsync(self._index_file.fileno())
+            self._index_file.close()
+        if self._reader is not None:
+            self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def reparse(archive_path, dataset_path, out_path):
+    """
+    用当前的解析器把归档中的原始输出重新解析，按数据集顺序写出与 run_evaluation 格式一致的
+    results.json，返回结果列表。数据集中没有归档记录的样本会被跳过。
+    """
+    results = []
+    with ResponseArchive(archive_path) as archive:
+        for item in open_dataset(dataset_path):
+            raw = archive.get(item["id"])
+            if raw is None:
+                continue
+            thought, pred_bbox = parse_raw(raw)
+            result = {
+                "id": item["id"],
+                "instruction": item["instruction"],
+                "pred_bbox": pred_bbox,
+                "gt_bbox": item["bbox"],
+                "thought": thought,
+            }
+            error = raw_error(raw)
+            if error is not None:
+                result["error"] = error
+            results.append(result)
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, out_path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型原始输出归档工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_reparse = sub.add_parser("reparse", help="用当前解析器从归档重建 results.json 并重新计算指标")
+    p_reparse.add_argument("--archive", default=DEFAULT_ARCHIVE_PATH)
+    p_reparse.add_argument("--dataset", default="data/dataset.json", help="dataset.json 或分片数据集目录")
+    p_reparse.add_argument("--output", default="output/results.json")
+
+    p_show = sub.add_parser("show", help="查看某个任务的原始输出")
+    p_show.add_argument("task_id")
+    p_show.add_argument("--archive", default=DEFAULT_ARCHIVE_PATH)
+
+    args = parser.parse_args()
+    if args.command == "reparse":
+        results = reparse(args.archive, args.dataset, args.output)
+        print(f"已从 {args.archive} 重新解析 {len(results)} 条结果，保存至 {args.output}")
+        results, errors = split_errors(results)
+        if errors:
+            print(f"其中 {len(errors)} 条为客户端 / API 错误，未计入模型指标。")
+        if results:
+            report = score(
+                to_bbox_array([r["pred_bbox"] for r in results]),
+                to_bbox_array([r["gt_bbox"] for r in results]),
+                instruction_types(results),
+            )
+            print("\n" + format_table({args.output: report}))
+    else:
+        with ResponseArchive(args.archive) as archive:
+            raw = archive.get(args.task_id)
+        if raw is None:
+            print(f"归档中没有任务 {args.task_id}")
+        else:
+            print(json.dumps(raw, ensure_ascii=False, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+推理后端注册表（mock / api / local）。
+
+每个后端只在实例化时导入自己依赖的重量级库：mock 和 api 模式不会导入 torch / transformers，
+CLI 和 API 评估进程因此可以在一秒内启动。新增后端时用 @register_backend("name") 注册即可。
+"""
+import os
+
+from src.api_client import DEFAULT_BASE_URL, APIError, DashScopeClient
+from src.dataset import open_dataset
+
+BACKENDS = {}
+
+# 解码模式：full 完整 CoT；early_stop 输出完整 BBox 后停止；coords 只输出坐标（本地模式按文法约束解码）
+DECODING_MODES = ("full", "early_stop", "coords")
+
+# 渲染共享前缀模板时代替指令的占位符
+_INSTRUCTION_MARKER = "\x00INSTRUCTION\x00"
+
+
+def register_backend(name):
+    def _register(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return _register
+
+
+def create_backend(name, owner):
+    """按名称实例化后端。owner 为所属的 UIGroundingModel，后端从中读取模型名、prompt 和埋点等配置。"""
+    if name not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {name}（可选: {', '.join(BACKENDS)}）")
+    return BACKENDS[name](owner)
+
+
+class Backend:
+    """
+    后端接口：
+
+    - batched: 是否支持把多个视图放进同一个批次推理（本地模型）；否则切片会在线程池中并行请求；
+    - predict(image, instruction): 直接返回整条原始输出记录、跳过预处理，返回 None 表示走通用的视图流程；
+    - generate(items, sizes): items 为 [(ImageHandle, instruction), ...]，sizes 为对应的图像尺寸，
+      返回一一对应的 {"response": 输出文本} 或 {"error": 错误信息}。
+    """
+
+    batched = False
+
+    def __init__(self, owner):
+        self.owner = owner
+
+    def predict(self, image, instruction):
+        return None
+
+    def generate(self, items, sizes):
+        raise NotImplementedError
+
+
+@register_backend("mock")
+class MockBackend(Backend):
+    """模拟输出，用于演示项目结构。按模型的输出格式生成文本，与真实推理走同样的解析流程。"""
+
+    def __init__(self, owner):
+        super().__init__(owner)
+        # 首次使用时建立 image_path -> item 索引
+        self._index = None
+        print("Running in MOCK mode (no model loaded)")
+
+    def predict(self, image, instruction):
+        # 简单的规则模拟，实际项目中应使用大模型
+        if self._index is None:
+            index = {}
+            for item in open_dataset(self.owner.mock_dataset):
+                index.setdefault(item["image_path"], item)
+            self._index = index
+
+        item = self._index.get(image.path)
+        if item is not None:
+            thought = f"在图片中找到了与指令 '{instruction}' 相关的元素 '{item['target']}'。"
+            response = f"Thought: {thought}\nBBox: {list(item['bbox'])}"
+        else:
+            response = "Thought: 无法识别目标元素。"
+        size = list(image.size)
+        return {"size": size, "views": [{"tile": None, "size": size, "response": response}]}
+
+
+def _usage_value(usage, key):
+    """DashScope 的 usage 既可能是字典也可能是对象，统一取值。"""
+    try:
+        value = usage[key]
+    except (KeyError, TypeError):
+        value = getattr(usage, key, None)
+    return value
+
+
+@register_backend("api")
+class ApiBackend(Backend):
+    """调用 DashScope 多模态生成接口（只依赖标准库的 HTTP 客户端）。"""
+
+    def __init__(self, owner):
+        super().__init__(owner)
+        owner.api_key = owner.api_key or os.getenv("DASHSCOPE_API_KEY")
+        # 默认连接 DashScope 官方接口，可通过 DASHSCOPE_BASE_URL 指向兼容的服务（如 src/mock_server.py）
+        if owner.api_client is None:
+            owner.api_client = DashScopeClient(
+                owner.api_key, base_url=os.getenv("DASHSCOPE_BASE_URL", DEFAULT_BASE_URL)
+            )
+        if owner.api_client.instrumentation is None:
+            owner.api_client.instrumentation = owner.instrumentation
+        self.client = owner.api_client
+        print(f"Using Qwen API Mode (Model: {owner.model_path}, {self.client.url})")
+
+    def generate(self, items, sizes):
+        return [self._call(image, instruction) for image, instruction in items]
+
+    def _call(self, image, instruction):
+        """
+        限流、5xx 和超时由客户端按退避策略重试，只有重试耗尽或不可重试的错误才会作为失败返回。
+        """
+        inst = self.owner.instrumentation
+        with inst.span("prompt_build"):
+            prompt = self.owner._build_prompt(instruction, tile=image.tile is not None)
+
+        try:
+            with inst.span("api_call"):
+                content, usage = self.client.generate(self.owner.model_path, image.data, prompt)
+        except APIError as e:
+            inst.count("api_error")
+            error_msg = f"API Error: {e}"
+        except Exception as e:
+            inst.count("api_exception")
+            error_msg = f"API Exception: {e}"
+        else:
+            # DashScope 在响应中返回本次调用的 token 用量
+            for key in ("input_tokens", "output_tokens", "image_tokens"):
+                value = _usage_value(usage, key)
+                if value is not None:
+                    inst.observe(key, value)
+            return {"response": content}
+        print(error_msg)
+        return {"error": error_msg}
+
+
+@register_backend("local")
+class LocalBackend(Backend):
+    """
+    本地 Qwen2-VL 推理。torch / transformers / qwen_vl_utils 只在这里导入，
+    依赖缺失时抛出 ImportError（UIGroundingModel 会回退到 mock 模式）。
+    """
+
+    batched = True
+
+    def __init__(self, owner):
+        super().__init__(owner)
+        from qwen_vl_utils import process_vision_info
+        from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+
+        self._process_vision_info = process_vision_info
+        print(f"Loading local model from {owner.model_path}...")
+        self.model = Qwen2VLForConditionalGeneration.from_pretrained(
+            owner.model_path, torch_dtype="auto", device_map="auto"
+        )
+        self.processor = AutoProcessor.from_pretrained(owner.model_path)
+        # 批量生成时 decoder-only 模型需要左侧 padding，保证各条样本的生成起点对齐
+        self.processor.tokenizer.padding_side = "left"
+        self._init_generation()
+
+    def _init_generation(self):
+        # 切片视图和整图视图的 prompt 不同，前缀 / 后缀模板分别缓存
+        self._templates = {}
+        self._coords_processor = None
+        if self.owner.prefix_cache is None:
+            return
+        import torch
+        from transformers import DynamicCache
+
+        self._torch = torch
+        self._DynamicCache = DynamicCache
+        if self.owner.prefix_cache.free_memory is None and torch.cuda.is_available():
+            def _free_memory():
+                # 缓存分配器中已保留但未使用的显存也算作可用，否则淘汰条目后可用显存不会增加
+                free, _ = torch.cuda.mem_get_info()
+                return free + torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+            self.owner.prefix_cache.free_memory = _free_memory
+
+    def generate(self, items, sizes):
+        """
+        本地模型推理：一个批次只做一次 processor 编码和一次 generate。
+        开启共享前缀缓存时改为逐条从截图的共享前缀状态解码，见 _generate_from_prefix。
+        """
+        if self.owner.prefix_cache is not None:
+            return [self._generate_from_prefix(image, instruction) for image, instruction in items]
+
+        inst = self.owner.instrumentation
+        texts = []
+        all_messages = []
+        for image, instruction in items:
+            with inst.span("prompt_build"):
+                prompt = self.owner._build_prompt(instruction, tile=image.tile is not None)
+            with inst.span("image_decode"):
+                decoded = image.decode()
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
+                        # 直接传入已解码的 PIL 图像，避免 process_vision_info 再读一次文件
+                        {"type": "image", "image": decoded},
+                        {"type": "text", "text": prompt},
+                    ],
+                }
+            ]
+            with inst.span("apply_chat_template"):
+                texts.append(
+                    self.processor.apply_chat_template(
+                        messages, tokenize=False, add_generation_prompt=True
+                    )
+                )
+            all_messages.append(messages)
+
+        with inst.span("process_vision_info"):
+            image_inputs, video_inputs = self._process_vision_info(all_messages)
+        with inst.span("processor"):
+            inputs = self.processor(
+                text=texts,
+                images=image_inputs,
+                videos=video_inputs,
+                padding=True,
+                return_tensors="pt",
+            )
+            inputs = inputs.to(self.model.device)
+
+        with inst.span("generate"):
+            generated_ids = self.model.generate(
+                **inputs, **self._generation_kwargs(
+                    inputs.input_ids.shape[1], sizes, [image.tile is not None for image, _ in items]
+                )
+            )
+        generated_ids_trimmed = [
+            out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+        ]
+        with inst.span("decode"):
+            responses = self.processor.batch_decode(
+                generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+            )
+
+        # 统计每条样本的输入 / 输出 token 数（不含 padding）
+        pad_id = self.processor.tokenizer.pad_token_id
+        for mask, out_ids in zip(inputs.attention_mask, generated_ids_trimmed):
+            inst.observe("input_tokens", int(mask.sum()))
+            inst.observe("output_tokens", int((out_ids != pad_id).sum()))
+
+        return [{"response": response} for response in responses]
+
+    def _generation_kwargs(self, prompt_length, sizes, tiles):
+        """
+        按解码模式构造 generate 的参数；prompt_length 为（padding 后的）输入长度，sizes 为各样本的图像尺寸，
+        tiles 为各样本是否为切片视图（coords 模式下切片视图的文法允许输出 BBox: NOT_FOUND）。
+        """
+        decoding = self.owner.decoding
+        if decoding == "full":
+            return {"max_new_tokens": 512}
+        from transformers import LogitsProcessorList, StoppingCriteriaList
+
+        from src.decoding import COORDS_MAX_NEW_TOKENS, BBoxLogitsProcessor, BBoxStoppingCriteria
+
+        tokenizer = self.processor.tokenizer
+        if decoding == "early_stop":
+            criteria = BBoxStoppingCriteria(tokenizer, prompt_length, sizes)
+            return {"max_new_tokens": 512, "stopping_criteria": StoppingCriteriaList([criteria])}
+        if self._coords_processor is None:
+            # 词表解码和文法状态表只构建一次，之后每次生成复用
+            self._coords_processor = BBoxLogitsProcessor(tokenizer)
+        return {
+            "max_new_tokens": COORDS_MAX_NEW_TOKENS,
+            "logits_processor": LogitsProcessorList([self._coords_processor.start(prompt_length, tiles)]),
+        }
+
+    def _prompt_template(self, tile=False):
+        """
+        把 chat template 渲染后的 prompt 切成与指令无关的前缀和含指令的后缀模板。
+        切分点取指令所在行的行首，前缀包含图像占位符和 system prompt 的前半部分；
+        在换行处切分使前缀和后缀分别分词的结果与整体分词一致。
+        """
+        if tile not in self._templates:
+            prompt = self.owner._build_prompt(_INSTRUCTION_MARKER, tile=tile)
+            messages = [{"role": "user", "content": [{"type": "image"}, {"type": "text", "text": prompt}]}]
+            text = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            cut = text.rfind("\n", 0, text.index(_INSTRUCTION_MARKER)) + 1
+            self._templates[tile] = (text[:cut], text[cut:])
+        return self._templates[tile]
+
+    def _prefill_prefix(self, image, prefix_text):
+        """对截图和 prompt 前缀做一次前向计算，返回可复用的前缀状态及其占用的字节数。"""
+        inst = self.owner.instrumentation
+        with inst.span("image_decode"):
+            decoded = image.decode()
+        messages = [{"role": "user", "content": [{"type": "image", "image": decoded}]}]
+        with inst.span("process_vision_info"):
+            image_inputs, _ = self._process_vision_info(messages)
+        with inst.span("processor"):
+            inputs = self.processor(text=[prefix_text], images=image_inputs, return_tensors="pt")
+            inputs = inputs.to(self.model.device)
+        with inst.span("prefill"), self._torch.no_grad():
+            outputs = self.model(**inputs, past_key_values=self._DynamicCache(), use_cache=True)
+        kv = outputs.past_key_values
+        entry = {
+            "input_ids": inputs.input_ids,
+            "kv": kv,
+            # Qwen2-VL 的 M-RoPE 在图像之后的位置偏移，续写时需要恢复，否则文本位置编码会错位
+            "rope_deltas": self._rope_holder().rope_deltas,
+        }
+        nbytes = sum(t.nbytes for layer in kv.to_legacy_cache() for t in layer)
+        return entry, nbytes
+
+    def _rope_holder(self):
+        # 较新版本的 transformers 把 rope_deltas 放在内层的 Qwen2VLModel 上
+        inner = getattr(self.model, "model", None)
+        return inner if hasattr(inner, "rope_deltas") else self.model
+
+    def _generate_from_prefix(self, image, instruction):
+        """
+        从截图的共享前缀状态解码单条指令：视觉编码和 prompt 前缀只在首次遇到该截图时计算，
+        之后的指令只需 prefill 指令后缀。解码完成后把 KV cache 裁回前缀长度，供下一条指令复用。
+        """
+        inst = self.owner.instrumentation
+        cache = self.owner.prefix_cache
+        tile = image.tile is not None
+        prefix_text, suffix_template = self._prompt_template(tile)
+
+        cache.shrink()
+        entry = cache.get(image.key) if image.key is not None else None
+        inst.count("prefix_cache_hit" if entry is not None else "prefix_cache_miss")
+        if entry is None:
+            entry, nbytes = self._prefill_prefix(image, prefix_text)
+            cache.put(image.key, entry, nbytes)
+
+        with inst.span("prompt_build"):
+            suffix = suffix_template.replace(_INSTRUCTION_MARKER, instruction)
+            suffix_ids = self.processor.tokenizer(suffix, add_special_tokens=False, return_tensors="pt").input_ids
+            input_ids = self._torch.cat([entry["input_ids"], suffix_ids.to(entry["input_ids"].device)], dim=1)
+        prefix_len = entry["input_ids"].shape[1]
+
+        self._rope_holder().rope_deltas = entry["rope_deltas"]
+        try:
+            with inst.span("generate"):
+                generated_ids = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=self._torch.ones_like(input_ids),
+                    past_key_values=entry["kv"],
+                    **self._generation_kwargs(input_ids.shape[1], [image.size], [tile]),
+                )
+        finally:
+            # generate 会原地追加 KV cache，恢复为共享前缀
+            entry["kv"].crop(prefix_len)
+        out_ids = generated_ids[0, input_ids.shape[1]:]
+        with inst.span("decode"):
+            response = self.processor.decode(
+                out_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
+            )
+        inst.observe("input_tokens", int(input_ids.shape[1]))
+        inst.observe("prefill_tokens", int(input_ids.shape[1] - prefix_len))
+        inst.observe("output_tokens", int(out_ids.shape[0]))
+        return {"response": response}
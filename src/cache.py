@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.image_io import ImageHandle
+
+DEFAULT_CACHE_PATH = ".cache/predictions.sqlite"
+
+# 缓存内容格式的版本号（记录在 SQLite 的 user_version 中），格式变化时旧条目会被清空
+SCHEMA_VERSION = 1
+
+
+class PredictionCache:
+    """
+    基于 SQLite 的持久化预测缓存（内容寻址）。
+
+    key 由图像字节、指令、模型名和 prompt 模板共同哈希得到，value 为模型的原始输出记录
+    （见 UIGroundingModel.predict_raw），命中后由当前的解析器重新解析。
+    超过 max_entries 或 max_bytes 时按最近最少使用（LRU）淘汰。
+    条数和总字节数在打开时统计一次，之后在内存中增量维护；命中时的 last_access 更新先记在内存中，
+    每 touch_batch 次命中、写入新条目、淘汰或关闭时批量写回，避免每次读写都扫全表或提交事务。
+    线程安全，可在并发评估中共享同一个实例；多个进程也可以共享同一个缓存文件（不适用于网络文件系统）。
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=100_000, max_bytes=512 * 1024 * 1024,
+                 touch_batch=256):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 图像内容哈希的内存索引：(path, mtime, size) -> sha256，避免重复读取同一文件
+        self._image_digests = {}
+        # 尚未写回的命中时间：key -> last_access
+        self._touched = {}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 多进程分片评估时各进程共享同一个缓存文件：WAL 模式允许读写并发，写锁冲突时最多等待 30 秒
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_access ON predictions(last_access)"
+        )
+        # 旧版本缓存保存的是解析后的 (thought, bbox)，无法重新解析，直接丢弃
+        (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+        if version != SCHEMA_VERSION:
+            self._conn.execute("DELETE FROM predictions")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.commit()
+        self._count, self._total = self._totals()
+
+    def image_digest(self, image):
+        """image 为图片路径或 ImageHandle；使用 ImageHandle 时复用其已读取的字节。"""
+        image = ImageHandle.coerce(image)
+        if image.path is None:
+            return hashlib.sha256(image.data).hexdigest()
+        if image.is_packed:
+            # 分片只追加不改写，引用本身就能唯一确定内容
+            stamp = (image.path,)
+        else:
+            stat = os.stat(image.path)
+            stamp = (image.path, stat.st_mtime_ns, stat.st_size)
+        digest = self._image_digests.get(stamp)
+        if digest is None:
+            digest = hashlib.sha256(image.data).hexdigest()
+            self._image_digests[stamp] = digest
+        return digest
+
+    def make_key(self, image, instruction, model_path, prompt):
+        h = hashlib.sha256()
+        for part in (self.image_digest(image), instruction, model_path, prompt):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch:
+                self._flush_touched()
+                self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time()),
+            )
+            self._touched.pop(key, None)
+            if old is None:
+                self._count += 1
+                self._total += size
+            else:
+                self._total += size - old[0]
+            self._flush_touched()
+            self._evict()
+            self._conn.commit()
+
+    def _totals(self):
+        return self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM predictions"
+        ).fetchone()
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE predictions SET last_access = ? WHERE key = ?",
+                [(ts, key) for key, ts in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _evict(self):
+        if self._count <= self.max_entries and self._total <= self.max_bytes:
+            return
+        # 内存中的计数不包含其他进程写入的条目，真正淘汰前重新统计一次（淘汰很少发生）
+        count, total = self._totals()
+        # 从最久未访问的条目开始删除，直到同时满足条数和容量限制
+        rows = self._conn.execute(
+            "SELECT key, size FROM predictions ORDER BY last_access ASC"
+        )
+        stale = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            stale.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM predictions WHERE key = ?", stale)
+        self._count, self._total = count, total
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM predictions")
+            self._conn.commit()
+            self._touched.clear()
+            self._count, self._total = 0, 0
+
+    def stats(self):
+        with self._lock:
+            count, total = self._count, self._total
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": total}
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket:
+    """
+    令牌桶限流器：每秒补充 rate 个令牌，最多积攒 capacity 个（允许短时突发）。
+    acquire() 在没有令牌时阻塞，线程安全。
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1.0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RequestLimiter:
+    """
+    后端请求级的并发与速率限制，作为上下文管理器使用：
+
+        with limiter:
+            send_request()
+
+    - max_in_flight: 同时在途的请求数上限（信号量），None 表示不限制；
+    - rate: 每秒最多发起的请求数（令牌桶），None 表示不限速。
+
+    与 run_concurrent 的任务级限制不同，一个任务拆成多个请求（如切片定位）时每个请求都会计数。
+    """
+
+    def __init__(self, max_in_flight=None, rate=None):
+        self._semaphore = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self._bucket = TokenBucket(rate) if rate else None
+
+    def __enter__(self):
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        if self._bucket is not None:
+            self._bucket.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+
+def run_concurrent(func, items, max_workers=8, rate_limit=None):
+    """
+    用线程池并发执行 func(item)，并按 items 的原始顺序逐个 yield (item, result)。
+
+    - max_workers: 同时在途的请求数上限；
+    - rate_limit: 每秒最多发起的请求数（令牌桶），None 表示不限速。
+
+    items 可以是任意可迭代对象，只会预取有限个任务，内存占用与数据集大小无关。
+    func 抛出的异常会在对应位置重新抛出。
+    """
+    bucket = TokenBucket(rate_limit) if rate_limit else None
+
+    def _call(item):
+        if bucket is not None:
+            bucket.acquire()
+        return func(item)
+
+    # 预取窗口大于线程数，避免队首慢请求导致在途请求数下降
+    window = max_workers * 4
+    pending = deque()
+    it = iter(items)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in it:
+            pending.append((item, executor.submit(_call, item)))
+            if len(pending) >= window:
+                break
+
+        while pending:
+            item, future = pending.popleft()
+            result = future.result()
+            next_item = next(it, _SENTINEL)
+            if next_item is not _SENTINEL:
+                pending.append((next_item, executor.submit(_call, next_item)))
+            yield item, result
+
+
+_SENTINEL = object()
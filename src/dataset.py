@@ -0,0 +1,317 @@
+import argparse
+import hashlib
+import json
+import os
+
+from src.image_io import read_image_bytes
+from src.journal import truncate_partial_line
+
+DEFAULT_SHARD_SIZE = 10_000
+MANIFEST_NAME = "manifest.json"
+INDEX_NAME = "index.tsv"
+DIGESTS_NAME = "images.tsv"
+
+
+def image_digest(data):
+    """图像字节的内容哈希（用于去重）。"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class ShardedDatasetWriter:
+    """
+    分片数据集写入器。
+
+    目录结构：
+        manifest.json          分片列表及每个分片已确认的样本数和 jsonl 字节数
+        index.tsv              id -> (分片号, 记录在 jsonl 中的字节偏移)
+        images.tsv             图像内容哈希 -> (分片号, offset, length)，用于去重
+        shard-00000.jsonl      每行一个样本的元数据
+        shard-00000.bin        该分片所有图像的编码字节首尾相接，记录中保存 [offset, length]
+
+    目录已存在时以追加模式打开，新样本写入新的分片，不会改写已有数据；打开时先把 index.tsv / images.tsv
+    截断到 manifest 已确认的状态（中断的导入续跑时，未确认的分片会被覆盖，残留的索引行不能再指向它）。
+    add 时给出图像的内容哈希，则相同内容的图像只存储一次，后续样本记录
+    [分片号, offset, length] 引用已有字节（可跨分片、跨多次追加）。
+    """
+
+    def __init__(self, root, shard_size=DEFAULT_SHARD_SIZE):
+        self.root = root
+        self.shard_size = shard_size
+        os.makedirs(root, exist_ok=True)
+        self.manifest = _load_manifest(root)
+        _truncate_index(root, self.manifest)
+        truncate_partial_line(os.path.join(root, DIGESTS_NAME))
+        self._index_file = open(os.path.join(root, INDEX_NAME), "a", encoding="utf-8")
+        self._digests = _load_digests(root, self.manifest)
+        # 尚未落盘的图像哈希，等图像字节 flush 之后才写入 images.tsv，保证其中的引用总是有效的
+        self._pending_digests = []
+        # 尚未落盘的索引行，同样等记录 flush 之后才写入 index.tsv
+        self._pending_index = []
+        self._records = None
+        self._images = None
+
+    def _open_shard(self):
+        shard_id = len(self.manifest["shards"])
+        name = f"shard-{shard_id:05d}"
+        self.manifest["shards"].append(
+            {"records": f"{name}.jsonl", "images": f"{name}.bin", "count": 0, "bytes": 0}
+        )
+        # 未登记到 manifest 的同名分片只可能是中断写入的残留，直接覆盖
+        self._records = open(os.path.join(self.root, f"{name}.jsonl"), "wb")
+        self._images = open(os.path.join(self.root, f"{name}.bin"), "wb")
+
+    def _close_shard(self):
+        if self._records is not None:
+            self._records.close()
+            self._images.close()
+            self._records = self._images = None
+            self._write_index()
+            self._write_manifest()
+            self._write_digests()
+
+    def has_image(self, digest):
+        return digest in self._digests
+
+    def add(self, item, image_bytes, digest=None):
+        """
+        写入一个样本。item 为元数据字典（id / instruction / bbox 等，image_path 会被忽略），
+        image_bytes 为已编码的图像字节（PNG / JPEG 等）。
+
+        digest 为图像的内容哈希：已存储过相同内容时复用已有字节，此时 image_bytes 可以为 None。
+        返回本次是否写入了新的图像字节。
+        """
+        if self._records is None or self.manifest["shards"][-1]["count"] >= self.shard_size:
+            self._close_shard()
+            self._open_shard()
+        shard_id = len(self.manifest["shards"]) - 1
+        shard = self.manifest["shards"][shard_id]
+
+        ref = self._digests.get(digest) if digest is not None else None
+        written = ref is None
+        if written:
+            ref = (shard_id, self._images.tell(), len(image_bytes))
+            self._images.write(image_bytes)
+            if digest is not None:
+                self._digests[digest] = ref
+                self._pending_digests.append((digest, ref))
+        record = {k: v for k, v in item.items() if k != "image_path"}
+        record["image"] = list(ref[1:]) if ref[0] == shard_id else list(ref)
+
+        record_offset = self._records.tell()
+        self._records.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._pending_index.append((record["id"], shard_id, record_offset))
+        shard["count"] += 1
+        shard["bytes"] = self._records.tell()
+        return written
+
+    def flush(self):
+        """把已写入的样本落盘并更新 manifest，之后即使进程中断这些样本也可被读取。"""
+        if self._records is not None:
+            self._images.flush()
+            self._records.flush()
+            self._write_index()
+            self._write_manifest()
+            self._write_digests()
+
+    def _write_index(self):
+        # 先于 manifest 写入：中断时可能多出指向未确认记录的索引行，读取时按 manifest 中的字节数丢弃
+        if self._pending_index:
+            for item_id, shard_id, offset in self._pending_index:
+                self._index_file.write(f"{item_id}\t{shard_id}\t{offset}\n")
+            self._index_file.flush()
+            self._pending_index = []
+
+    def _write_digests(self):
+        if self._pending_digests:
+            with open(os.path.join(self.root, DIGESTS_NAME), "a", encoding="utf-8") as f:
+                for digest, (shard_id, offset, length) in self._pending_digests:
+                    f.write(f"{digest}\t{shard_id}\t{offset}\t{length}\n")
+            self._pending_digests = []
+
+    def _write_manifest(self):
+        tmp_path = os.path.join(self.root, MANIFEST_NAME + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, os.path.join(self.root, MANIFEST_NAME))
+
+    def close(self):
+        self._close_shard()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardedDataset:
+    """
+    分片数据集读取器：打开时只读取 manifest，迭代时逐行流式读取元数据，
+    图像字节在真正使用时才通过 mmap 按偏移读取。
+
+    产出的样本与 dataset.json 中的格式一致，image_path 为打包引用，
+    可直接交给 ImageHandle / UIGroundingModel.predict。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest = _load_manifest(root)
+        self._index = None
+
+    def __len__(self):
+        return sum(shard["count"] for shard in self.manifest["shards"])
+
+    def _to_item(self, shard, record):
+        image = record.pop("image")
+        if len(image) == 3:
+            # 去重后引用其他分片中的图像字节
+            shard = self.manifest["shards"][image[0]]
+        offset, length = image[-2:]
+        record["image_path"] = f"{os.path.join(self.root, shard['images'])}#{offset}:{length}"
+        return record
+
+    def __iter__(self):
+        for shard in self.manifest["shards"]:
+            with open(os.path.join(self.root, shard["records"]), "r", encoding="utf-8") as f:
+                for n, line in enumerate(f):
+                    # 只读取 manifest 中已确认的记录，忽略写入中断留下的残缺尾部
+                    if n >= shard["count"]:
+                        break
+                    yield self._to_item(shard, json.loads(line))
+
+    def get(self, item_id):
+        """按 id 随机访问单个样本，不存在（或尚未在 manifest 中确认）时抛出 KeyError。"""
+        if self._index is None:
+            self._index = _load_index(self.root, self.manifest)
+        shard_id, offset = self._index[str(item_id)]
+        shard = self.manifest["shards"][shard_id]
+        with open(os.path.join(self.root, shard["records"]), "rb") as f:
+            f.seek(offset)
+            return self._to_item(shard, json.loads(f.readline()))
+
+
+def _load_manifest(root):
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"version": 1, "shards": []}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _is_committed(manifest, shard_id, offset):
+    """索引项是否指向 manifest 中已确认的记录。旧版 manifest 没有记录字节数，只能检查分片号。"""
+    shards = manifest["shards"]
+    if not 0 <= shard_id < len(shards):
+        return False
+    size = shards[shard_id].get("bytes")
+    return size is None or offset < size
+
+
+def _load_index(root, manifest):
+    """
+    读取 index.tsv，返回 {id: (分片号, 偏移)}。写入中断时 index.tsv 可能比 manifest 超前：
+    残缺的行和指向未确认记录的行都会被忽略，随机访问与迭代看到的样本保持一致。
+    """
+    index = {}
+    path = os.path.join(root, INDEX_NAME)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parsed = _parse_index_line(line)
+                if parsed is not None and _is_committed(manifest, *parsed[1]):
+                    index[parsed[0]] = parsed[1]
+    return index
+
+
+def _parse_index_line(line):
+    """解析 index.tsv 的一行，返回 (id, (分片号, 偏移))，残缺的行返回 None。"""
+    try:
+        item_id, shard_id, offset = line.rstrip("\n").split("\t")
+        return item_id, (int(shard_id), int(offset))
+    except ValueError:
+        return None
+
+
+def _truncate_index(root, manifest):
+    """去掉 index.tsv 中残缺的行和指向未确认记录的行（只在确有这样的行时重写文件）。"""
+    path = os.path.join(root, INDEX_NAME)
+    if not os.path.exists(path):
+        return
+    tmp_path = path + ".tmp"
+    dropped = False
+    with open(path, "r", encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+        for line in src:
+            parsed = _parse_index_line(line)
+            if parsed is None or not line.endswith("\n") or not _is_committed(manifest, *parsed[1]):
+                dropped = True
+                continue
+            dst.write(line)
+    if dropped:
+        os.replace(tmp_path, path)
+    else:
+        os.remove(tmp_path)
+
+
+def _load_digests(root, manifest):
+    """读取 images.tsv；残缺的行和引用未确认分片的行被忽略。"""
+    digests = {}
+    path = os.path.join(root, DIGESTS_NAME)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    digest, shard_id, offset, length = line.rstrip("\n").split("\t")
+                    ref = (int(shard_id), int(offset), int(length))
+                except ValueError:
+                    continue
+                if ref[0] < len(manifest["shards"]):
+                    digests[digest] = ref
+    return digests
+
+
+def open_dataset(path):
+    """
+    打开数据集：目录视为分片数据集，否则按 dataset.json 格式读取。
+    两者都支持 len() 和按顺序迭代。
+    """
+    if os.path.isdir(path):
+        return ShardedDataset(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def pack_dataset(json_path, root, shard_size=DEFAULT_SHARD_SIZE):
+    """把 dataset.json 及其引用的图片打包为分片数据集（追加到 root），同一张图片只存储一次。"""
+    with open(json_path, "r", encoding="utf-8") as f:
+        dataset = json.load(f)
+    with ShardedDatasetWriter(root, shard_size) as writer:
+        for item in dataset:
+            data = read_image_bytes(item["image_path"])
+            writer.add(item, data, digest=image_digest(data))
+    return len(dataset)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片数据集工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_pack = sub.add_parser("pack", help="把 dataset.json 打包为分片数据集")
+    p_pack.add_argument("json_path")
+    p_pack.add_argument("root")
+    p_pack.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+
+    p_info = sub.add_parser("info", help="查看分片数据集信息")
+    p_info.add_argument("root")
+
+    args = parser.parse_args()
+    if args.command == "pack":
+        count = pack_dataset(args.json_path, args.root, args.shard_size)
+        print(f"已打包 {count} 个样本到 {args.root}")
+    else:
+        dataset = ShardedDataset(args.root)
+        print(f"{args.root}: {len(dataset)} 个样本，{len(dataset.manifest['shards'])} 个分片")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+本地模式的受限解码（只在 LocalBackend 中按需导入，依赖 torch / transformers）。
+
+- early_stop: BBoxStoppingCriteria 在模型输出完整且合法的 "BBox: [...]" 后立即停止生成，
+  不再等待后续的自我修正或收尾文字；
+- coords: 配合只要求输出坐标的 prompt，BBoxLogitsProcessor 把输出限制在
+  "BBox: [x1, y1, x2, y2]" 文法内（每个坐标为 [0, 1] 内最多 3 位小数的数），输出完整后强制结束；
+  切片视图的文法另外允许 "BBox: NOT_FOUND"（目标不在该切片中）。
+"""
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+from src.parser import NOT_FOUND, find_tagged_bbox
+
+# coords 模式的最大生成长度：完整的 "BBox: [0.123, 0.456, 0.789, 0.999]" 不超过 40 个 token
+COORDS_MAX_NEW_TOKENS = 48
+# 判断是否已输出完整 bbox 时只解码最近的这么多个 token（BBox 行通常不超过 30 个 token）
+_STOP_WINDOW = 48
+
+_PREFIX = "BBox: "
+_DIGITS = "0123456789"
+_FINAL = ("end",)
+
+
+def grammar_step(state, ch):
+    """
+    坐标文法的字符级状态机，返回读入 ch 之后的状态，不合法时返回 None。
+
+    状态：("lit", i, nf) 已匹配前缀 "BBox: " 的前 i 个字符，nf 表示是否允许 NOT_FOUND；
+    ("nf", i) 已匹配 "NOT_FOUND" 的前 i 个字符；("num", k, s) 正在读第 k 个坐标，
+    s 为数字内部状态（""、"0"、"1"、"0."、"1." 或已读的小数位数）；("sep", k) 第 k 个坐标后的逗号之后；
+    ("end",) 已读到 "]" 或完整的 NOT_FOUND，只允许结束。
+    """
+    kind = state[0]
+    if kind == "lit":
+        _, i, nf = state
+        if i < len(_PREFIX):
+            return ("lit", i + 1, nf) if ch == _PREFIX[i] else None
+        if ch == "[":
+            return ("num", 0, "")
+        return ("nf", 1) if nf and ch == NOT_FOUND[0] else None
+    if kind == "nf":
+        i = state[1]
+        if ch != NOT_FOUND[i]:
+            return None
+        return ("nf", i + 1) if i + 1 < len(NOT_FOUND) else _FINAL
+    if kind == "sep":
+        return ("num", state[1] + 1, "") if ch == " " else None
+    if kind != "num":
+        return None
+
+    _, k, s = state
+    if s == "":
+        return ("num", k, ch) if ch in "01" else None
+    if s in ("0", "1"):
+        if ch == ".":
+            return ("num", k, s + ".")
+    elif s == "0.":
+        return ("num", k, ("0", 1)) if ch in _DIGITS else None
+    elif s == "1.":
+        return ("num", k, ("1", 1)) if ch == "0" else None
+    else:
+        head, places = s
+        if places < 3 and (ch in _DIGITS if head == "0" else ch == "0"):
+            return ("num", k, (head, places + 1))
+    # 当前坐标已经可以结束：前三个坐标后接 ", "，第四个坐标后接 "]"
+    if ch == "," and k < 3:
+        return ("sep", k)
+    if ch == "]" and k == 3:
+        return _FINAL
+    return None
+
+
+def grammar_start(not_found=False):
+    return ("lit", 0, not_found)
+
+
+def token_strings(tokenizer):
+    """词表中每个 token 单独解码后的字符串。"""
+    return [tokenizer.decode([token_id]) for token_id in range(len(tokenizer))]
+
+
+class BBoxStoppingCriteria(StoppingCriteria):
+    """
+    每生成一个 token 检查一次：只有新 token 含 "]" 时才解码最近的窗口，窗口中出现归一化后合法的
+    "BBox: [...]" 即认为该样本已完成。返回逐样本的完成标记，批量生成时各样本独立停止。
+    """
+
+    def __init__(self, tokenizer, prompt_length, sizes):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.sizes = sizes
+        self._closing = {}
+
+    def _has_closing(self, token_id):
+        closing = self._closing.get(token_id)
+        if closing is None:
+            closing = self._closing[token_id] = "]" in self.tokenizer.decode([token_id])
+        return closing
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        if input_ids.shape[1] <= self.prompt_length:
+            return done
+        for row, (width, height) in enumerate(self.sizes):
+            if not self._has_closing(int(input_ids[row, -1])):
+                continue
+            start = max(self.prompt_length, input_ids.shape[1] - _STOP_WINDOW)
+            text = self.tokenizer.decode(input_ids[row, start:], skip_special_tokens=True)
+            done[row] = find_tagged_bbox(text, width, height) is not None
+        return done
+
+
+class BBoxLogitsProcessor(LogitsProcessor):
+    """
+    把生成限制在坐标文法内：每一步只保留能让输出仍是文法前缀的 token，读完 "]" 后只允许结束符。
+
+    词表只在构造时解码一次；只有字符全部属于文法字母表的 token 才是候选，
+    每个文法状态允许的 token 集合计算一次后缓存（状态数只有几十个）。
+    同一个实例可以跨多次 generate 复用，每次生成前调用 start(prompt_length)。
+    """
+
+    def __init__(self, tokenizer, prompt_length=0):
+        self.prompt_length = prompt_length
+        self.eos_token_id = tokenizer.eos_token_id
+        strings = token_strings(tokenizer)
+        alphabet = set(_PREFIX + NOT_FOUND + _DIGITS + "[.,] ")
+        self._strings = strings
+        self._candidates = [
+            token_id for token_id, text in enumerate(strings) if text and set(text) <= alphabet
+        ]
+        self._next = {}
+        self._allowed = {}
+        self._not_found = None
+        self._states = None
+
+    def start(self, prompt_length, not_found=None):
+        """not_found 为逐样本的标记（切片视图为 True），允许对应样本输出 BBox: NOT_FOUND。"""
+        self.prompt_length = prompt_length
+        self._not_found = not_found
+        self._states = None
+        return self
+
+    def _advance(self, state, text):
+        for ch in text:
+            state = grammar_step(state, ch)
+            if state is None:
+                return None
+        return state
+
+    def _successors(self, state):
+        """从 state 出发、读入后能到达可完成状态的候选 token 列表（文法无环，递归深度不超过输出长度）。"""
+        ids = self._next.get(state)
+        if ids is None:
+            ids = []
+            for token_id in self._candidates:
+                target = self._advance(state, self._strings[token_id])
+                if target is not None and (target == _FINAL or self._successors(target)):
+                    ids.append(token_id)
+            self._next[state] = ids
+        return ids
+
+    def _allowed_ids(self, state, device):
+        key = (state, device)
+        allowed = self._allowed.get(key)
+        if allowed is None:
+            # 只允许之后仍能补全为完整输出的 token，避免走进词表无法继续的死路
+            ids = [self.eos_token_id] if state == _FINAL else self._successors(state)
+            allowed = self._allowed[key] = torch.tensor(ids, dtype=torch.long, device=device)
+        return allowed
+
+    def __call__(self, input_ids, scores):
+        generated = input_ids.shape[1] - self.prompt_length
+        if generated == 0 or self._states is None:
+            flags = self._not_found or [False] * input_ids.shape[0]
+            self._states = [grammar_start(flag) for flag in flags]
+        else:
+            last = input_ids[:, -1].tolist()
+            self._states = [
+                None if state is None or state == _FINAL else self._advance(state, self._strings[token_id])
+                for state, token_id in zip(self._states, last)
+            ]
+
+        mask = torch.full_like(scores, float("-inf"))
+        for row, state in enumerate(self._states):
+            if state is None:
+                # 已结束（或偏离文法）的样本不再约束，由 generate 自行填充 padding
+                mask[row] = 0
+            else:
+                mask[row, self._allowed_ids(state, scores.device)] = 0
+        return scores + mask
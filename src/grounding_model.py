@@ -1,53 +1,98 @@
-import json
-import os
-import re
+from concurrent.futures import ThreadPoolExecutor
 
-import torch
-from PIL import Image
+from src.backends import DECODING_MODES, create_backend
+from src.image_io import ImageHandle
+from src.instrumentation import NullInstrumentation
+from src.parser import NOT_FOUND, parse_raw, parse_response
+
+# 单个批次内图像总像素上限（约 4 张 1080p 截图）
+DEFAULT_MAX_BATCH_PIXELS = 4 * 1920 * 1080
+
+
+def _split_batches(sizes, batch_size, max_batch_pixels):
+    """
+    按顺序把样本切分成批次，返回下标列表的列表。
+    每批最多 batch_size 条，且图像总像素不超过 max_batch_pixels（单张超限的图像独占一批）。
+    """
+    batches = []
+    current, current_pixels = [], 0
+    for idx, (width, height) in enumerate(sizes):
+        pixels = width * height
+        if current and (len(current) >= batch_size or current_pixels + pixels > max_batch_pixels):
+            batches.append(current)
+            current, current_pixels = [], 0
+        current.append(idx)
+        current_pixels += pixels
+    if current:
+        batches.append(current)
+    return batches
 
-# 假设使用 Qwen2-VL 或类似的本地模型，如果没有则提供 Mock
-try:
-    from qwen_vl_utils import process_vision_info
-    from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
-    HAS_TRANSFORMERS = True
-except ImportError:
-    HAS_TRANSFORMERS = False
 
 class UIGroundingModel:
-    def __init__(self, model_path="qwen-vl-max", mode="mock", api_key=None):
+    def __init__(self, model_path="qwen-vl-max", mode="mock", api_key=None, cache=None,
+                 mock_dataset="data/dataset.json", preprocessor=None, instrumentation=None, api_client=None,
+                 prefix_cache=None, decoding="full", request_limiter=None):
         self.mode = mode
         self.model_path = model_path
         self.api_key = api_key
-        
-        if mode == "local":
-            if HAS_TRANSFORMERS:
-                print(f"Loading local model from {model_path}...")
-                self.model = Qwen2VLForConditionalGeneration.from_pretrained(
-                    model_path, torch_dtype="auto", device_map="auto"
-                )
-                self.processor = AutoProcessor.from_pretrained(model_path)
-            else:
-                print("Error: transformers or qwen_vl_utils not installed. Falling back to mock.")
-                self.mode = "mock"
-        elif mode == "api":
-            import dashscope
-            self.api_key = api_key or os.getenv("DASHSCOPE_API_KEY")
-            dashscope.api_key = self.api_key
-            print(f"Using Qwen API Mode (Model: {model_path})")
-        else:
-            print("Running in MOCK mode (no model loaded)")
+        # 可选的持久化预测缓存（src.cache.PredictionCache），None 表示不使用缓存
+        self.cache = cache
+        # Mock 模式从该数据集查找标注
+        self.mock_dataset = mock_dataset
+        # 可选的图像预处理（src.preprocess.Preprocessor）：按像素预算缩放、切片定位
+        self.preprocessor = preprocessor
+        # 埋点收集器（src.instrumentation.Instrumentation）：记录各阶段耗时、token 数和缓存状态
+        self.instrumentation = instrumentation or NullInstrumentation()
+        # API 模式的 HTTP 客户端（src.api_client.DashScopeClient），负责超时、重试和熔断
+        self.api_client = api_client
+        # 本地模式的共享前缀缓存（src.prefix_cache.PrefixCache）：同一截图的多条指令复用视觉编码和 prompt 前缀
+        self.prefix_cache = prefix_cache
+        # 解码模式（见 src.backends.DECODING_MODES）：full 完整 CoT；early_stop 输出完整 BBox 后立即停止；
+        # coords 只要求输出坐标，本地模式下按坐标文法约束解码
+        if decoding not in DECODING_MODES:
+            raise ValueError(f"未知的解码模式: {decoding}（可选: {', '.join(DECODING_MODES)}）")
+        self.decoding = decoding
+        # 可选的请求级限流器（src.concurrency.RequestLimiter）：每个送往后端的视图请求（包括切片请求）
+        # 都先通过它，切片并行时在途请求数和请求速率仍受全局限制
+        self.request_limiter = request_limiter
 
-    def _build_prompt(self, instruction):
+        # 推理后端（src.backends）：只在这里按模式导入对应的依赖，mock / api 模式不会加载 torch
+        try:
+            self.backend = create_backend(mode, self)
+        except ImportError as e:
+            if mode != "local":
+                raise
+            print(f"Error: transformers or qwen_vl_utils not installed ({e}). Falling back to mock.")
+            self.mode = "mock"
+            self.backend = create_backend("mock", self)
+
+    def _build_prompt(self, instruction, tile=False):
         """
         推理增强：通过精心设计的 System Prompt 和 CoT 模板。
+        coords 解码模式下改用只输出坐标的 prompt。
+        tile 为 True 时用于切片视图：目标元素很可能不在该切片中，允许模型回答 BBox: NOT_FOUND，
+        否则每个切片都会给出一个框，合并时无从区分真正包含目标的切片。
         """
+        not_found = (
+            "\n这张截图只是完整界面的一个局部切片，目标元素可能不在其中。"
+            f"如果切片中没有完整出现目标元素，请输出 BBox: {NOT_FOUND}，不要猜测坐标。"
+            if tile else ""
+        )
+        if self.decoding == "coords":
+            return f"""你是一个专业的 UI 界面分析专家。
+请根据提供的界面截图和指令，准确定位目标元素。
+指令：{instruction}
+只输出目标元素的归一化矩形边框 [xmin, ymin, xmax, ymax]，所有值在 [0, 1] 之间、最多保留 3 位小数，不要输出其他内容。{not_found}
+
+### 输出格式：
+BBox: [xmin, ymin, xmax, ymax]"""
         prompt = f"""你是一个专业的 UI 界面分析专家。
 请根据提供的界面截图和指令，准确定位目标元素。
 
 ### 推理步骤：
 1. **分析布局**：观察截图中的各个组件及其相对位置。
 2. **寻找目标**：根据指令 '{instruction}'，识别最匹配的 UI 元素（如按钮、图标、输入框等）。
-3. **确定坐标**：计算该元素的归一化矩形边框 [xmin, ymin, xmax, ymax]，其中所有值在 [0, 1] 之间。
+3. **确定坐标**：计算该元素的归一化矩形边框 [xmin, ymin, xmax, ymax]，其中所有值在 [0, 1] 之间。{not_found}
 
 ### 输出格式：
 Thought: <你的思考过程>
@@ -56,181 +101,172 @@ BBox: [xmin, ymin, xmax, ymax]
 注意：请严格遵守输出格式。"""
         return prompt
 
-    def predict(self, image_path, instruction):
-        # 获取图像尺寸以便后续可能的强制归一化
-        with Image.open(image_path) as img:
-            width, height = img.size
-
-        if self.mode == "mock":
-            # 模拟推理过程
-            return self._mock_predict(image_path, instruction)
-        elif self.mode == "api":
-            # 调用 API
-            return self._api_predict(image_path, instruction, width, height)
-        
-        # 真实本地模型推理代码
-        prompt = self._build_prompt(instruction)
-        
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image", "image": image_path},
-                    {"type": "text", "text": prompt},
-                ],
-            }
-        ]
-        
-        text = self.processor.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
-        image_inputs, video_inputs = process_vision_info(messages)
-        inputs = self.processor(
-            text=[text],
-            images=image_inputs,
-            videos=video_inputs,
-            padding=True,
-            return_tensors="pt",
-        )
-        inputs = inputs.to(self.model.device)
-
-        generated_ids = self.model.generate(**inputs, max_new_tokens=512)
-        generated_ids_trimmed = [
-            out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-        ]
-        response = self.processor.batch_decode(
-            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
-        )[0]
-        
-        return self._parse_response(response, width, height)
-
-    def _mock_predict(self, image_path, instruction):
+    def predict(self, image, instruction):
         """
-        模拟输出，用于演示项目结构。
+        image: 图片路径（含打包引用）或 ImageHandle。传入 ImageHandle 时，
+        尺寸、字节和解码结果在缓存、推理和可视化之间共享，不会重复读取文件。
         """
-        # 简单的规则模拟，实际项目中应使用大模型
-        with open("data/dataset.json", "r") as f:
-            dataset = json.load(f)
-        
-        for item in dataset:
-            if item["image_path"] == image_path:
-                thought = f"在图片中找到了与指令 '{instruction}' 相关的元素 '{item['target']}'。"
-                bbox = item["bbox"]
-                return thought, bbox
-        
-        return "无法识别目标元素。", [0, 0, 0, 0]
-
-    def _api_predict(self, image_path, instruction, width, height):
+        raw = self.predict_raw(image, instruction)
+        with self.instrumentation.span("parse"):
+            return parse_raw(raw)
+
+    def predict_raw(self, image, instruction):
         """
-        调用 DashScope MultiModalConversation API。
+        返回未解析的原始输出记录，用 src.parser.parse_raw 解析为 (thought, bbox)：
+
+            {"size": [W, H], "views": [{"tile": [x0, y0, x1, y1] 或 None, "size": [w, h],
+                                       "response": 模型输出文本（调用失败时为 "error": 错误信息）}, ...]}
+
+        缓存和归档保存的都是这份记录，调整解析规则后无需重新推理。
         """
-        import os
+        image = ImageHandle.coerce(image)
+        with self.instrumentation.span("predict"):
+            key = self._cache_key(image, instruction)
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
 
-        from dashscope import MultiModalConversation
+            raw = self._predict_uncached(image, instruction)
+            self._cache_put(key, raw)
+            return raw
 
+    def _cache_key(self, image, instruction):
+        if self.cache is None:
+            return None
+        model_key = f"{self.mode}:{self.model_path}"
+        if self.decoding != "full":
+            # 提前停止会截断输出，与完整输出分开缓存
+            model_key += f":{self.decoding}"
         prompt = self._build_prompt(instruction)
-        # DashScope 支持本地 file:// 协议，需使用绝对路径
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"image": f"file://{os.path.abspath(image_path)}"},
-                    {"text": prompt}
-                ]
-            }
-        ]
-        
-        try:
-            response = MultiModalConversation.call(model=self.model_path, messages=messages)
-            if response.status_code == 200:
-                content = response.output.choices[0].message.content
-                # 如果返回的是列表，提取文本内容
-                if isinstance(content, list):
-                    content = next((item['text'] for item in content if 'text' in item), "")
-                return self._parse_response(content, width, height)
+        if self.preprocessor is not None:
+            model_key += f":{self.preprocessor.signature()}"
+            if self.preprocessor.tile_size:
+                prompt += self._build_prompt(instruction, tile=True)
+        return self.cache.make_key(image, instruction, model_key, prompt)
+
+    def _cache_get(self, key):
+        if key is None:
+            return None
+        with self.instrumentation.span("cache_lookup"):
+            cached = self.cache.get(key)
+        self.instrumentation.count("cache_hit" if cached is not None else "cache_miss")
+        return cached
+
+    def _cache_put(self, key, raw):
+        # API 报错属于瞬时失败，不写入缓存，下次运行会重新请求
+        if key is not None and not any("error" in view for view in raw["views"]):
+            self.cache.put(key, raw)
+
+    def _predict_uncached(self, image, instruction):
+        # 模拟推理等后端可以直接给出整条记录，跳过预处理
+        raw = self.backend.predict(image, instruction)
+        if raw is not None:
+            return raw
+
+        if self.preprocessor is None:
+            views = [(None, image)]
+        else:
+            with self.instrumentation.span("preprocess"):
+                views = self.preprocessor.views(image)
+        return self._predict_views(image, instruction, views)
+
+    def _predict_views(self, image, instruction, views):
+        """对预处理得到的视图 [(tile, ImageHandle), ...] 推理，返回整条原始输出记录。"""
+        if len(views) == 1:
+            records = [self._predict_view(views[0][1], instruction)]
+        elif self.backend.batched:
+            # 切片定位：本地模式按批次推理所有切片
+            sizes = [view.size for _, view in views]
+            records = []
+            for batch in _split_batches(sizes, len(views), DEFAULT_MAX_BATCH_PIXELS):
+                outputs = self.backend.generate(
+                    [(views[k][1], instruction) for k in batch], [sizes[k] for k in batch]
+                )
+                records.extend(
+                    {"tile": list(views[k][0]), "size": list(sizes[k]), **output}
+                    for k, output in zip(batch, outputs)
+                )
+        else:
+            # API 模式并行请求各切片
+            with ThreadPoolExecutor(max_workers=self.preprocessor.tile_workers) as executor:
+                records = list(executor.map(lambda v: self._predict_view(v[1], instruction, v[0]), views))
+        return {"size": list(image.size), "views": records}
+
+    def _predict_view(self, image, instruction, tile=None):
+        # 获取图像尺寸以便后续可能的强制归一化（只读取文件头）
+        with self.instrumentation.span("image_open"):
+            width, height = image.size
+        record = {"tile": list(tile) if tile is not None else None, "size": [width, height]}
+        if self.request_limiter is None:
+            record.update(self.backend.generate([(image, instruction)], [(width, height)])[0])
+        else:
+            with self.request_limiter:
+                record.update(self.backend.generate([(image, instruction)], [(width, height)])[0])
+        return record
+
+    def predict_batch(self, items, batch_size=4, max_batch_pixels=DEFAULT_MAX_BATCH_PIXELS):
+        """批量推理，返回与 items 顺序一致的 (thought, bbox) 列表，参数见 predict_batch_raw。"""
+        raws = self.predict_batch_raw(items, batch_size, max_batch_pixels)
+        with self.instrumentation.span("parse"):
+            return [parse_raw(raw) for raw in raws]
+
+    def predict_batch_raw(self, items, batch_size=4, max_batch_pixels=DEFAULT_MAX_BATCH_PIXELS):
+        """
+        批量推理。items 为 (image, instruction) 序列（image 为路径或 ImageHandle），
+        返回顺序一致的原始输出记录列表（格式见 predict_raw）。
+        支持批量的后端（本地模式）把多条 prompt 和图像 padding 到同一个批次，每批只调用一次 generate；
+        批次同时受 batch_size 和图像总像素 max_batch_pixels 限制，超大截图会单独成批。
+        其它后端逐条调用 predict_raw。
+        """
+        items = [(ImageHandle.coerce(image), instruction) for image, instruction in items]
+        if not self.backend.batched:
+            return [self.predict_raw(image, instruction) for image, instruction in items]
+
+        # 先查缓存，只对未命中的样本做批量推理
+        results = [None] * len(items)
+        keys = [self._cache_key(image, instruction) for image, instruction in items]
+        pending = []
+        for idx, key in enumerate(keys):
+            cached = self._cache_get(key)
+            if cached is not None:
+                results[idx] = cached
+            else:
+                pending.append(idx)
+
+        # 经过预处理后只有单个视图的样本参与批量推理，需要切片的样本逐条处理
+        batchable = []
+        for idx in pending:
+            image, instruction = items[idx]
+            if self.preprocessor is not None:
+                with self.instrumentation.span("preprocess"):
+                    views = self.preprocessor.views(image)
+            else:
+                views = [(None, image)]
+            if len(views) == 1:
+                batchable.append((idx, views[0][1], instruction))
             else:
-                error_msg = f"API Error: {response.code} - {response.message}"
-                print(error_msg)
-                return error_msg, [0, 0, 0, 0]
-        except Exception as e:
-            error_msg = f"API Exception: {str(e)}"
-            print(error_msg)
-            return error_msg, [0, 0, 0, 0]
+                # 视图已经算好，直接推理，不再重复预处理
+                results[idx] = self._predict_views(image, instruction, views)
+                self._cache_put(keys[idx], results[idx])
+
+        sizes = [view.size for _, view, _ in batchable]
+        for batch in _split_batches(sizes, batch_size, max_batch_pixels):
+            outputs = self.backend.generate(
+                [batchable[k][1:] for k in batch], [sizes[k] for k in batch]
+            )
+            for k, output in zip(batch, outputs):
+                idx = batchable[k][0]
+                results[idx] = {
+                    "size": list(items[idx][0].size),
+                    "views": [{"tile": None, "size": list(sizes[k]), **output}],
+                }
+                self._cache_put(keys[idx], results[idx])
+        return results
 
     def _parse_response(self, response, width, height):
         """
         从模型返回的文本中解析出 bbox。
         如果模型输出的是像素坐标，则根据 width 和 height 进行自动归一化。
         """
-        FLOAT_RE = r"[-+]?(?:\d*\.\d+|\d+)(?:[eE][-+]?\d+)?"
-
-        def _normalize_bbox_if_needed(bbox):
-            # 自动纠正：如果任意坐标值大于 1.1，判定为像素坐标并强制归一化
-            if any(v > 1.1 for v in bbox):
-                bbox = [
-                    bbox[0] / width,
-                    bbox[1] / height,
-                    bbox[2] / width,
-                    bbox[3] / height,
-                ]
-            # 裁剪到合法范围 [0, 1]
-            bbox = [max(0.0, min(1.0, float(v))) for v in bbox]
-            # 统一保留 3 位小数（便于可读、也与现有逻辑一致）
-            return [round(v, 3) for v in bbox]
-
-        def _is_valid_bbox(bbox):
-            if not isinstance(bbox, (list, tuple)) or len(bbox) != 4:
-                return False
-            x1, y1, x2, y2 = bbox
-            if not (0.0 <= x1 <= 1.0 and 0.0 <= y1 <= 1.0 and 0.0 <= x2 <= 1.0 and 0.0 <= y2 <= 1.0):
-                return False
-            # 必须是正面积矩形
-            return (x2 > x1) and (y2 > y1)
-
-        def _extract_candidate_bboxes(text):
-            """
-            返回候选 bbox 列表（按出现顺序）。之所以保留多个候选，是因为模型有时会先给一个尝试，
-            后面再自我修正输出第二个/第三个 bbox；取最后一个合法 bbox 更稳健。
-            """
-            candidates = []
-
-            # 1) 优先解析显式的 BBox: [...]（支持中文冒号）
-            for m in re.finditer(r"BBox\s*[:：]\s*\[([^\]]+)\]", text, flags=re.I):
-                nums = re.findall(FLOAT_RE, m.group(1))
-                if len(nums) >= 4:
-                    try:
-                        bbox = [float(n) for n in nums[:4]]
-                        candidates.append(bbox)
-                    except Exception:
-                        pass
-
-            # 2) 若没找到 BBox 标记，再尝试全文中所有 [...]，取其中恰好 4 个数字的
-            if not candidates:
-                for m in re.finditer(r"\[([^\]]+)\]", text):
-                    nums = re.findall(FLOAT_RE, m.group(1))
-                    if len(nums) == 4:
-                        try:
-                            bbox = [float(n) for n in nums]
-                            candidates.append(bbox)
-                        except Exception:
-                            pass
-
-            return candidates
-
-        try:
-            # 提取 Thought
-            thought_match = re.search(r"Thought\s*[:：]\s*(.*)", response, re.S | re.I)
-            thought = thought_match.group(1).split("BBox:")[0].strip() if thought_match else ""
-            
-            # 提取并选择 bbox（取最后一个合法候选，避免“先错后改”被误解析）
-            candidates = _extract_candidate_bboxes(response)
-            for raw_bbox in reversed(candidates):
-                bbox = _normalize_bbox_if_needed(raw_bbox)
-                if _is_valid_bbox(bbox):
-                    return thought, bbox
-
-            return thought, [0, 0, 0, 0]
-        except Exception as e:
-            print(f"解析失败: {e}, 原始输出: {response}")
-            return "解析失败", [0, 0, 0, 0]
+        return parse_response(response, width, height)
 
@@ -0,0 +1,202 @@
+import hashlib
+import io
+import mmap
+import os
+import re
+import tempfile
+import threading
+
+from PIL import Image
+
+# 打包图像的引用格式：<shard>.bin#<offset>:<length>
+# 它可以像普通图片路径一样在数据项、结果和缓存中传递，读取时按偏移直接从分片中取出字节
+_PACKED_REF_RE = re.compile(r"^(?P<path>.+\.bin)#(?P<offset>\d+):(?P<length>\d+)$")
+
+_mmaps = {}
+_mmaps_lock = threading.Lock()
+
+
+def is_packed_ref(image_path):
+    return _PACKED_REF_RE.match(image_path) is not None
+
+
+def _mmap_for(path):
+    with _mmaps_lock:
+        mm = _mmaps.get(path)
+        if mm is None:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _mmaps[path] = mm
+        return mm
+
+
+def read_image_bytes(image_path):
+    """读取图像的原始编码字节，支持普通文件路径和打包分片引用。"""
+    m = _PACKED_REF_RE.match(image_path)
+    if m is None:
+        with open(image_path, "rb") as f:
+            return f.read()
+    offset, length = int(m["offset"]), int(m["length"])
+    mm = _mmap_for(m["path"])
+    if offset + length > len(mm):
+        # 分片在打开后又被追加写入，重新映射
+        with _mmaps_lock:
+            _mmaps.pop(m["path"], None)
+        mm = _mmap_for(m["path"])
+    return mm[offset:offset + length]
+
+
+def open_image(image_path):
+    """打开图像（惰性解码），支持普通文件路径和打包分片引用。"""
+    if is_packed_ref(image_path):
+        return Image.open(io.BytesIO(read_image_bytes(image_path)))
+    return Image.open(image_path)
+
+
+def materialize_image(image_path, data=None):
+    """
+    返回一个可直接访问的本地文件路径。打包引用会被解出到临时目录（同一引用只写一次），
+    用于只接受文件路径的接口。data 为已读取的图像字节，可避免重复读取。
+    """
+    m = _PACKED_REF_RE.match(image_path)
+    if m is None:
+        return image_path
+    name = f"{os.path.basename(m['path'])}-{m['offset']}-{m['length']}"
+    return _write_temp_image(name, lambda: read_image_bytes(image_path) if data is None else data)
+
+
+def _write_temp_image(name, get_data):
+    out_path = os.path.join(tempfile.gettempdir(), "ui_grounding_images", name)
+    if not os.path.exists(out_path):
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp_path = f"{out_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(get_data())
+        os.replace(tmp_path, out_path)
+    return out_path
+
+
+class ImageHandle:
+    """
+    单个任务在整条流水线中共享的图像句柄。
+
+    - size: 只解析文件头获得尺寸，不做完整解码；
+    - data: 原始编码字节，首次访问时读取一次，之后共享（哈希、上传、解码都复用）；
+    - decode(): 完整解码后的 PIL 图像，只解码一次；调用方如需修改请先 copy()。
+    线程安全；任务结束后调用 release() 释放字节和解码结果。
+
+    预处理（缩放、切片）产生的图像没有对应文件，用 from_image() 构造内存句柄，
+    其字节在首次访问 data 时才编码。
+
+    key 在进程内标识图像内容（用于本地模式的共享前缀缓存）：文件句柄为路径，
+    内存句柄默认为 None，预处理产生的视图由 Preprocessor 设置为原图 key + 切片。
+    tile 为切片视图在原图中的像素坐标框（由 Preprocessor 设置），其它句柄为 None；后端据此选择切片专用的 prompt。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.key = path
+        self.tile = None
+        self._data = None
+        self._size = None
+        self._image = None
+        self._format = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_image(cls, image, image_format="PNG"):
+        handle = cls()
+        handle._image = image
+        handle._size = image.size
+        handle._format = image_format
+        return handle
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        由编码后的图像字节构造内存句柄（如服务收到的上传截图）。只解析文件头校验格式并读取尺寸，
+        无法识别的数据抛出 PIL.UnidentifiedImageError。key 取内容哈希，相同截图的请求可以共享前缀缓存。
+        """
+        handle = cls()
+        with Image.open(io.BytesIO(data)) as img:
+            handle._size = img.size
+            handle._format = img.format
+        handle._data = data
+        handle.key = "sha256:" + hashlib.sha256(data).hexdigest()[:32]
+        return handle
+
+    @classmethod
+    def coerce(cls, image):
+        """接受 ImageHandle 或图片路径（含打包引用），统一返回 ImageHandle。"""
+        return image if isinstance(image, cls) else cls(image)
+
+    @property
+    def is_packed(self):
+        return self.path is not None and is_packed_ref(self.path)
+
+    @property
+    def data(self):
+        with self._lock:
+            if self._data is None:
+                if self.path is None:
+                    buf = io.BytesIO()
+                    self._image.save(buf, format=self._format)
+                    self._data = buf.getvalue()
+                else:
+                    self._data = read_image_bytes(self.path)
+            return self._data
+
+    @property
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                if self._image is not None:
+                    self._size = self._image.size
+                elif self._data is None and not self.is_packed:
+                    # 普通文件只读取文件头
+                    with Image.open(self.path) as img:
+                        self._size = img.size
+                else:
+                    with Image.open(io.BytesIO(self.data)) as img:
+                        self._size = img.size
+            return self._size
+
+    def decode(self):
+        with self._lock:
+            if self._image is None:
+                img = Image.open(io.BytesIO(self.data))
+                img.load()
+                self._image = img
+                self._size = img.size
+            return self._image
+
+    def take_image(self):
+        """
+        取走解码后的图像，供最后一个使用者（如可视化）原地修改而无需 copy()。
+        文件句柄交出后不再持有解码结果，之后再访问会重新解码；内存句柄没有可重新读取的来源，返回副本。
+        """
+        with self._lock:
+            image = self.decode()
+            if self.path is None:
+                return image.copy()
+            self._image = None
+            return image
+
+    def local_path(self):
+        """可直接访问的本地文件路径（打包引用和内存图像会写出到临时文件）。"""
+        if self.path is None:
+            data = self.data
+            name = f"{hashlib.sha256(data).hexdigest()}.{self._format.lower()}"
+            return _write_temp_image(name, lambda: data)
+        if not self.is_packed:
+            return self.path
+        return materialize_image(self.path, self.data)
+
+    def release(self):
+        with self._lock:
+            if self.path is not None:
+                self._data = None
+                self._image = None
+            elif self._image is not None:
+                # 内存句柄没有可重新读取的来源：保留图像本身，字节需要时重新编码
+                self._data = None
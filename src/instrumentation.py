@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Instrumentation:
+    """
+    推理过程的埋点收集器，线程安全，数据在内存中聚合：
+
+    - span(name): 上下文管理器，记录一段代码的耗时（秒）；
+    - observe(name, value): 记录一个数值样本（如每次调用的输入 / 输出 token 数）；
+    - count(name, n): 累加计数器（如缓存命中、重试次数）。
+
+    可通过 add_callback(fn) 注册回调，每条事件都会以 fn(kind, name, value) 的形式转发，
+    kind 为 "span" / "observe" / "count"，便于接入外部监控。
+
+    max_samples 限制每个 span / 数值只保留最近的多少个样本（长期运行的服务使用，分布反映最近的窗口），
+    None 表示全部保留；计数器不受影响。
+    """
+
+    def __init__(self, max_samples=None):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._values = {}
+        self._counters = {}
+        self._callbacks = []
+
+    def add_callback(self, fn):
+        self._callbacks.append(fn)
+
+    def _emit(self, kind, name, value):
+        for fn in self._callbacks:
+            fn(kind, name, value)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._spans.setdefault(name, deque(maxlen=self.max_samples)).append(elapsed)
+            self._emit("span", name, elapsed)
+
+    def observe(self, name, value):
+        with self._lock:
+            self._values.setdefault(name, deque(maxlen=self.max_samples)).append(value)
+        self._emit("observe", name, value)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+        self._emit("count", name, n)
+
+    def summary(self):
+        """返回聚合结果：各阶段耗时分布（毫秒）、数值样本分布和计数器。"""
+        with self._lock:
+            spans = {k: list(v) for k, v in self._spans.items()}
+            values = {k: list(v) for k, v in self._values.items()}
+            counters = dict(self._counters)
+        return {
+            "spans_ms": {k: _distribution(np.asarray(v) * 1000) for k, v in spans.items()},
+            "values": {k: _distribution(np.asarray(v, dtype=np.float64)) for k, v in values.items()},
+            "counters": counters,
+        }
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=4)
+
+
+class NullInstrumentation(Instrumentation):
+    """不记录任何数据的空实现，作为默认值以免在调用处到处判断 None。"""
+
+    @contextmanager
+    def span(self, name):
+        yield
+
+    def observe(self, name, value):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+def _distribution(arr):
+    if arr.size == 0:
+        return {"count": 0}
+    return {
+        "count": int(arr.size),
+        "total": round(float(arr.sum()), 3),
+        "mean": round(float(arr.mean()), 3),
+        "p50": round(float(np.percentile(arr, 50)), 3),
+        "p95": round(float(np.percentile(arr, 95)), 3),
+        "p99": round(float(np.percentile(arr, 99)), 3),
+        "max": round(float(arr.max()), 3),
+    }
@@ -0,0 +1,91 @@
+import json
+import os
+
+
+def truncate_partial_line(path, chunk_size=65536):
+    """
+    把追加写入的行式文件截断到最后一个换行符之后，去掉进程异常退出时残留的半行；
+    否则续写的第一行会接在残缺内容后面，成为一整行无法解析的数据。文件不存在时什么也不做。
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - chunk_size)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline != -1:
+                keep = start + newline + 1
+                break
+            pos = start
+        else:
+            keep = 0
+        if keep != end:
+            f.truncate(keep)
+
+
+class ResultJournal:
+    """
+    评估结果日志（JSONL，追加写入）。
+
+    每条结果完成后立即写入并 flush，进程因异常、OOM 或 Ctrl-C 退出时已完成的结果不会丢失；
+    续跑时通过 completed() 得到已完成的 id，最后用 compact() 按数据集顺序生成 results.json。
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 非续跑模式下清空旧日志，避免混入上一次运行的结果；续跑时先去掉崩溃留下的残缺末行
+        if resume:
+            truncate_partial_line(path)
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def append(self, result):
+        self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def load(self):
+        """读取日志，返回 {id: result}。同一 id 出现多次时以最后一条为准，残缺的行会被忽略。"""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[str(result["id"])] = result
+        return records
+
+    def completed(self):
+        """已完成的 id。客户端 / API 错误（带 error 字段）的记录不算完成，续跑时会重新推理。"""
+        return {task_id for task_id, result in self.load().items() if not result.get("error")}
+
+    def compact(self, dataset, out_path):
+        """
+        按 dataset 的顺序把日志中的结果整理为与原先格式一致的 results.json，返回结果列表。
+        数据集中尚未完成的样本会被跳过。
+        """
+        records = self.load()
+        results = [records[str(item["id"])] for item in dataset if str(item["id"]) in records]
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, out_path)
+        return results
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,81 @@
+"""
+内存预算与逐任务峰值内存统计。
+
+MemoryBudget 把内存预算换算成推理前的图像像素上限；PeakMemoryTracker 在每个任务开始前重置
+进程的峰值 RSS（Linux 的 /proc/self/clear_refs），任务结束后读取 VmHWM，得到该任务期间的真实峰值。
+"""
+import resource
+import sys
+
+# 每个输入像素在推理期间的大致内存开销（字节）：解码后的 RGB 图像、缩放副本、
+# 视觉编码器的 float32 patch 张量及其中间激活。用于把内存预算换算成像素上限，偏保守。
+BYTES_PER_PIXEL = 64
+
+
+class MemoryBudget:
+    """
+    单个评估进程的内存预算（MB）。
+
+    - max_pixels: 推理前图像的像素上限（预算的一半留给模型权重以外的图像相关开销），
+      超出的截图在编码前等比缩小；
+    - 任务峰值超过预算时由 run_evaluation 打印警告。
+    """
+
+    def __init__(self, max_mb):
+        self.max_mb = max_mb
+
+    @property
+    def max_pixels(self):
+        return int(self.max_mb * 1024 * 1024 / 2 / BYTES_PER_PIXEL)
+
+    def exceeded(self, peak_mb):
+        return peak_mb > self.max_mb
+
+
+def _read_status(field):
+    """读取 /proc/self/status 中以 kB 为单位的字段，返回 MB；不可用时返回 None。"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class PeakMemoryTracker:
+    """
+    逐任务峰值内存：reset() 在任务开始前调用，peak() 在任务结束后返回 {"rss_mb": ..., "gpu_mb": ...}。
+
+    Linux 上通过写 /proc/self/clear_refs 重置峰值 RSS，peak 为该任务期间的真实峰值；
+    其他平台无法重置，退化为进程启动以来的历史峰值。已导入 torch 且有可用显卡时同时统计显存峰值
+    （不会为此主动导入 torch）。并发评估时多个任务的执行时间重叠，峰值反映的是对应时间窗口内的整体占用。
+    """
+
+    def __init__(self):
+        self._resettable = True
+
+    def reset(self):
+        if self._resettable:
+            try:
+                with open("/proc/self/clear_refs", "w") as f:
+                    f.write("5")
+            except OSError:
+                self._resettable = False
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    def peak(self):
+        rss_mb = _read_status("VmHWM") if self._resettable else None
+        if rss_mb is None:
+            usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # macOS 上 ru_maxrss 以字节为单位，Linux 上以 kB 为单位
+            rss_mb = usage / 2**20 if sys.platform == "darwin" else usage / 1024
+        result = {"rss_mb": round(rss_mb, 1)}
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            result["gpu_mb"] = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+        return result
+
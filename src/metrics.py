@@ -0,0 +1,212 @@
+import argparse
+import json
+
+import numpy as np
+
+DEFAULT_IOU_THRESHOLDS = (0.3, 0.5, 0.7)
+
+# 指令类型关键词（按顺序匹配，命中第一个即返回）
+INSTRUCTION_TYPE_KEYWORDS = (
+    ("click", ("点击", "单击", "click", "press", "tap")),
+    ("locate", ("找到", "查找", "定位", "find", "locate")),
+    ("type", ("输入", "填写", "type", "enter", "fill")),
+    ("select", ("选择", "勾选", "select", "choose", "pick")),
+)
+
+
+def split_errors(records):
+    """
+    把结果分为 (模型结果, 客户端 / API 错误)：带 error 字段的记录是请求失败（重试耗尽、熔断），
+    不是模型的输出，不计入定位指标，单独报告。
+    """
+    ok = [r for r in records if not r.get("error")]
+    errors = [r for r in records if r.get("error")]
+    return ok, errors
+
+
+def load_results(path):
+    """
+    读取 results.json，返回 (pred, gt, records)：pred / gt 为 (N, 4) 的 float 数组。
+    客户端 / API 错误的记录不包含在内（见 split_errors）。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        records, _ = split_errors(json.load(f))
+    pred = to_bbox_array([r["pred_bbox"] for r in records])
+    gt = to_bbox_array([r["gt_bbox"] for r in records])
+    return pred, gt, records
+
+
+def to_bbox_array(bboxes):
+    arr = np.asarray(bboxes, dtype=np.float64)
+    if arr.size == 0:
+        return arr.reshape(0, 4)
+    return arr.reshape(-1, 4)
+
+
+def failure_mask(pred):
+    """[0,0,0,0] 哨兵以及非正面积的预测都视为失败。"""
+    return (pred[:, 2] <= pred[:, 0]) | (pred[:, 3] <= pred[:, 1])
+
+
+def iou(pred, gt):
+    """逐行计算 IoU，失败预测的 IoU 为 0。"""
+    ix1 = np.maximum(pred[:, 0], gt[:, 0])
+    iy1 = np.maximum(pred[:, 1], gt[:, 1])
+    ix2 = np.minimum(pred[:, 2], gt[:, 2])
+    iy2 = np.minimum(pred[:, 3], gt[:, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area_p = np.clip(pred[:, 2] - pred[:, 0], 0, None) * np.clip(pred[:, 3] - pred[:, 1], 0, None)
+    area_g = np.clip(gt[:, 2] - gt[:, 0], 0, None) * np.clip(gt[:, 3] - gt[:, 1], 0, None)
+    union = area_p + area_g - inter
+    out = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+    out[failure_mask(pred)] = 0.0
+    return out
+
+
+def center_hit(pred, gt):
+    """预测框中心点是否落在真实框内（点击类任务最关心的指标）。"""
+    cx = (pred[:, 0] + pred[:, 2]) / 2
+    cy = (pred[:, 1] + pred[:, 3]) / 2
+    hit = (cx >= gt[:, 0]) & (cx <= gt[:, 2]) & (cy >= gt[:, 1]) & (cy <= gt[:, 3])
+    return hit & ~failure_mask(pred)
+
+
+def classify_instruction(instruction):
+    text = instruction.lower()
+    for name, keywords in INSTRUCTION_TYPE_KEYWORDS:
+        if any(k in text for k in keywords):
+            return name
+    return "other"
+
+
+def instruction_types(records):
+    """
+    返回每条记录的指令类型。记录自带 "type" 字段时直接使用，否则按关键词分类；
+    相同指令只分类一次。
+    """
+    memo = {}
+    types = []
+    for r in records:
+        t = r.get("type")
+        if t is None:
+            instruction = r.get("instruction", "")
+            t = memo.get(instruction)
+            if t is None:
+                t = memo[instruction] = classify_instruction(instruction)
+        types.append(t)
+    return types
+
+
+def bootstrap_ci(values, n_boot=1000, alpha=0.05, seed=0):
+    """
+    均值的 bootstrap 置信区间。
+
+    不对 N 个样本逐次重采样，而是在取值的经验分布上做多项分布抽样：
+    重采样后各取值出现的次数服从 Multinomial(N, p)，复杂度为 O(N + n_boot × 取值个数)。
+    布尔值直接计数；连续值（如 IoU）量化到 1e-3 网格后用 bincount 统计。
+    """
+    values = np.asarray(values)
+    n = values.size
+    if n == 0:
+        return (float("nan"), float("nan"))
+    if values.dtype == bool:
+        hits = int(np.count_nonzero(values))
+        uniq = np.array([0.0, 1.0])
+        counts = np.array([n - hits, hits])
+    else:
+        q = np.round(values.astype(np.float64) * 1000).astype(np.int64)
+        offset = q.min()
+        counts = np.bincount(q - offset)
+        keep = counts > 0
+        uniq = (np.nonzero(keep)[0] + offset) / 1000.0
+        counts = counts[keep]
+    rng = np.random.default_rng(seed)
+    draws = rng.multinomial(n, counts / n, size=n_boot)
+    means = draws @ uniq / n
+    lo, hi = np.quantile(means, [alpha / 2, 1 - alpha / 2])
+    return float(lo), float(hi)
+
+
+def _summarize(ious, hits, failed, thresholds, n_boot):
+    summary = {
+        "count": int(ious.size),
+        "failure_rate": float(failed.mean()) if ious.size else 0.0,
+        "mean_iou": float(ious.mean()) if ious.size else 0.0,
+        "center_acc": float(hits.mean()) if ious.size else 0.0,
+    }
+    for t in thresholds:
+        summary[f"acc@{t}"] = float((ious >= t).mean()) if ious.size else 0.0
+    if n_boot:
+        summary["mean_iou_ci"] = bootstrap_ci(ious, n_boot)
+        summary["center_acc_ci"] = bootstrap_ci(hits, n_boot)
+        for t in thresholds:
+            summary[f"acc@{t}_ci"] = bootstrap_ci(ious >= t, n_boot)
+    return summary
+
+
+def score(pred, gt, types=None, thresholds=DEFAULT_IOU_THRESHOLDS, n_boot=1000):
+    """
+    对整批预测打分，pred / gt 为 (N, 4) 归一化坐标数组。
+    返回整体指标，以及（给定 types 时）按指令类型拆分的指标。
+    """
+    ious = iou(pred, gt)
+    hits = center_hit(pred, gt)
+    failed = failure_mask(pred)
+    report = {"overall": _summarize(ious, hits, failed, thresholds, n_boot)}
+
+    if types is not None:
+        # 用字典编码类型（比对字符串数组做 np.unique 排序快得多）
+        index = {}
+        codes = np.fromiter((index.setdefault(t, len(index)) for t in types), dtype=np.int64, count=len(ious))
+        report["by_type"] = {}
+        for name, k in sorted(index.items()):
+            mask = codes == k
+            report["by_type"][str(name)] = _summarize(ious[mask], hits[mask], failed[mask], thresholds, n_boot)
+    return report
+
+
+def score_file(path, thresholds=DEFAULT_IOU_THRESHOLDS, n_boot=1000):
+    pred, gt, records = load_results(path)
+    return score(pred, gt, instruction_types(records), thresholds, n_boot)
+
+
+def format_table(reports, thresholds=DEFAULT_IOU_THRESHOLDS):
+    """把多个 {name: report} 格式化为并排对比的 Markdown 表格。"""
+    columns = ["count", "failure_rate", "mean_iou", "center_acc"] + [f"acc@{t}" for t in thresholds]
+    lines = [
+        "| run | type | " + " | ".join(columns) + " |",
+        "|---|---|" + "---|" * len(columns),
+    ]
+    for name, report in reports.items():
+        rows = [("all", report["overall"])] + sorted(report.get("by_type", {}).items())
+        for type_name, summary in rows:
+            cells = []
+            for c in columns:
+                v = summary[c]
+                cell = str(v) if c == "count" else f"{v:.3f}"
+                if f"{c}_ci" in summary:
+                    lo, hi = summary[f"{c}_ci"]
+                    cell += f" [{lo:.3f}, {hi:.3f}]"
+                cells.append(cell)
+            lines.append(f"| {name} | {type_name} | " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对一个或多个 results.json 计算定位指标")
+    parser.add_argument("results", nargs="+", help="results.json 路径，可传多个并排比较")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=list(DEFAULT_IOU_THRESHOLDS))
+    parser.add_argument("--n-boot", type=int, default=1000, help="bootstrap 次数，0 表示不计算置信区间")
+    parser.add_argument("--json", action="store_true", help="以 JSON 格式输出")
+    args = parser.parse_args()
+
+    thresholds = tuple(args.thresholds)
+    reports = {path: score_file(path, thresholds, args.n_boot) for path in args.results}
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=4))
+    else:
+        print(format_table(reports, thresholds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+本地的 DashScope 兼容服务，用于在没有网络的情况下对 API 客户端做压测和故障注入。
+
+    python3 -m src.mock_server --port 8089 --latency-ms 200 --throttle-rate 0.1 --error-rate 0.05
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8089/api/v1 python3 main.py --workers 32
+
+返回的文本符合项目 prompt 要求的 Thought / BBox 格式，bbox 由请求内容确定性生成；
+切片 prompt 的请求约有 3/4 确定性地回答 BBox: NOT_FOUND（目标不在该切片中）。
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.api_client import GENERATION_PATH
+from src.parser import NOT_FOUND
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 压测时会有大量并发连接，默认的 listen backlog（5）会导致连接被拒绝
+    request_queue_size = 256
+
+
+class MockDashScopeServer:
+    """
+    故障注入参数：
+
+    - latency_ms / latency_jitter_ms: 每个请求的处理延迟（均匀分布在 latency_ms ± jitter 内）；
+    - throttle_rate: 以该概率返回 429，并带上 Retry-After: retry_after 秒；
+    - error_rate: 以该概率返回 500 / 503；
+    - hang_rate: 以该概率挂起 hang_seconds 秒后再应答，用于触发客户端超时；
+    - max_concurrency: 同时处理的请求数上限，超出时返回 429（模拟服务端限流），None 表示不限制。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=50.0, latency_jitter_ms=0.0, throttle_rate=0.0,
+                 retry_after=1.0, error_rate=0.0, hang_rate=0.0, hang_seconds=30.0, max_concurrency=None, seed=0):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.max_concurrency = max_concurrency
+        self.stats = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._httpd = _Server((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def _record(self, status):
+        with self._lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+    def _draw(self):
+        """决定本次请求的结局，返回 (status, 延迟秒数)。"""
+        with self._lock:
+            r = self._rng.random()
+            latency = max(0.0, self.latency_ms + self._rng.uniform(-1, 1) * self.latency_jitter_ms) / 1000
+        if r < self.throttle_rate:
+            return 429, 0.0
+        r -= self.throttle_rate
+        if r < self.error_rate:
+            return (500 if r < self.error_rate / 2 else 503), latency
+        r -= self.error_rate
+        if r < self.hang_rate:
+            return 200, self.hang_seconds
+        return 200, latency
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload, headers=None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                server._record(status)
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    for key, value in (headers or {}).items():
+                        self.send_header(key, value)
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端已超时断开（挂起注入的预期结果）
+                    self.close_connection = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.endswith(GENERATION_PATH):
+                    return self._reply(404, {"code": "NotFound", "message": self.path})
+                try:
+                    request = json.loads(body)
+                    content = request["input"]["messages"][0]["content"]
+                    request["model"]
+                except (ValueError, KeyError, IndexError, TypeError):
+                    return self._reply(400, {"code": "InvalidParameter", "message": "malformed request"})
+
+                with server._lock:
+                    server._in_flight += 1
+                    overloaded = server.max_concurrency is not None and server._in_flight > server.max_concurrency
+                try:
+                    if overloaded:
+                        return self._reply(429, {"code": "Throttling", "message": "too many concurrent requests"},
+                                           {"Retry-After": str(server.retry_after)})
+                    status, delay = server._draw()
+                    time.sleep(delay)
+                    if status == 429:
+                        return self._reply(429, {"code": "Throttling.RateQuota", "message": "rate limited"},
+                                           {"Retry-After": str(server.retry_after)})
+                    if status != 200:
+                        return self._reply(status, {"code": "InternalError", "message": "injected failure"})
+                    return self._reply(200, _generation_payload(body, content))
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+
+        return Handler
+
+    def start(self):
+        """在后台线程中启动服务，返回 base_url。"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _generation_payload(body, content):
+    digest = hashlib.sha256(body).digest()
+    x1, y1 = digest[0] / 255 * 0.8, digest[1] / 255 * 0.8
+    bbox = [round(x1, 3), round(y1, 3), round(x1 + 0.05 + digest[2] / 255 * 0.15, 3),
+            round(y1 + 0.02 + digest[3] / 255 * 0.1, 3)]
+    prompt = next((part["text"] for part in content if "text" in part), "")
+    if NOT_FOUND in prompt and digest[4] % 4:
+        text = f"Thought: 模拟服务判断目标不在该切片中。\nBBox: {NOT_FOUND}"
+    else:
+        text = f"Thought: 模拟服务根据请求内容生成的结果。\nBBox: {bbox}"
+    return {
+        "output": {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": [{"text": text}]}}]},
+        "usage": {"input_tokens": len(prompt), "output_tokens": len(text), "image_tokens": len(body) // 1024},
+        "request_id": digest.hex()[:32],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 DashScope 兼容服务（故障注入）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应中 Retry-After 的秒数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 / 503 的概率")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="挂起请求（触发客户端超时）的概率")
+    parser.add_argument("--hang-seconds", type=float, default=30.0)
+    parser.add_argument("--max-concurrency", type=int, default=None, help="同时处理的请求数上限")
+    args = parser.parse_args()
+
+    server = MockDashScopeServer(
+        args.host, args.port, args.latency_ms, args.latency_jitter_ms, args.throttle_rate, args.retry_after,
+        args.error_rate, args.hang_rate, args.hang_seconds, args.max_concurrency,
+    )
+    print(f"Mock DashScope 服务已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import re
+
+from src.preprocess import merge_outputs
+
+# 预编译的正则，模块加载时只编译一次
+_FLOAT_RE = re.compile(r"[-+]?(?:\d*\.\d+|\d+)(?:[eE][-+]?\d+)?")
+_THOUGHT_RE = re.compile(r"Thought\s*[:：]\s*", re.I)
+# 显式大小写字符类代替 re.I：匹配结果相同，但正则引擎可以更快地定位候选起点
+_TAG_RE = re.compile(r"[Bb][Bb][Oo][Xx]\s*[:：]\s*\[([^\]]+)\]")
+_GENERIC_RE = re.compile(r"\[([^\]]+)\]")
+
+FAILURE_BBOX = [0, 0, 0, 0]
+# 切片视图的 prompt 允许模型回答目标不在该切片中（BBox: NOT_FOUND），解析为没有候选
+NOT_FOUND = "NOT_FOUND"
+_NOT_FOUND_RE = re.compile(r"[Bb][Bb][Oo][Xx]\s*[:：]\s*" + NOT_FOUND)
+
+
+def _iter_candidates(text):
+    """
+    从后往前逐个产出候选 bbox（字符串形式的 4 个数），只在被消费到时才提取数字：
+    存在至少一个含 4 个以上数字的 BBox: [...] 时只在这些标记中取前 4 个数；
+    否则退回到所有恰好包含 4 个数的普通括号组。
+    """
+    findall = _FLOAT_RE.findall
+    found = False
+    for body in reversed(_TAG_RE.findall(text)):
+        nums = findall(body)
+        if len(nums) >= 4:
+            found = True
+            yield nums[:4]
+    if found:
+        return
+    for body in reversed(_GENERIC_RE.findall(text)):
+        nums = findall(body)
+        if len(nums) == 4:
+            yield nums
+
+
+def _select_bbox(candidates, width, height):
+    """取第一个归一化后合法的候选（候选已按从后往前排列：模型常会先给一个尝试，后面再自我修正）。"""
+    for raw in candidates:
+        bbox = [float(n) for n in raw]
+        # 自动纠正：如果任意坐标值大于 1.1，判定为像素坐标并强制归一化
+        if bbox[0] > 1.1 or bbox[1] > 1.1 or bbox[2] > 1.1 or bbox[3] > 1.1:
+            bbox = [bbox[0] / width, bbox[1] / height, bbox[2] / width, bbox[3] / height]
+        # 裁剪到合法范围 [0, 1]，并统一保留 3 位小数
+        x1, y1, x2, y2 = [round(max(0.0, min(1.0, v)), 3) for v in bbox]
+        # 必须是正面积矩形
+        if x2 > x1 and y2 > y1:
+            return [x1, y1, x2, y2]
+    return None
+
+
+def find_tagged_bbox(text, width, height):
+    """
+    返回文本中最后一个归一化后合法的 BBox: [...] 标记（不退回普通括号组），没有时返回 None。
+    用于生成过程中判断模型是否已经输出了完整的结果。
+    """
+    findall = _FLOAT_RE.findall
+    candidates = (nums[:4] for nums in map(findall, reversed(_TAG_RE.findall(text))) if len(nums) >= 4)
+    return _select_bbox(candidates, width, height)
+
+
+def parse_response(response, width, height):
+    """
+    从模型返回的文本中解析出 (thought, bbox)。
+    如果模型输出的是像素坐标，则根据 width 和 height 进行自动归一化。
+
+    选择规则：存在含 4 个以上数字的 BBox: [...] 标记时只在这些候选中选；否则在所有恰好 4 个数的括号组中选；
+    取最后一个合法候选，都不合法时返回 [0, 0, 0, 0]。模型回答 BBox: NOT_FOUND 时只在其后的文本中找候选，
+    之后没有再给出坐标即视为目标不在该视图中，返回 [0, 0, 0, 0]。
+    """
+    try:
+        # 提取 Thought：第一个 Thought: 之后、第一个 BBox: 之前的内容
+        thought = ""
+        m = _THOUGHT_RE.search(response)
+        if m is not None:
+            end = response.find("BBox:", m.end())
+            thought = (response[m.end():] if end < 0 else response[m.end():end]).strip()
+
+        text = response
+        if NOT_FOUND in response:
+            for m in _NOT_FOUND_RE.finditer(response):
+                text = response[m.end():]
+        bbox = _select_bbox(_iter_candidates(text), width, height)
+        return thought, bbox if bbox is not None else list(FAILURE_BBOX)
+    except Exception as e:
+        print(f"解析失败: {e}, 原始输出: {response}")
+        return "解析失败", list(FAILURE_BBOX)
+
+
+def parse_many(items):
+    """批量解析，items 为 (response, width, height) 序列，返回 (thought, bbox) 列表。"""
+    return [parse_response(response, width, height) for response, width, height in items]
+
+
+def parse_view(view):
+    """解析原始记录中的单个视图；调用失败的视图（带 error 字段）直接返回错误信息和失败哨兵。"""
+    if "error" in view:
+        return view["error"], list(FAILURE_BBOX)
+    width, height = view["size"]
+    return parse_response(view["response"], width, height)
+
+
+def raw_error(raw):
+    """
+    原始记录中第一个调用失败视图的错误信息（重试耗尽、熔断等客户端 / API 错误），没有时返回 None。
+    这类记录不是模型的输出，不应计入模型的失败率。
+    """
+    for view in raw["views"]:
+        if "error" in view:
+            return view["error"]
+    return None
+
+
+def parse_raw(raw):
+    """
+    把 UIGroundingModel.predict_raw 返回的原始记录解析为 (thought, bbox)：
+    逐个视图解析后按切片坐标合并。只依赖记录本身，可以离线重新解析归档中的历史输出。
+    """
+    views = raw["views"]
+    outputs = [parse_view(view) for view in views]
+    return merge_outputs([view["tile"] for view in views], outputs, raw["size"])
@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+
+DEFAULT_PREFIX_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+
+class PrefixCache:
+    """
+    本地模式的共享前缀缓存：按截图保存视觉编码和 prompt 公共前缀经过 prefill 后的状态（KV cache），
+    同一截图上的多条指令只需对各自的指令后缀做 prefill，然后从共享状态开始解码。
+
+    - max_entries / max_bytes: 条目数和总字节数上限，超出时按最近最少使用（LRU）淘汰；
+    - min_free_bytes / free_memory: free_memory() 返回当前可用的显存（字节），低于 min_free_bytes 时
+      持续淘汰最旧的条目，避免缓存挤占推理所需的显存。
+
+    条目内容由后端决定，缓存只记录其占用的字节数。线程安全。
+    """
+
+    def __init__(self, max_entries=16, max_bytes=DEFAULT_PREFIX_CACHE_BYTES, min_free_bytes=None, free_memory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.free_memory = free_memory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        """加入一个条目；单个条目超过 max_bytes 时不缓存，返回是否已缓存。"""
+        if key is None or (self.max_bytes is not None and nbytes > self.max_bytes):
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self._shrink(keep=1)
+        return key in self._entries
+
+    def shrink(self):
+        """在显存紧张时淘汰最旧的条目（推理前调用）。"""
+        with self._lock:
+            self._shrink(keep=0)
+
+    def _shrink(self, keep):
+        while len(self._entries) > keep and self._over_budget():
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+    def _over_budget(self):
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        if self.max_bytes is not None and self.nbytes > self.max_bytes:
+            return True
+        if self.min_free_bytes is not None and self.free_memory is not None:
+            return self.free_memory() < self.min_free_bytes
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+        }
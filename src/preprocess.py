@@ -0,0 +1,154 @@
+import math
+
+from PIL import Image
+
+from src.image_io import ImageHandle
+from src.utils import add_visual_grid
+
+
+def resize_to_pixel_budget(image, max_pixels):
+    """
+    等比缩放图像，使总像素数不超过 max_pixels；本身不超限时原样返回。
+    模型输出的是归一化坐标，缩放不影响结果，只减少传输和编码开销。
+    """
+    width, height = image.size
+    if not max_pixels or width * height <= max_pixels:
+        return image
+    scale = math.sqrt(max_pixels / (width * height))
+    new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return image.resize(new_size, Image.Resampling.LANCZOS)
+
+
+def make_tiles(width, height, tile_size, overlap=0.2):
+    """
+    把 width × height 的图像切分为边长不超过 tile_size 的重叠切片，返回像素坐标框列表
+    [(x0, y0, x1, y1), ...]，按从上到下、从左到右排列。相邻切片重叠 overlap 比例，
+    保证跨越切片边界的元素至少完整出现在一个切片中。
+    """
+    def _starts(length):
+        if length <= tile_size:
+            return [0]
+        # 在满足最小重叠的前提下用最少的切片覆盖全长，并均匀分布
+        step = max(1, int(tile_size * (1 - overlap)))
+        n = math.ceil((length - tile_size) / step) + 1
+        return [round(i * (length - tile_size) / (n - 1)) for i in range(n)]
+
+    tile_w, tile_h = min(tile_size, width), min(tile_size, height)
+    return [
+        (x0, y0, x0 + tile_w, y0 + tile_h)
+        for y0 in _starts(height)
+        for x0 in _starts(width)
+    ]
+
+
+def project_bbox(bbox, tile, width, height):
+    """把切片内的归一化 bbox 投影回整张图的归一化坐标。"""
+    x0, y0, x1, y1 = tile
+    tile_w, tile_h = x1 - x0, y1 - y0
+    return [
+        round((x0 + bbox[0] * tile_w) / width, 3),
+        round((y0 + bbox[1] * tile_h) / height, 3),
+        round((x0 + bbox[2] * tile_w) / width, 3),
+        round((y0 + bbox[3] * tile_h) / height, 3),
+    ]
+
+
+def _touches_cut_edge(bbox, tile, width, height, eps=0.005):
+    """bbox 是否贴着切片的内部切割边（而非原图边界），贴边说明元素可能被截断。"""
+    x0, y0, x1, y1 = tile
+    return (
+        (bbox[0] <= eps and x0 > 0)
+        or (bbox[1] <= eps and y0 > 0)
+        or (bbox[2] >= 1 - eps and x1 < width)
+        or (bbox[3] >= 1 - eps and y1 < height)
+    )
+
+
+def merge_outputs(tiles, outputs, size):
+    """
+    合并各视图的 (thought, bbox)：切片视图的 prompt 允许回答目标不在该切片中（解析为失败哨兵，不参与合并），
+    切片坐标投影回整图后，取第一个合法且未贴切割边的结果；
+    都贴边时退而取第一个合法结果；全部失败时返回失败哨兵。tiles 与 outputs 一一对应，
+    tile 为 None 表示整图视图。只依赖坐标，离线重新解析时无需原图。
+    """
+    width, height = size
+    fallback = None
+    for tile, (thought, bbox) in zip(tiles, outputs):
+        if not (bbox[2] > bbox[0] and bbox[3] > bbox[1]):
+            continue
+        if tile is None:
+            return thought, bbox
+        projected = project_bbox(bbox, tile, width, height)
+        if not _touches_cut_edge(bbox, tile, width, height):
+            return thought, projected
+        if fallback is None:
+            fallback = (thought, projected)
+    if fallback is not None:
+        return fallback
+    return outputs[0][0] if outputs else "", [0, 0, 0, 0]
+
+
+class Preprocessor:
+    """
+    推理前的图像预处理：
+
+    - max_pixels: 像素预算，超出时等比缩小后再发送给模型；
+    - tile_size: 切片边长（像素），图像任一边超过它时切分为重叠切片逐片定位，None 表示不切片；
+    - tile_overlap: 相邻切片的重叠比例；
+    - tile_workers: API 模式下并行请求的切片数；
+    - image_format: 缩放 / 切片后图像的编码格式（仅在需要上传字节时编码）；
+    - grid_size: 在送入模型的视图上叠加参考网格（src.utils.add_visual_grid）的间距（像素），None 表示不叠加。
+    """
+
+    def __init__(self, max_pixels=None, tile_size=None, tile_overlap=0.2, tile_workers=4, image_format="PNG",
+                 grid_size=None):
+        self.max_pixels = max_pixels
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_workers = tile_workers
+        self.image_format = image_format
+        self.grid_size = grid_size
+
+    def signature(self):
+        """预处理配置的字符串表示，参与预测缓存的 key。"""
+        signature = f"max_pixels={self.max_pixels},tile={self.tile_size}/{self.tile_overlap}"
+        if self.grid_size:
+            signature += f",grid={self.grid_size}"
+        return signature
+
+    def views(self, image):
+        """
+        返回需要送入模型的视图列表 [(tile, ImageHandle), ...]。tile 为切片在原图中的
+        像素坐标框；不切片时只有一个视图，tile 为 None。
+        图像无需缩放、不切片也不叠加网格时直接返回原句柄，不做任何解码。
+        """
+        width, height = image.size
+        if self.tile_size and (width > self.tile_size or height > self.tile_size):
+            tiles = make_tiles(width, height, self.tile_size, self.tile_overlap)
+        else:
+            if (not self.max_pixels or width * height <= self.max_pixels) and not self.grid_size:
+                return [(None, image)]
+            tiles = [None]
+
+        full = image.decode()
+        views = []
+        for tile in tiles:
+            view = full if tile is None else full.crop(tile)
+            view = resize_to_pixel_budget(view, self.max_pixels)
+            if self.grid_size:
+                # 未缩放的整图视图就是原图本身，需要先复制再画网格
+                if view.mode not in ("RGB", "RGBA"):
+                    view = view.convert("RGB")
+                elif view is full:
+                    view = view.copy()
+                view = add_visual_grid(view, self.grid_size)
+            handle = ImageHandle.from_image(view, self.image_format)
+            handle.tile = tile
+            if image.key is not None:
+                handle.key = f"{image.key}|{self.signature()}|{tile}"
+            views.append((tile, handle))
+        return views
+
+    def merge(self, views, outputs, size):
+        """合并各视图的 (thought, bbox)，规则见 merge_outputs。"""
+        return merge_outputs([tile for tile, _ in views], outputs, size)
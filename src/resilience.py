@@ -0,0 +1,117 @@
+import random
+import threading
+import time
+
+
+class TransientError(Exception):
+    """可重试的失败（限流、服务端 5xx、超时、连接错误）。retry_after 为服务端建议的等待秒数。"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝。"""
+
+
+class RetryPolicy:
+    """
+    带抖动的指数退避：第 attempt 次重试前等待 uniform(0, min(max_delay, base_delay * 2 ** attempt)) 秒
+    （full jitter，避免大量并发请求在同一时刻重试）。服务端给出 Retry-After 时至少等待该时长，
+    但不超过 max_delay。
+    """
+
+    def __init__(self, max_retries=3, base_delay=0.5, max_delay=30.0, seed=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = random.Random(seed)
+
+    def delay(self, attempt, retry_after=None):
+        backoff = self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            backoff = max(backoff, retry_after + self._rng.uniform(0, self.base_delay))
+        return min(backoff, self.max_delay)
+
+
+class CircuitBreaker:
+    """
+    熔断器，线程安全：
+
+    - closed: 正常放行，连续 failure_threshold 次可重试失败后打开；
+    - open: 直接拒绝请求（快速失败，不再给已经过载的服务端增加压力），reset_timeout 秒后进入半开；
+    - half_open: 只放行一个试探请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = "half_open"
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+def call_with_retry(func, policy, breaker=None, instrumentation=None, sleep=time.sleep):
+    """
+    调用 func()，遇到 TransientError 按 policy 退避重试。breaker 打开时抛出 CircuitOpenError；
+    重试耗尽后抛出最后一次的 TransientError。其它异常视为不可重试，直接向上抛出
+    （例如参数错误：服务端能正常应答，对熔断器而言算作成功）。
+    """
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow():
+            if instrumentation is not None:
+                instrumentation.count("circuit_open")
+            raise CircuitOpenError("circuit breaker is open")
+        try:
+            result = func()
+        except TransientError as e:
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt >= policy.max_retries:
+                raise
+            delay = policy.delay(attempt, e.retry_after)
+            if instrumentation is not None:
+                instrumentation.count("api_retry")
+                instrumentation.observe("retry_delay", delay)
+            sleep(delay)
+            attempt += 1
+            continue
+        except Exception:
+            if breaker is not None:
+                breaker.record_success()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result
@@ -0,0 +1,431 @@
+"""
+常驻的 UI Grounding 推理服务：进程内只加载一次模型，把并发到达的单条请求合并成微批次推理。
+
+    python3 -m src.server --mode local --model Qwen/Qwen2-VL-7B-Instruct --max-batch-size 8 --max-wait-ms 10
+    curl -s http://127.0.0.1:8090/health
+
+接口（JSON）：
+
+- POST /v1/ground: {"instruction": "...", "image": "<base64 编码的截图>"}，
+  或 {"instruction": "...", "image_path": "..."}（需要 --allow-image-paths，路径在服务端读取）；
+  返回 {"thought": ..., "bbox": [x1, y1, x2, y2], "size": [W, H], "latency_ms": ...}。
+  排队请求数达到上限时返回 429 并带上 Retry-After（背压），等待超过 --request-timeout 返回 504，
+  后端请求失败（重试耗尽、熔断）返回 502；
+- GET /health: 存活检查，以及当前的模式、模型和排队长度；
+- GET /metrics: 调度统计（排队长度、在途请求）与埋点分布（批大小、排队时间、请求延迟、各阶段耗时）。
+"""
+import argparse
+import base64
+import binascii
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import UnidentifiedImageError
+
+from src.api_client import DEFAULT_BASE_URL, DashScopeClient
+from src.backends import BACKENDS, DECODING_MODES
+from src.cache import DEFAULT_CACHE_PATH, PredictionCache
+from src.concurrency import RequestLimiter
+from src.grounding_model import DEFAULT_MAX_BATCH_PIXELS, UIGroundingModel
+from src.image_io import ImageHandle
+from src.instrumentation import Instrumentation
+from src.parser import parse_raw, raw_error
+from src.prefix_cache import PrefixCache
+from src.preprocess import Preprocessor
+from src.resilience import CircuitBreaker, RetryPolicy
+
+GROUND_PATH = "/v1/ground"
+# 埋点分布只保留最近的这么多个样本，常驻进程的内存占用不随请求数增长
+METRICS_WINDOW = 10000
+
+
+class Overloaded(Exception):
+    """请求队列已满（背压），调用方应稍后重试。"""
+
+
+class _Request:
+    __slots__ = ("image", "instruction", "future", "enqueued")
+
+    def __init__(self, image, instruction):
+        self.image = image
+        self.instruction = instruction
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class BatchScheduler:
+    """
+    把并发到达的单条请求合并成微批次交给 UIGroundingModel：
+
+    - 支持批量的后端（本地模式）由一个工作线程取批：拿到第一条请求后最多再等待 max_wait_ms，
+      凑满 max_batch_size 条或超时即调用一次 predict_batch_raw（批次同时受 max_batch_pixels 限制）；
+    - 其它后端（api / mock）没有批量收益，由 workers 个线程各自逐条处理；
+    - 排队请求数达到 max_queue 时 submit() 直接抛出 Overloaded，不在内存中无限堆积。
+
+    submit() 返回 concurrent.futures.Future，结果为原始输出记录（格式见 UIGroundingModel.predict_raw）。
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=10.0, max_queue=64, workers=8,
+                 max_batch_pixels=DEFAULT_MAX_BATCH_PIXELS):
+        self.model = model
+        self.batched = model.backend.batched
+        self.max_batch_size = max_batch_size if self.batched else 1
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.max_batch_pixels = max_batch_pixels
+        self.workers = 1 if self.batched else workers
+        self.instrumentation = model.instrumentation
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"grounding-worker-{k}", daemon=True)
+            for k in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, image, instruction):
+        request = _Request(image, instruction)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            self.instrumentation.count("rejected")
+            raise Overloaded(f"排队请求数已达上限 {self.max_queue}")
+        self.instrumentation.count("accepted")
+        return request.future
+
+    def _next_batch(self):
+        """阻塞取第一条请求，再在 max_wait 内尽量凑满一批；取到停止标记时返回 (batch, True)。"""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _worker(self):
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                self._run(batch)
+            if stop:
+                return
+
+    def _run(self, batch):
+        # 等待超时的请求已被取消（客户端收到 504），不再占用模型时间
+        batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        now = time.perf_counter()
+        for request in batch:
+            self.instrumentation.observe("queue_wait_ms", (now - request.enqueued) * 1000)
+        self.instrumentation.observe("batch_size", len(batch))
+        with self._lock:
+            self._in_flight += len(batch)
+        try:
+            if self.batched:
+                raws = self.model.predict_batch_raw(
+                    [(r.image, r.instruction) for r in batch], self.max_batch_size, self.max_batch_pixels
+                )
+            else:
+                raws = [self.model.predict_raw(batch[0].image, batch[0].instruction)]
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+        else:
+            for request, raw in zip(batch, raws):
+                request.future.set_result(raw)
+        finally:
+            with self._lock:
+                self._in_flight -= len(batch)
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "queue_depth": self._queue.qsize(),
+            "in_flight": in_flight,
+            "max_queue": self.max_queue,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "workers": self.workers,
+        }
+
+    def close(self):
+        """处理完已排队的请求后停止工作线程。"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 大量 agent 同时连接时，默认的 listen backlog（5）会导致连接被拒绝
+    request_queue_size = 256
+
+
+class GroundingServer:
+    """
+    包装 BatchScheduler 的 HTTP 服务（接口见模块说明）。
+
+    - request_timeout: 单个请求最多等待的秒数（含排队），超时返回 504；
+    - retry_after: 429 响应中建议客户端等待的秒数；
+    - allow_image_paths: 是否接受 image_path（在服务端读取文件），默认只接受上传的图像字节。
+    """
+
+    def __init__(self, model, host="127.0.0.1", port=0, request_timeout=120.0, retry_after=1.0,
+                 allow_image_paths=False, **scheduler_kwargs):
+        self.model = model
+        self.scheduler = BatchScheduler(model, **scheduler_kwargs)
+        self.request_timeout = request_timeout
+        self.retry_after = retry_after
+        self.allow_image_paths = allow_image_paths
+        self.started = time.time()
+        self._httpd = _Server((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def health(self):
+        return {
+            "status": "ok",
+            "mode": self.model.mode,
+            "model": self.model.model_path,
+            "decoding": self.model.decoding,
+            "uptime_s": round(time.time() - self.started, 1),
+            "queue_depth": self.scheduler.stats()["queue_depth"],
+        }
+
+    def metrics(self):
+        return {"scheduler": self.scheduler.stats(), **self.model.instrumentation.summary()}
+
+    def _parse_request(self, body):
+        """解析 /v1/ground 的请求体，返回 (ImageHandle, instruction)；不合法时抛出 ValueError。"""
+        try:
+            request = json.loads(body)
+            instruction = request["instruction"]
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("请求体必须是包含 instruction 的 JSON 对象")
+        if not isinstance(instruction, str) or not instruction:
+            raise ValueError("instruction 必须是非空字符串")
+
+        if "image" in request:
+            try:
+                return ImageHandle.from_bytes(base64.b64decode(request["image"], validate=True)), instruction
+            except (binascii.Error, TypeError, UnidentifiedImageError):
+                raise ValueError("image 必须是 base64 编码的图像")
+        if "image_path" in request:
+            if not self.allow_image_paths:
+                raise ValueError("服务未开启 --allow-image-paths，请上传图像字节")
+            image = ImageHandle(request["image_path"])
+            try:
+                image.size
+            except (OSError, UnidentifiedImageError):
+                raise ValueError(f"无法读取图像: {request['image_path']}")
+            return image, instruction
+        raise ValueError("缺少 image 或 image_path")
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload, headers=None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    for key, value in (headers or {}).items():
+                        self.send_header(key, value)
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端已超时断开
+                    self.close_connection = True
+
+            def do_GET(self):
+                if self.path == "/health":
+                    return self._reply(200, server.health())
+                if self.path == "/metrics":
+                    return self._reply(200, server.metrics())
+                return self._reply(404, {"error": f"未知路径: {self.path}"})
+
+            def do_POST(self):
+                start = time.perf_counter()
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path != GROUND_PATH:
+                    return self._reply(404, {"error": f"未知路径: {self.path}"})
+                try:
+                    image, instruction = server._parse_request(body)
+                except ValueError as e:
+                    server.model.instrumentation.count("bad_request")
+                    return self._reply(400, {"error": str(e)})
+
+                try:
+                    future = server.scheduler.submit(image, instruction)
+                except Overloaded as e:
+                    return self._reply(429, {"error": str(e)}, {"Retry-After": str(server.retry_after)})
+                try:
+                    raw = future.result(timeout=server.request_timeout)
+                except FutureTimeoutError:
+                    # 仍在排队的请求直接取消；已经开始推理的请求无法取消，结果被丢弃
+                    if future.cancel():
+                        server.model.instrumentation.count("cancelled")
+                    server.model.instrumentation.count("timeout")
+                    return self._reply(504, {"error": f"请求在 {server.request_timeout} 秒内未完成"})
+                except Exception as e:
+                    server.model.instrumentation.count("internal_error")
+                    return self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+
+                error = raw_error(raw)
+                if error is not None:
+                    # 后端请求失败（重试耗尽、熔断）不是模型的定位结果，不返回失败哨兵 bbox
+                    server.model.instrumentation.count("backend_error")
+                    return self._reply(502, {"error": error})
+                thought, bbox = parse_raw(raw)
+                latency_ms = (time.perf_counter() - start) * 1000
+                server.model.instrumentation.observe("request_latency_ms", latency_ms)
+                return self._reply(200, {
+                    "thought": thought,
+                    "bbox": bbox,
+                    "size": raw["size"],
+                    "latency_ms": round(latency_ms, 1),
+                })
+
+        return Handler
+
+    def start(self):
+        """在后台线程中启动服务，返回服务地址。"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self.scheduler.close()
+
+
+def build_model(args):
+    """按命令行参数构造常驻的 UIGroundingModel（埋点只保留最近 METRICS_WINDOW 个样本）。"""
+    instrumentation = Instrumentation(max_samples=METRICS_WINDOW)
+    preprocessor = None
+    if args.max_pixels is not None or args.tile_size is not None:
+        preprocessor = Preprocessor(max_pixels=args.max_pixels, tile_size=args.tile_size,
+                                    tile_overlap=args.tile_overlap)
+    api_client = None
+    if args.mode == "api":
+        api_client = DashScopeClient(
+            os.getenv("DASHSCOPE_API_KEY"),
+            base_url=args.api_base_url,
+            timeout=args.api_timeout,
+            retry=RetryPolicy(max_retries=args.max_retries),
+            breaker=CircuitBreaker(args.breaker_threshold, args.breaker_reset) if args.breaker_threshold > 0 else None,
+            instrumentation=instrumentation,
+        )
+    prefix_cache = None
+    if args.mode == "local" and args.prefix_cache:
+        prefix_cache = PrefixCache(max_bytes=args.prefix_cache_mb * 1024 * 1024)
+    return UIGroundingModel(
+        model_path=args.model,
+        mode=args.mode,
+        api_key=os.getenv("DASHSCOPE_API_KEY"),
+        cache=None if args.no_cache else PredictionCache(args.cache_path),
+        preprocessor=preprocessor,
+        instrumentation=instrumentation,
+        api_client=api_client,
+        prefix_cache=prefix_cache,
+        decoding=args.decoding,
+        # 切片请求同样受 --workers 限制，一个请求切成多片时不会放大对后端的并发
+        request_limiter=RequestLimiter(args.workers) if args.mode == "api" else None,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻的 UI Grounding 推理服务（微批次调度 + 背压）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--mode", choices=sorted(BACKENDS), default="api", help="推理后端（默认 api）")
+    parser.add_argument("--model", default="qwen-vl-max", help="API 模式的模型名，或本地模式的权重路径")
+    parser.add_argument("--decoding", choices=DECODING_MODES, default="full", help="解码模式")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="本地模式下每个微批次的最大请求数")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0,
+                        help="本地模式下拿到第一条请求后为凑批最多等待的毫秒数")
+    parser.add_argument("--max-queue", type=int, default=64, help="排队请求数上限，超出时返回 429")
+    parser.add_argument("--workers", type=int, default=8, help="API / Mock 模式下同时处理的请求数")
+    parser.add_argument("--request-timeout", type=float, default=120.0, help="单个请求最多等待的秒数（含排队）")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应中的 Retry-After 秒数")
+    parser.add_argument("--allow-image-paths", action="store_true",
+                        help="接受 image_path 请求（在服务端读取文件，只应在可信环境中开启）")
+    parser.add_argument("--max-pixels", type=int, default=None, help="推理前把图像缩放到该像素预算以内")
+    parser.add_argument("--tile-size", type=int, default=None, help="切片边长（像素）")
+    parser.add_argument("--tile-overlap", type=float, default=0.2, help="相邻切片的重叠比例")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="预测缓存文件路径")
+    parser.add_argument("--no-cache", action="store_true", help="不使用预测缓存")
+    parser.add_argument("--prefix-cache", action="store_true",
+                        help="本地模式：相同截图的请求共享视觉编码和 prompt 前缀的 KV cache")
+    parser.add_argument("--prefix-cache-mb", type=int, default=2048, help="共享前缀缓存的显存上限（MB）")
+    parser.add_argument("--api-base-url", default=os.getenv("DASHSCOPE_BASE_URL", DEFAULT_BASE_URL))
+    parser.add_argument("--api-timeout", type=float, default=60.0, help="单次 API 请求的超时（秒）")
+    parser.add_argument("--max-retries", type=int, default=3, help="限流 / 5xx / 超时后的最大重试次数")
+    parser.add_argument("--breaker-threshold", type=int, default=10, help="连续失败多少次后熔断，0 表示不熔断")
+    parser.add_argument("--breaker-reset", type=float, default=10.0, help="熔断后多少秒放行试探请求")
+    args = parser.parse_args()
+
+    server = GroundingServer(
+        build_model(args),
+        host=args.host,
+        port=args.port,
+        request_timeout=args.request_timeout,
+        retry_after=args.retry_after,
+        allow_image_paths=args.allow_image_paths,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_queue=args.max_queue,
+        workers=args.workers,
+    )
+    print(f"UI Grounding 服务已启动: {server.url}（{server.model.mode} / {server.model.model_path}）", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        if server.model.cache is not None:
+            server.model.cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import json
+import os
+import subprocess
+import sys
+
+from src.archive import ResponseArchive
+
+SHARD_DIR = "output/shards"
+
+
+def parse_shard(text):
+    """解析 "i/N" 形式的分片参数（i 从 0 开始），返回 (i, N)。"""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"分片参数应为 i/N 形式: {text}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"分片编号超出范围: {text}")
+    return index, count
+
+
+class DatasetShard:
+    """
+    数据集的确定性切片：按数据集顺序轮流分配，第 k 个样本属于分片 k % count。
+    轮流分配使各分片的样本数最多相差 1，且难度相近的相邻样本会被分散到不同进程。
+    """
+
+    def __init__(self, dataset, index, count):
+        self.dataset = dataset
+        self.index = index
+        self.count = count
+
+    def __len__(self):
+        total = len(self.dataset)
+        return total // self.count + (1 if self.index < total % self.count else 0)
+
+    def __iter__(self):
+        for k, item in enumerate(self.dataset):
+            if k % self.count == self.index:
+                yield item
+
+
+def shard_paths(index, count, shard_dir=SHARD_DIR):
+    """单个分片的输出文件路径（结果日志、原始输出归档、部分结果、埋点统计、运行日志）。"""
+    prefix = os.path.join(shard_dir, f"shard-{index:03d}-of-{count:03d}")
+    return {
+        "journal": prefix + ".journal.jsonl",
+        "archive": prefix + ".archive",
+        "results": prefix + ".results.json",
+        "instrumentation": prefix + ".instrumentation.json",
+        "log": prefix + ".log",
+    }
+
+
+def merge_shards(dataset, count, out_path, archive_path=None, shard_dir=SHARD_DIR):
+    """
+    把 count 个分片的部分结果按数据集顺序合并为 out_path，返回 (结果列表, 缺失的分片编号列表)。
+    archive_path 不为 None 时同时把各分片的原始输出归档合并到一个归档中，便于整体 reparse。
+    """
+    records = {}
+    missing = []
+    for index in range(count):
+        paths = shard_paths(index, count, shard_dir)
+        if not os.path.exists(paths["results"]):
+            missing.append(index)
+            continue
+        with open(paths["results"], "r", encoding="utf-8") as f:
+            for result in json.load(f):
+                records[str(result["id"])] = result
+
+    results = [records[str(item["id"])] for item in dataset if str(item["id"]) in records]
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, out_path)
+
+    if archive_path is not None:
+        with ResponseArchive(archive_path, mode="w") as merged:
+            for index in range(count):
+                path = shard_paths(index, count, shard_dir)["archive"]
+                if not os.path.exists(path):
+                    continue
+                with ResponseArchive(path) as archive:
+                    for task_id in archive.ids():
+                        merged.append(task_id, archive.get(task_id))
+    return results, missing
+
+
+def _strip_option(argv, name):
+    """从命令行参数中去掉 name 选项及其取值（支持 --name v 和 --name=v 两种写法）。"""
+    out = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        if arg == name:
+            skip = True
+            continue
+        if arg.startswith(name + "="):
+            continue
+        out.append(arg)
+    return out
+
+
+def launch_workers(script, argv, count, shard_dir=SHARD_DIR, devices=None):
+    """
+    在本机启动 count 个子进程，各自以 --shard i/count 运行 script（每个进程只加载一次模型），
+    等待全部结束，返回各进程的退出码列表。子进程的输出写入各分片的 .log 文件。
+
+    - 每个进程的 OMP / MKL 线程数设为 CPU 核数 / count，避免多进程之间的线程超额订阅；
+    - devices 为 GPU 编号列表时按轮转方式设置 CUDA_VISIBLE_DEVICES，每个进程只看到一张卡。
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    # 子进程只负责自己的分片：去掉启动 / 合并多进程相关的选项，分片和设备由这里重新指定
+    for name in ("--processes", "--shard", "--merge-shards", "--devices"):
+        argv = _strip_option(argv, name)
+    threads = str(max(1, (os.cpu_count() or 1) // count))
+
+    procs = []
+    for index in range(count):
+        env = dict(os.environ)
+        env.setdefault("OMP_NUM_THREADS", threads)
+        env.setdefault("MKL_NUM_THREADS", threads)
+        if devices:
+            env["CUDA_VISIBLE_DEVICES"] = str(devices[index % len(devices)])
+        log = open(shard_paths(index, count, shard_dir)["log"], "w", encoding="utf-8")
+        cmd = [sys.executable, script, *argv, "--shard", f"{index}/{count}"]
+        procs.append((subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT), log))
+    print(f"已启动 {count} 个评估进程，日志见 {shard_dir}/")
+
+    codes = []
+    try:
+        for index, (proc, log) in enumerate(procs):
+            codes.append(proc.wait())
+            log.close()
+            print(f"分片 {index}/{count} " + ("完成" if codes[-1] == 0 else f"失败（退出码 {codes[-1]}）"))
+    except KeyboardInterrupt:
+        # 子进程各自收到 SIGINT 并保存结果日志，之后可用 --resume 续跑
+        for proc, log in procs:
+            proc.wait()
+            log.close()
+        raise
+    return codes
@@ -0,0 +1,131 @@
+import os
+import queue
+import threading
+
+from PIL import Image, ImageOps
+
+from src.instrumentation import NullInstrumentation
+from src.metrics import iou, to_bbox_array
+from src.utils import draw_bbox
+
+VIS_MODES = ("all", "none", "failures", "every")
+VIS_FORMATS = {"png": "PNG", "jpg": "JPEG", "webp": "WEBP"}
+
+
+class VisualizationWriter:
+    """
+    后台可视化写入器：解码、画框、编码和保存都在工作线程中完成，推理循环只负责投递任务。
+
+    - mode: "all" 全部绘制；"none" 不绘制；"failures" 只绘制失败样本（IoU < failure_iou）；
+      "every" 每 every 个任务绘制一次；
+    - image_format: png / jpg / webp；
+    - max_side: 缩略图最长边（像素），None 表示保持原尺寸；
+    - queue_size: 待写入任务的队列上限。队列已满时 submit() 阻塞等待（背压），每张请求的结果图都会写出，
+      同时排队的解码图像数量有上限；
+    - drop_when_full: 显式开启后，队列已满时丢弃该任务（计入 dropped）而不是等待，
+      推理循环永远不会因为图像编码而阻塞，代价是部分结果图不会写出。
+    """
+
+    def __init__(self, out_dir="output", mode="all", every=1, image_format="png", max_side=None,
+                 workers=2, queue_size=32, failure_iou=0.5, drop_when_full=False):
+        if mode not in VIS_MODES:
+            raise ValueError(f"未知的可视化模式: {mode}")
+        if image_format not in VIS_FORMATS:
+            raise ValueError(f"未知的图像格式: {image_format}")
+        self.out_dir = out_dir
+        self.mode = mode
+        self.every = max(1, every)
+        self.image_format = image_format
+        self.max_side = max_side
+        self.failure_iou = failure_iou
+        self.drop_when_full = drop_when_full
+        # 埋点收集器：记录后台线程中绘制（vis_draw）和编码保存（vis_write）的耗时，由 run_evaluation 设置
+        self.instrumentation = NullInstrumentation()
+        self.written = 0
+        self.dropped = 0
+        self._submitted = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        if mode != "none":
+            os.makedirs(out_dir, exist_ok=True)
+            for _ in range(workers):
+                t = threading.Thread(target=self._worker, daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _wanted(self, pred_bbox, gt_bbox):
+        self._submitted += 1
+        if self.mode == "none":
+            return False
+        if self.mode == "every":
+            return (self._submitted - 1) % self.every == 0
+        if self.mode == "failures":
+            return iou(to_bbox_array([pred_bbox]), to_bbox_array([gt_bbox]))[0] < self.failure_iou
+        return True
+
+    def submit(self, img_id, image, pred_bbox, gt_bbox):
+        """
+        投递一个可视化任务，队列已满时等待（drop_when_full 时丢弃）。image 为该任务的 ImageHandle，
+        写入完成（或被跳过、丢弃）后由写入器负责 release()。
+        """
+        if not self._wanted(pred_bbox, gt_bbox):
+            image.release()
+            return
+        if not self.drop_when_full:
+            self._queue.put((img_id, image, pred_bbox, gt_bbox))
+            return
+        try:
+            self._queue.put_nowait((img_id, image, pred_bbox, gt_bbox))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            image.release()
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                self._queue.task_done()
+                return
+            img_id, image, pred_bbox, gt_bbox = task
+            try:
+                self._write(img_id, image, pred_bbox, gt_bbox)
+                with self._lock:
+                    self.written += 1
+            except Exception as e:
+                print(f"可视化写入失败 ({img_id}): {e}")
+            finally:
+                image.release()
+                self._queue.task_done()
+
+    def _write(self, img_id, image, pred_bbox, gt_bbox):
+        # 结果可视化（Pred=红色，GT=绿色）
+        # 写入器是图像的最后一个使用者：取走解码结果直接在上面绘制，不再复制整张原图
+        with self.instrumentation.span("vis_draw"):
+            raw_img = image.take_image()
+            full_size = raw_img.size
+            if self.max_side and max(full_size) > self.max_side:
+                # 直接缩放生成缩略图
+                canvas = ImageOps.contain(raw_img, (self.max_side, self.max_side), Image.Resampling.LANCZOS)
+            else:
+                canvas = raw_img
+            del raw_img
+            if self.image_format != "png" and canvas.mode not in ("RGB", "L"):
+                canvas = canvas.convert("RGB")
+
+            line_width = 3 if canvas.size == full_size else 2
+            canvas = draw_bbox(canvas, pred_bbox, label="Pred", color="red", line_width=line_width)
+            canvas = draw_bbox(canvas, gt_bbox, label="GT", color="lime", line_width=line_width)
+
+        with self.instrumentation.span("vis_write"):
+            save_path = os.path.join(self.out_dir, f"result_{img_id}.{self.image_format}")
+            canvas.save(save_path, format=VIS_FORMATS[self.image_format])
+
+    def close(self):
+        """等待队列中的任务全部写完并结束工作线程。"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []